@@ -0,0 +1,174 @@
+###################################
+# PROLOG SECTION
+# bench_normalize.py
+#
+# A benchmark of the parsing of post text in deconstructwp.py.
+# It times the old way, BeautifulSoup prettify followed by an
+# XML parse and, when that fails, a wrap in <div> and another
+# parse, against normalizeHTML in wptransform.py, over a corpus
+# of real posts.
+#
+# A corpus is a WordPress export file (Tools > Export in the
+# WordPress admin pages, a WXR file) or a directory of files
+# that each hold the raw text of one post.
+#
+# Usage:
+#  python bench_normalize.py [--repeat 5] corpus [corpus ...]
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import sys
+import os
+import time
+import argparse
+from xml.etree.ElementTree import *
+import wptransform
+
+# BeautifulSoup is only needed to time the old way
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+# namespace of the post text in a WordPress export file
+CONTENT_NS = "{http://purl.org/rss/1.0/modules/content/}encoded"
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to read the post texts of a corpus
+#
+def readCorpus(path):
+    texts = []
+    if os.path.isdir(path):
+        for dirpath,dirnames,filenames in os.walk(path):
+            for f in sorted(filenames):
+                fp = open(os.path.join(dirpath,f),"r",encoding="utf-8",errors="replace")
+                texts.append(fp.read())
+                fp.close()
+    else:
+        for event,e in iterparse(path):
+            if e.tag == CONTENT_NS:
+                if e.text:
+                    texts.append(e.text)
+                e.clear()
+
+    return texts
+
+#
+# Function to parse a post the old way
+#
+def oldNormalize(s):
+    soup = BeautifulSoup(s,"html.parser")
+    stext = soup.prettify()
+    try:
+        root = XML(stext)
+        if root.tag == "html":
+            bodye = root.find("body")
+            if not bodye == None:
+                bodye.tag = "div"
+                root = bodye
+    except:
+        root = fromstring("<div>"+stext+"</div>")
+    return root
+
+#
+# Function to parse a post with normalizeHTML
+#
+def newNormalize(s):
+    root,how = wptransform.normalizeHTML(s)
+    return root
+
+#
+# Function to parse a post with normalizeHTML, without lxml
+#
+def stdlibNormalize(s):
+    save = wptransform.lxml
+    wptransform.lxml = None
+    try:
+        root,how = wptransform.normalizeHTML(s)
+    finally:
+        wptransform.lxml = save
+    return root
+
+#
+# Function to time a parse function over the corpus. Returns
+# the best time of repeat passes, the number of posts that
+# could not be parsed and the size of the serialized output.
+#
+def timeParse(func,texts,repeat):
+    best = None
+    for i in range(repeat):
+        failed = 0
+        size = 0
+        start = time.perf_counter()
+        for s in texts:
+            try:
+                root = func(s)
+            except Exception:
+                failed = failed+1
+                continue
+            if i == 0:
+                size = size+len(tostring(root,encoding="unicode"))
+        t = time.perf_counter()-start
+        if i == 0:
+            out_size = size
+        if best == None or t<best:
+            best = t
+
+    return best,failed,out_size
+
+###################################
+# MAIN PROCESSING SECTION
+###################################
+
+parser = argparse.ArgumentParser(description="Time the parsing of post text")
+parser.add_argument("--repeat",type=int,default=5,help="passes over the corpus, the best is kept")
+parser.add_argument("corpus",nargs="+",help="WordPress export file or directory of post files")
+args = parser.parse_args()
+
+wptransform.setdebug(False)
+
+texts = []
+for c in args.corpus:
+    texts.extend(readCorpus(c))
+if len(texts)==0:
+    print("no posts in",args.corpus)
+    sys.exit(1)
+
+# count the posts each parser handles
+tiers = {}
+for s in texts:
+    try:
+        root,how = wptransform.normalizeHTML(s)
+    except Exception:
+        how = "failed"
+    tiers[how] = tiers.get(how,0)+1
+
+nbytes = sum(len(s) for s in texts)
+print("posts:",len(texts),"text bytes:",nbytes)
+print("parsed by normalizeHTML with:",", ".join(k+" "+str(tiers[k]) for k in sorted(tiers)))
+print()
+
+runs = []
+if not BeautifulSoup == None:
+    runs.append(("prettify + XML",oldNormalize))
+else:
+    print("bs4 is not installed, the old way is not timed")
+runs.append(("normalizeHTML",newNormalize))
+if not wptransform.lxml == None:
+    runs.append(("normalizeHTML no lxml",stdlibNormalize))
+
+base = None
+print("%-24s %10s %12s %8s %12s %8s" % ("parser","seconds","us/post","failed","out bytes","speedup"))
+for name,func in runs:
+    t,failed,size = timeParse(func,texts,args.repeat)
+    if base == None:
+        base = t
+    print("%-24s %10.3f %12.1f %8d %12d %7.2fx" % (name,t,t*1e6/len(texts),failed,size,base/t))
@@ -12,11 +12,27 @@
 #
 # Outputs:
 #  An XML manifest file (manifest.xml) that catalogs
-#  all the information extracted from the WordPress site.
+#  all the information extracted from the WordPress site,
+#  or with the manifestdb option a SQLite database with the
+#  same information.
 #
 #  A subdirectory for each content type containing one
 #  file for each node containing its text.
 #
+#  A JSON timing report (deconstructwp_timing.json) with the
+#  time and bytes of each phase of the run.
+#
+# With the watch option the script keeps running and polls the
+# site every watch seconds, each pass an incremental run that
+# also keeps the DITA output up to date, as the fused option
+# does. The connections, caches and worker processes are kept
+# from pass to pass, and so are the nodes of the manifest and
+# the ids of the posts on the site. Each pass reads the posts
+# and, with the medialibrary option, the media items added
+# since the pass before. An interrupt or termination signal stops
+# the watch between passes; a pass that is cut short can be
+# finished with --resume.
+#
 # Tested with Python 3.4.3
 # May 1, 2016
 #
@@ -31,24 +47,64 @@
 # import the common processing code
 from ditapub import *
 import datetime
+import itertools
+import queue
+import threading
+import concurrent.futures
+import collections
+import hashlib
+import asyncio
+from xml.sax.saxutils import escape
 import urllib.request
 import urllib.error
 import urllib.parse
-from bs4 import BeautifulSoup
+import http.client
+import httppool
+import mediacache
+import wpcassette
+import ratecontrol
+import journal
+import wprpc
+import wpmanifest
+import wptransform
+import wptiming
+import sitecache
+import wplayout
+import poststore
+import wpdita
+import shortcodes
+import atexit
+import signal
 from PIL import Image
 from xml.etree.ElementTree import *
 
-# file object for the web site error log file
+# file object for the web site error log file, and how to open
+# it, the log is appended to once it was started
 log_fileobj = None
+log_mode = "w"
+# lock so download threads can share the error log
+log_lock = threading.Lock()
 
 blogid = 1
 
 UNCAT = "Uncategorized"
-SGALLERY = "[gallery "
-SCAPTION = "[caption "
 FEATURED_IMAGE = "featured"
+IMAGE_TOKEN = wptransform.IMAGE_TOKEN
 
 user_dict = {}
+# media library items by attachment id and by url, and the
+# ids the site would not return
+media_by_id = {}
+media_by_url = {}
+media_missing = set()
+# number of XML-RPC calls that failed
+rpc_failures = 0
+# the ids of the posts and pages on the site by type, kept
+# between the passes of a watch, None until they are listed
+site_ids = {"post":None,"page":None}
+# the [type,hash,path] of the nodes written in a pass of a watch
+# by post id
+pass_nodes = {}
 
 ###################################
 # FUNCTION DEFINITION SECTION
@@ -60,16 +116,37 @@ user_dict = {}
 #
 def webErrorLog(*s):
     global log_fileobj
+    global log_mode
     log_file = "deconstructError.log"
         
-    if log_fileobj == None:
-        log_fileobj = open(log_file, "w")
+    with log_lock:
+        if log_fileobj == None:
+            log_fileobj = open(log_file, log_mode)
+            log_mode = "a"
 
-    print(s, file=log_fileobj)
-    print("***webErrorLog:",s)
+        print(s, file=log_fileobj)
+        print("***webErrorLog:",s)
 
     return
 
+#
+# Function to report an XML-RPC call that failed. The run
+# goes on without what the call would have returned.
+#
+def reportRPCError(what,err):
+    global rpc_failures
+    if isinstance(err,xmlrpc.client.Fault):
+        wprpc.printFault(err)
+        s = "fault "+str(err.faultCode)+" "+err.faultString
+    elif isinstance(err,xmlrpc.client.ProtocolError):
+        wprpc.printProtocolError(err)
+        s = "protocol error "+str(err.errcode)+" "+err.errmsg
+    else:
+        s = repr(err)
+    with log_lock:
+        rpc_failures = rpc_failures+1
+    webErrorLog("Error, XML-RPC call failed:",what,s)
+
 #
 # Function to close the web site error log
 #
@@ -150,120 +227,407 @@ def getCategory(p):
     return cdef
 
 #
-# Function to get information about a user id
+# Function to get information about a user id. Returns None
+# if the site would not return the user.
 #
 def getWPUser(id):
     if debugMode():
         print("getWPUser",id)
 
-    sendf=False
-    for i in range(get_maxretry()):
-            try:
-                ret=proxy.wp.getUser(blogid,get_user(),get_password(),id)
-                sendf=True
-                break;
-            except xmlrpc.client.Fault as err:
-                print("A fault occurred")
-                print("Fault code: %d" % err.faultCode)
-                print("Fault string: %s" % err.faultString)
-                exit(0)
-            except xmlrpc.client.ProtocolError as err:
-                print("A protocol error occurred")
-                print("URL: %s" % err.url)
-                print("HTTP/HTTPS headers: %s" % err.headers)
-                print("Error code: %d" % err.errcode)
-                print("Error message: %s" % err.errmsg)
-                exit(0)
-
-            except:
-                errCnt()
-                print(" WordPress XMLRPC error!",i+1)
-                ret="WordPress XMLRPC error"
-                time.sleep(get_retrysleep())
-
-    if not sendf:
-        ret=proxy.wp.wp.getUser(blogid,get_user(),get_password(),id)
+    try:
+        ret = wprpc.runAsync(wprpc.acall("wp.getUser",blogid,get_user(),get_password(),id)).result()
+    except Exception as err:
+        reportRPCError("wp.getUser "+str(id),err)
+        return None
         
     # return the user structure
     return ret
 
 #
-# Function to get all WordPress posts
+# Coroutine to look up the display names of a list of user ids
+# in one batch and add them to user_dict. A user the site will
+# not return is left for getWPUser to report, and so are all
+# the users of a batch that failed.
 #
-def getWPposts(ptype):
+async def getWPUsers(ids):
     if debugMode():
-        print("getWPposts",blogid)
+        print("getWPUsers",ids)
+
+    calls = []
+    for id in ids:
+        calls.append(("wp.getUser",(blogid,get_user(),get_password(),id)))
+    try:
+        rets = await wprpc.abatch(calls)
+    except Exception as err:
+        print("Note, the batch of",len(ids),"users could not be read:",err)
+        return
+    for id,ret in zip(ids,rets):
+        if not isinstance(ret,xmlrpc.client.Fault):
+            user_dict[id] = ret['display_name']
+
+#
+# Coroutine to read all the users of the site into user_dict
+#
+async def readUsersAsync():
+    async def deliver(page):
+        for u in page:
+            user_dict[str(u['user_id'])] = u['display_name']
+        return True
+
+    def makeCall(offset,number):
+        f = {"number":number,"offset":offset}
+        return ("wp.getUsers",(blogid,get_user(),get_password(),f,["basic"]))
+
+    await readWindows(makeCall,pagesize,deliver)
+
+#
+# Coroutine to read all the terms of a taxonomy into the site
+# cache
+#
+async def readTermsAsync(taxonomy):
+    async def deliver(page):
+        for t in page:
+            sitecache.addTerm(t)
+        return True
+
+    def makeCall(offset,number):
+        f = {"number":number,"offset":offset}
+        return ("wp.getTerms",(blogid,get_user(),get_password(),taxonomy,f))
+
+    await readWindows(makeCall,pagesize,deliver)
+
+#
+# Function to read the users and the category and tag terms of
+# the site before the posts, so the posts need no lookups. A
+# site that will not list them leaves the cache of the last run
+# and the lookups of single users to fill in.
+#
+def prefetchSite():
+    if debugMode():
+        print("prefetchSite")
+
+    what = ("users","categories","tags")
+    calls = (readUsersAsync(),readTermsAsync("category"),readTermsAsync("post_tag"))
+
+    async def readAll():
+        return await asyncio.gather(*calls,return_exceptions=True)
+
+    rets = wprpc.runAsync(readAll()).result()
+    for w,ret in zip(what,rets):
+        if isinstance(ret,Exception):
+            print("Note, the",w,"of the site could not be listed:",ret)
+
+#
+# Function to make the directories of the categories known from
+# the site cache before any post arrives
+#
+def makeCategoryDirs():
+    names = [t["name"].replace(" ","_") for t in sitecache.getTerms("category").values()]
+    names.append("StaticPages")
+    for c in names:
+        if not c in catdirs:
+            catdirs[c] = outdir+os.sep+c
+            os.makedirs(catdirs[c],exist_ok=True)
+
+#
+# Coroutine to read a list from the site in windows of number
+# items. makeCall(offset,number) returns the (method,args) of
+# the call for the window at offset. Groups of batchwindows
+# windows go in one batch, and up to the XML-RPC concurrency
+# of groups are in flight at once, so the windows are requested
+# ahead of the one being delivered. Each window is passed in
+# order to the coroutine deliver, which returns False to stop.
+# The windows stop at the first short window.
+#
+async def readWindows(makeCall,number,deliver):
+    pending = collections.deque()
+    offset = 0
+    more = True
+    try:
+        while more:
+            # keep the next groups of windows in flight
+            while len(pending)<wprpc.get_concurrency():
+                calls = []
+                for i in range(batchwindows):
+                    calls.append(makeCall(offset,number))
+                    offset = offset+number
+                pending.append(asyncio.ensure_future(wprpc.abatch(calls)))
+            pages = await pending.popleft()
+            for page in pages:
+                if isinstance(page,xmlrpc.client.Fault):
+                    raise page
+                if not await deliver(page) or len(page)<number:
+                    more = False
+                    break
+    finally:
+        # drop the windows past the end
+        for fut in pending:
+            fut.cancel()
+
+#
+# Function to return the (method,args) of a wp.getPosts call
+# for a window of posts matching the query qarg. If fields is
+# given only those fields are returned.
+#
+def postsCall(qarg,offset,number,fields=None):
+    q = dict(qarg)
+    q["number"] = number
+    q["offset"] = offset
+    args = [blogid,get_user(),get_password(),q]
+    if not fields == None:
+        args.append(fields)
+    return ("wp.getPosts",args)
+
+#
+# Coroutine to read pages of posts until a short page comes
+# back, or until the posts are older than since, and put each
+# page on the queue for the main thread. The new authors of
+# each page are looked up before the page is handed over. None
+# marks the end of the posts.
+#
+async def readPostsAsync(qarg,since,q):
+    loop = asyncio.get_running_loop()
+
+    async def deliver(page):
+        # look up the new authors of these posts in one batch
+        authors = []
+        for p in page:
+            if not p['post_author'] in user_dict and not p['post_author'] in authors:
+                authors.append(p['post_author'])
+        if len(authors)>0:
+            await getWPUsers(authors)
+        await loop.run_in_executor(None,q.put,page)
+        if not since == None and len(page)>0 and str(page[-1]["post_modified"])<since:
+            return False
+        return True
+
+    try:
+        makeCall = lambda offset,number: postsCall(qarg,offset,number)
+        await readWindows(makeCall,pagesize,deliver)
+    except Exception as err:
+        reportRPCError("wp.getPosts "+qarg["post_type"],err)
+    await loop.run_in_executor(None,q.put,None)
+
+#
+# Generator function to return the posts read ahead on the
+# event loop, skipping any post seen twice because the site
+# changed while we were paging, and any post not modified
+# since the since watermark.
+#
+def streamPosts(q,since):
+    seen = set()
+    while True:
+        page = q.get()
+        if page == None:
+            return
+        for p in page:
+            if p["post_id"] in seen:
+                continue
+            if not since == None and str(p["post_modified"])<since:
+                continue
+            seen.add(p["post_id"])
+            yield p
+
+#
+# Function to get all WordPress posts of a type. The posts are
+# read in windows of pagesize on the event loop so later pages
+# are in flight while the caller processes earlier ones.
+# If since is given, only the posts modified at or after that
+# time are returned, newest modification first.
+# Returns a generator of posts.
+#
+def getWPposts(ptype,since=None):
+    if debugMode():
+        print("getWPposts",blogid,ptype,since)
+
+    qarg = {"post_type":ptype}
+    if not since == None:
+        qarg["orderby"] = "modified"
+        qarg["order"] = "DESC"
+
+    q = queue.Queue(readahead)
+    wprpc.runAsync(readPostsAsync(qarg,since,q))
+
+    return streamPosts(q,since)
+
+#
+# Function to get the ids of all the WordPress posts of a type,
+# used to find posts deleted from the site since the last run.
+# Returns None if the ids could not all be read.
+#
+def getWPpostIds(ptype):
+    if debugMode():
+        print("getWPpostIds",ptype)
+
+    ids = set()
+    qarg = {"post_type":ptype}
+
+    async def deliver(page):
+        for p in page:
+            ids.add(p["post_id"])
+        return True
+
+    makeCall = lambda offset,number: postsCall(qarg,offset,number,["post_id"])
+    try:
+        wprpc.runAsync(readWindows(makeCall,pagesize,deliver)).result()
+    except Exception as err:
+        reportRPCError("wp.getPosts "+ptype+" ids",err)
+        return None
+
+    return ids
+
+#
+# Function to get the ids of the posts of a type on the site for
+# a later pass of a watch. The ids kept from the pass before,
+# with the ids listed in this pass, seen, are the ids on the site
+# if the site has as many posts as that, which the window of two
+# posts at the end of the ids tells. Otherwise the ids are listed
+# again with getWPpostIds. Returns None if the ids could not all
+# be read.
+#
+def sitePostIds(ptype,seen):
+    if debugMode():
+        print("sitePostIds",ptype,len(seen))
+
+    ids = site_ids[ptype]
+    if not ids == None:
+        ids = ids|seen
+        method,args = postsCall({"post_type":ptype},max(len(ids)-1,0),2,["post_id"])
+        try:
+            last = wprpc.runAsync(wprpc.acall(method,*args)).result()
+        except Exception as err:
+            reportRPCError("wp.getPosts "+ptype+" count",err)
+            return None
+        if len(last) == min(len(ids),1):
+            site_ids[ptype] = ids
+            return ids
+        print("the site does not have",len(ids),ptype+"s, listing them again")
+
+    ids = getWPpostIds(ptype)
+    site_ids[ptype] = ids
+    return ids
+
+#
+# Function to compute a hash of the post fields that end up
+# in the archive, used to tell if a post really changed
+#
+def postHash(p):
+    h = hashlib.sha256()
+    for k in ("post_title","post_name","post_author","post_content","link","post_date"):
+        h.update(str(p.get(k)).encode("utf-8"))
+        h.update(b"\0")
+    for t in p.get("terms",[]):
+        h.update(str(t.get("taxonomy")).encode("utf-8"))
+        h.update(str(t.get("name")).encode("utf-8"))
+        h.update(b"\0")
+    pthumb = p.get("post_thumbnail")
+    if pthumb:
+        h.update(str(pthumb.get("thumbnail")).encode("utf-8"))
+    return h.hexdigest()
+
+#
+# Function to read the manifest of the last run for an
+# incremental run, a node at a time. Returns the watermark,
+# the category directories and the [type,hash,path] of the
+# nodes by post id, or None if there is no usable manifest.
+#
+def readManifest(f):
+    if debugMode():
+        print("readManifest",f)
+
+    if not os.path.exists(f):
+        print("no manifest",f,"from a previous run")
+        return None
+
+    try:
+        ret = wpmanifest.scanManifest(f)
+    except:
+        print("Error, could not parse",f)
+        return None
+
+    if ret[0] == None:
+        print(f,"has no modification watermark")
+        return None
 
-    qarg = {"post_type":ptype,"number":500}
-    
-    sendf=False
-    for i in range(get_maxretry()):
-            try:
-                ret=proxy.wp.getPosts(blogid,get_user(),get_password(),qarg)
-                sendf=True
-                break;
-            except xmlrpc.client.Fault as err:
-                print("A fault occurred")
-                print("Fault code: %d" % err.faultCode)
-                print("Fault string: %s" % err.faultString)
-                exit(0)
-            except xmlrpc.client.ProtocolError as err:
-                print("A protocol error occurred")
-                print("URL: %s" % err.url)
-                print("HTTP/HTTPS headers: %s" % err.headers)
-                print("Error code: %d" % err.errcode)
-                print("Error message: %s" % err.errmsg)
-                exit(0)
-
-            except:
-                errCnt()
-                print(" WordPress XMLRPC error!",i+1)
-                ret="WordPress XMLRPC error"
-                time.sleep(get_retrysleep())
-
-    if not sendf:
-        ret=proxy.wp.wp.getPosts(blogid,get_user(),get_password().qarg)
-        
-    # return the posts content structure
     return ret
 
 #
-# Function to get WordPress media library information
+# Function to add a media library item to the media index,
+# by its attachment id and by the urls of the original and
+# of each of its sizes
+#
+def indexMedia(m):
+    media_by_id[m['attachment_id']] = m
+    link = m.get('link')
+    if not link:
+        return
+    media_by_url[normalizeURL(link)] = m
+    mdata = m.get('metadata')
+    if not isinstance(mdata,dict):
+        return
+    msizes = mdata.get('sizes')
+    if not isinstance(msizes,dict):
+        return
+    for size in msizes.values():
+        if 'file' in size:
+            media_by_url[normalizeURL(os.path.dirname(link)+'/'+size['file'])] = m
+
+#
+# Function to get WordPress media library information. The
+# library is read in windows of pagesize items, several at a
+# time, and each window is added to the media index as it
+# arrives. If since is given only the items added at or after
+# that time are read, the library lists the newest items first.
+# Returns the number of media items read.
 #
-def getWPMediaLibrary():
+def getWPMediaLibrary(since=None):
     if debugMode():
-        print("getWPMediaLibrary")
-
-    sendf=False
-    for i in range(get_maxretry()):
-            try:
-                ret=proxy.wp.getMediaLibrary(blogid,get_user(),get_password())
-                sendf=True
-                break;
-            except xmlrpc.client.Fault as err:
-                print("A fault occurred")
-                print("Fault code: %d" % err.faultCode)
-                print("Fault string: %s" % err.faultString)
-                exit(0)
-            except xmlrpc.client.ProtocolError as err:
-                print("A protocol error occurred")
-                print("URL: %s" % err.url)
-                print("HTTP/HTTPS headers: %s" % err.headers)
-                print("Error code: %d" % err.errcode)
-                print("Error message: %s" % err.errmsg)
-                exit(0)
-
-            except:
-                errCnt()
-                print(" WordPress XMLRPC error!",i+1)
-                ret="WordPress XMLRPC error"
-                time.sleep(get_retrysleep())
-
-    if not sendf:
-        ret=proxy.wp.wp.getMediaLibrary(blogid,get_user(),get_password())
+        print("getWPMediaLibrary",since)
+
+    ret = []
+
+    async def deliver(page):
+        for m in page:
+            if not since == None and str(m["date_created_gmt"])<since:
+                return False
+            indexMedia(m)
+            ret.append(m)
+        return True
+
+    def makeCall(offset,number):
+        f = {"number":number,"offset":offset}
+        return ("wp.getMediaLibrary",(blogid,get_user(),get_password(),f))
+
+    try:
+        wprpc.runAsync(readWindows(makeCall,pagesize,deliver)).result()
+    except Exception as err:
+        reportRPCError("wp.getMediaLibrary",err)
         
-    # return the media content structure
-    return ret
+    # return the number of media items
+    return len(ret)
+
+#
+# Function to get media items missing from the media index
+# in one batch and add them to it
+#
+def getWPMediaItems(ids):
+    if debugMode():
+        print("getWPMediaItems",ids)
+
+    calls = []
+    for id in ids:
+        calls.append(("wp.getMediaItem",(blogid,get_user(),get_password(),id)))
+    try:
+        rets = wprpc.runAsync(wprpc.abatch(calls)).result()
+    except Exception as err:
+        reportRPCError("wp.getMediaItem",err)
+        return
+    for id,ret in zip(ids,rets):
+        if isinstance(ret,xmlrpc.client.Fault):
+            print("Error!, media item",id,"not found:",ret.faultString)
+            media_missing.add(id)
+        else:
+            indexMedia(ret)
 
 #
 # Function to get the thumbnail URL for a media id
@@ -274,39 +638,39 @@ def getMediaThumbURL(id):
 
     url = None
     
-    for m in MediaLib:
-        if id==m['attachment_id']:
-            mdata = m['metadata']
-            link = m['link']
-            msizes = mdata['sizes']
-            mimage = msizes['thumbnail']['file']
-            url = os.path.dirname(link)+'/'+mimage
+    m = media_by_id.get(id)
+    if not m == None:
+        mdata = m['metadata']
+        link = m['link']
+        msizes = mdata['sizes']
+        mimage = msizes['thumbnail']['file']
+        url = os.path.dirname(link)+'/'+mimage
 
     if url==None:
         print("Error!, link for",id,"not found")
 
     return url
 #
-# Function to map an image uri to a unique filename
+# Function to normalize an image url so every reference
+# to the same upload maps to a single download. The path
+# is kept unquoted, storeImage quotes it when fetching.
 #
-def mapFname(uri):
-    global file_ident
-    
+def normalizeURL(u):
     if debugMode():
-        print("mapFname",uri)
-    
-    base = os.path.basename(uri)
+        print("normalizeURL",u)
 
-    p = base.find(".")
-    
-    ret = base[0:p]+"_"+str(file_ident)+base[p:]
+    parts = urllib.parse.urlsplit(u.strip())
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    # drop default ports
+    if scheme == "http" and host.endswith(":80"):
+        host = host[:-3]
+    if scheme == "https" and host.endswith(":443"):
+        host = host[:-4]
+    path = urllib.parse.unquote(parts.path)
 
-    # replace umlauts
-    ret = ret.replace("ü","ue")
-    
-    file_ident = file_ident+1
-    
-    return ret
+    # the fragment never reaches the server
+    return urllib.parse.urlunsplit((scheme,host,path,parts.query,""))
 
 #
 # Function to empty a directory
@@ -326,8 +690,8 @@ def EmptyDir(d):
                 print("  removed",ff)
     else:
         os.mkdir(d)
-    # delete any subdirectories
-    dirs = os.walk(d)
+    # delete any subdirectories, the deepest first
+    dirs = os.walk(d,topdown=False)
     for dd in dirs:
         for ddir in dd[1]:
           os.rmdir(dd[0]+os.sep+ddir)
@@ -335,7 +699,9 @@ def EmptyDir(d):
     print("all files deleted from",d)
     
 #
-# Function to list the supported XMLRPC methods
+# Function to list the supported XMLRPC methods. A site that
+# will not list them is reported and taken to support none of
+# the optional ones.
 #
 def listMethods():
     if debugMode():
@@ -343,18 +709,9 @@ def listMethods():
         
     try:
        ret=proxy.system.listMethods()
-    except xmlrpc.client.Fault as err:
-        print("A fault occurred")
-        print("Fault code: %d" % err.faultCode)
-        print("Fault string: %s" % err.faultString)
-        exit(0)
-    except xmlrpc.client.ProtocolError as err:
-        print("A protocol error occurred")
-        print("URL: %s" % err.url)
-        print("HTTP/HTTPS headers: %s" % err.headers)
-        print("Error code: %d" % err.errcode)
-        print("Error message: %s" % err.errmsg)
-        exit(0)
+    except (xmlrpc.client.Fault,xmlrpc.client.ProtocolError) as err:
+        reportRPCError("system.listMethods",err)
+        return []
 
 
 
@@ -366,8 +723,42 @@ def listMethods():
     return ret
 
 
+#
+# Function to return the url an image is fetched from,
+# using the absolute or relative url
+#
+def imageURL(ipath,url):
+    return urllib.parse.urljoin(url+"/",ipath)
+
+#
+# Function to fetch a url into the file at path with
+# httppool.fetchURL, trying again after the backoff of the rate
+# controller of the host when the site is busy, the request
+# times out or the connection fails
+#
+def fetchRetry(url,path,hdrs=None,timeout=30):
+    for i in range(get_maxretry()+1):
+        try:
+            return httppool.fetchURL(url,path,hdrs,timeout)
+        except urllib.error.HTTPError as e:
+            if i>=get_maxretry() or not ratecontrol.retryable(e.code):
+                raise
+            wait = ratecontrol.getController(url).backoff(i,ratecontrol.retryAfter(e.headers))
+            print(" image request busy",e.code,"trying again in %.1fs" % wait)
+        except (urllib.error.URLError,OSError,http.client.HTTPException) as e:
+            if i>=get_maxretry():
+                raise
+            wait = ratecontrol.getController(url).backoff(i)
+            print(" image request error",e,"trying again in %.1fs" % wait)
+        errCnt()
+        time.sleep(wait)
+
 #
 # Function to retrieve an image from the site and store it in a file.
+# The image is read over a pooled keep-alive connection. If the
+# image is in the media cache a conditional GET is sent and a
+# 304 answer reuses the cached bytes.
+# Returns the SHA-256 hash of the image, or None on failure.
 #
 def storeImage(imgpath,ipath,url,idir):
     if debugMode():
@@ -375,34 +766,342 @@ def storeImage(imgpath,ipath,url,idir):
     
     timeout = 10
     # set url to fetch the image from using absolute or relative url
-    if not "http:" in ipath:
-        fpath = url+ipath
-    else:
-        fpath = ipath
+    fpath = imageURL(ipath,url)
     # set the location to store the image on disk
     iipath = idir+os.sep+imgpath
 
     # encode any unicode characters
     ufpath = formatURL(fpath)
     
+    start = time.perf_counter()
     try:
       # read the url into a disk file
-      uret = urllib.request.urlretrieve(ufpath,iipath)
-      if debugMode():
-          print("image",iipath,"stored")
+      hdrs = mediacache.validators(fpath)
+      uret = fetchRetry(ufpath,iipath,hdrs,timeout)
+      if uret["status"] == 304:
+          uret["sha256"] = mediacache.restore(fpath,iipath)
+          if uret["sha256"] == None:
+              # the cached copy went away, read it again
+              uret = fetchRetry(ufpath,iipath,timeout=timeout)
+          elif debugMode():
+              print("image",iipath,"not modified, using cached copy")
+      if uret["status"] == 200:
+          mediacache.update(fpath,iipath,uret["sha256"],uret["headers"])
+          if debugMode():
+              print("image",iipath,"stored",uret["bytes"],"bytes")
 
     except urllib.error.URLError as e:
       webErrorLog(" storeImage URL error",e)
       webErrorLog("  URL:",fpath)
-      return False
+      wptiming.addSample("image download",time.perf_counter()-start,0,fpath)
+      return None
 
     except:
       webErrorLog(" storeImage other error",ufpath)
       webErrorLog("  args:",imgpath,ipath,url,idir)
-      return False
+      wptiming.addSample("image download",time.perf_counter()-start,0,fpath)
+      return None
         
+    wptiming.addSample("image download",time.perf_counter()-start,uret["bytes"],fpath)
         
-    return True
+    return uret["sha256"]
+
+#
+# Function to return the semaphore that limits the number
+# of downloads running at the same time against one host
+#
+def hostSlot(fpath):
+    host = urllib.parse.urlsplit(fpath).netloc
+    with host_lock:
+        if not host in host_slots:
+            host_slots[host] = threading.BoundedSemaphore(hostconnections)
+        return host_slots[host]
+
+#
+# Function run by a download thread to store one image.
+# The image is read into a temporary file and then renamed
+# to its content hash, so identical images share one file.
+# Returns the stored file name, or None if the download failed.
+#
+def fetchImage(nurl,idir):
+    tmpname = ".download_"+str(next(temp_ident))
+    tmppath = idir+os.sep+tmpname
+
+    with hostSlot(nurl):
+        ihash = storeImage(tmpname,nurl,"",idir)
+
+    if ihash == None:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        return None
+
+    ext = os.path.splitext(urllib.parse.urlsplit(nurl).path)[1].lower()
+    fname = ihash+ext
+    ipath = imageFile(fname)
+    wplayout.makeDir(os.path.dirname(ipath))
+    os.replace(tmppath,ipath)
+    # a rename onto a hard link of the same file does nothing
+    if os.path.exists(tmppath):
+        os.remove(tmppath)
+    journal.journalImage(nurl,fname)
+    if debugMode():
+        print("image",nurl,"stored as",fname)
+
+    return fname
+
+#
+# Function to return the path of a stored image file in the
+# layout of the run
+#
+def imageFile(fname):
+    return imagedir+os.sep+wplayout.imageRelPath(layout,fname).replace("/",os.sep)
+
+#
+# Function to queue an image download on the download pool.
+# Each normalized url is only downloaded once per run, later
+# references get the future of the first download.
+#
+def queueImage(ipath,url,idir):
+    global image_pool
+    global image_refs
+    if debugMode():
+        print("queueImage:",ipath)
+
+    image_refs = image_refs+1
+    nurl = normalizeURL(imageURL(ipath,url))
+    if nurl in image_store:
+        return image_store[nurl]
+
+    if image_pool == None:
+        image_pool = concurrent.futures.ThreadPoolExecutor(max_workers=imageworkers)
+
+    fut = image_pool.submit(fetchImage,nurl,idir)
+    image_store[nurl] = fut
+
+    return fut
+
+#
+# Function to hold a post until it is transformed and its
+# images are stored. transform is the future of the result
+# of wptransform.transformPost for the post.
+#
+def queuePost(transform,fpath,ptitle,featured,pcat,ne):
+    rec = {"transform":transform,"text":None,"path":fpath,"title":ptitle}
+    # category and manifest node, for the journal
+    rec["ctype"] = pcat
+    rec["node"] = ne
+    # list of [future,original src] for the img elements,
+    # filled in when the transform is done
+    rec["images"] = None
+    # [manifest image element,future,original uri] or None
+    rec["featured"] = featured
+    pending_posts.append(rec)
+
+#
+# Function to take the result of the transform of a post and
+# queue the images it references. The post text has
+# IMAGE_TOKEN placeholders in place of the img src values.
+#
+def takeTransform(rec):
+    ret = rec["transform"].result()
+    wptiming.addSample("transform",ret["seconds"],0,rec["path"])
+    for note in ret["notes"]:
+        print(note)
+    rec["text"] = ret["text"]
+    rec["transform"] = None
+
+    srcs = ret["srcs"]
+    if len(srcs)>0:
+        print(" post has",len(srcs),"image references")
+    images = []
+    for isrc,srcset in zip(srcs,ret["srcsets"]):
+        # queue the image, or a smaller rendition of it, to be
+        # read and stored, the src is set to the stored file
+        # when the post is written
+        fut = queueImage(chooseRendition(isrc,srcset),WordPressurl,imagedir)
+        images.append([fut,isrc])
+        if debugMode():
+            print("  store referenced image",isrc)
+    rec["images"] = images
+
+#
+# Function to take the results of the transforms that are
+# done, in post order, so their images start downloading
+#
+def collectTransforms():
+    for rec in pending_posts:
+        if rec["images"] == None and rec["transform"].done():
+            takeTransform(rec)
+
+#
+# Function to write out the queued posts that are transformed
+# and whose images have all been stored, in the order the posts
+# were read. If wait is True, wait for the transforms and the
+# downloads until no more than keep posts are left queued.
+#
+def finishPosts(wait,keep=0):
+    global total_nodes
+
+    collectTransforms()
+    while len(pending_posts)>keep:
+        rec = pending_posts[0]
+        if rec["images"] == None:
+            if not wait and not rec["transform"].done():
+                return
+            takeTransform(rec)
+        futs = [i[0] for i in rec["images"]]
+        if not rec["featured"] == None:
+            futs.append(rec["featured"][1])
+        if wait:
+            concurrent.futures.wait(futs)
+        else:
+            for fut in futs:
+                if not fut.done():
+                    return
+        pending_posts.popleft()
+
+        fpath = rec["path"]
+        failures = False
+
+        # point the img elements at the stored images
+        def newSrc(m):
+            nonlocal failures
+            fut,isrc = rec["images"][int(m.group(1))]
+            fname = fut.result()
+            if fname == None:
+                failures = True
+                nsrc = isrc
+            else:
+                nsrc = os.path.dirname(isrc)+"/"+fname
+            return '"'+escape(nsrc,{'"':"&quot;"})+'"'
+        stext = re.sub('"'+IMAGE_TOKEN+'([0-9]+)"',newSrc,rec["text"])
+
+        # fill in the featured image
+        if not rec["featured"] == None:
+            ie,fut,pimage = rec["featured"]
+            fname = fut.result()
+            if fname == None:
+                failures = True
+                ie.set("filename",imagedir+"/"+os.path.basename(pimage))
+            else:
+                impath = imagedir+"/"+wplayout.imageRelPath(layout,fname)
+                ie.set("filename",impath)
+                im = Image.open(impath)
+                ie.set("height",str(im.size[1]))
+                ie.set("width",str(im.size[0]))
+                im.close()
+
+        if failures:
+            webErrorLog("image failures in",fpath,rec["title"])
+
+        # write out the text to a file or the post store
+        print(" writing",fpath)
+        with wptiming.Timer("file write",fpath):
+            if post_store == None:
+                f = open(fpath,"w")
+                f.write(stext)
+                f.close()
+            else:
+                poststore.writePost(fpath,stext)
+        total_nodes = total_nodes+1
+        if fused:
+            # make the DITA topic from the text in the topic
+            # process, the post is journaled when it is done
+            fnames = [i[0].result() for i in rec["images"] if not i[0].result() == None]
+            if not rec["featured"] == None and not rec["featured"][1].result() == None:
+                fnames.append(rec["featured"][1].result())
+            fut = dita_pool.submit(wpdita.makeTopic,rec["ctype"],rec["node"],stext,
+                                   [(imageFile(f),f) for f in fnames])
+            dita_topics.append((fut,rec["ctype"],rec["node"]))
+            collectTopics(False)
+        else:
+            journal.journalPost(rec["ctype"],catdirs[rec["ctype"]],rec["node"])
+        with wptiming.Timer("manifest write"):
+            writeManifestNode(rec["ctype"],rec["node"])
+
+#
+# Function to write the node of a finished post to the manifest.
+# A watch keeps its type, hash and path for the next pass.
+#
+def writeManifestNode(ctype,node):
+    wpmanifest.writeNode(ctype,catdirs[ctype],node)
+    if watch>0:
+        pass_nodes[node.get("id")] = [ctype,node.get("hash"),node.get("path")]
+
+#
+# Function to journal the posts whose DITA topics are made. If
+# wait is True all the topics are waited for, otherwise only
+# the oldest if too many are queued.
+#
+def collectTopics(wait):
+    while len(dita_topics)>0:
+        fut,ctype,node = dita_topics[0]
+        if not wait and not fut.done() and len(dita_topics)<=post_backlog:
+            return
+        dita_topics.popleft()
+        seconds,hrefs = fut.result()
+        wptiming.addSample("dita topic",seconds,0,node.get("path"))
+        wpdita.addNodeLinks(node.get("id"),hrefs)
+        journal.journalPost(ctype,catdirs[ctype],node)
+
+#
+# Function to remove the DITA topic of a post
+#
+def removeTopic(ctype,pid):
+    tpath = wpdita.topicPath(ctype,pid)
+    if os.path.exists(tpath):
+        print("removing",tpath)
+        os.remove(tpath)
+        topic_dirs.add(os.path.dirname(tpath))
+    wpdita.addNodeLinks(pid,[])
+
+#
+# Function to write the DITA maps of a fused run from the
+# finished manifest. The topics with links to posts that were
+# not known when they were made are made again. After the first
+# pass of a watch only the maps changed by the pass are written.
+# Returns the number of topics made again.
+#
+def writeDITAMaps():
+    if debugMode():
+        print("writeDITAMaps")
+
+    # the map entries of the pass before
+    last_nodes = dict(wpdita.node_data)
+    root = wpdita.readManifest(xml_file)
+    relink = wpdita.relinkNodes()
+    ctps = []
+    for ctype in root.findall("ctype"):
+        ctp = ctype.get("type")
+        ctps.append(ctp)
+        for node in wpdita.ctypeNodes(ctype):
+            wpdita.addNode(ctp,node)
+            if node.get("id") in relink:
+                wpdita.writeTopic(ctp,node)
+    if npass == 0:
+        wpdita.writeMaps(ctps)
+    else:
+        touched = wpdita.changedMaps(last_nodes)
+        print(sum(len(y) for y in touched.values()),"year maps of",len(touched),"content types changed")
+        if len(touched)>0:
+            wpdita.writeMaps(ctps,touched)
+    wpdita.closeManifest()
+    wpdita.webErrorLogClose()
+    # the topic process is done, drop the topic directories that
+    # are left empty
+    for d in topic_dirs:
+        if os.path.isdir(d) and len(os.listdir(d)) == 0:
+            os.rmdir(d)
+    topic_dirs.clear()
+
+    return len(relink)
+
+#
+# Function to stop a watch on a termination signal the way an
+# interrupt does
+#
+def stopWatch(signum,frame):
+    raise KeyboardInterrupt()
 
 #
 # Function to format a dictionary
@@ -416,207 +1115,453 @@ def formatDict(d):
         print(d)
 
 #
-# Function to expand gallery short codes like [gallery ids="17,16,15,14"]
+# Function to look up the media ids missing from the media
+# index in one batch
 #
-def expandGallery(s):
-    if debugMode():
-        print("expandGallery:",s)
-        
-    # get start of gallery
-    i = s.find(SGALLERY)
+def lookupMedia(ilist):
+    missing = []
+    for il in ilist:
+        if not il in media_by_id and not il in media_missing and not il in missing:
+            missing.append(il)
+    if len(missing)>0:
+        with wptiming.Timer("media library"):
+            getWPMediaItems(missing)
 
-    if i<0:
-        print("expandGallery found no gallery!")
-        print(s)
-        exit(0)
+#
+# Function to choose the rendition of an image to download. The
+# renditions are those in the srcset of the img and the sizes of
+# its media item, if it is in the media index. When the src is a
+# rendition wider than imagewidth, the width manifest2ditawp.py
+# scales the images to, the smallest rendition at least
+# imagewidth wide is read instead. Otherwise, or if no rendition
+# is wide enough, the src is read as it is.
+#
+def chooseRendition(isrc,srcset):
+    global rendition_count
+    if imagewidth<=0:
+        return isrc
+
+    # the width of each rendition by normalized url
+    widths = {}
+    for u,w in srcset:
+        widths[normalizeURL(imageURL(u,WordPressurl))] = [u,w]
+    nsrc = normalizeURL(imageURL(isrc,WordPressurl))
+    m = media_by_url.get(nsrc)
+    if not m == None and isinstance(m.get('metadata'),dict):
+        mdata = m['metadata']
+        link = m['link']
+        if 'width' in mdata:
+            widths.setdefault(normalizeURL(link),[link,int(mdata['width'])])
+        msizes = mdata.get('sizes')
+        if isinstance(msizes,dict):
+            for size in msizes.values():
+                if 'file' in size and 'width' in size:
+                    u = os.path.dirname(link)+'/'+size['file']
+                    widths.setdefault(normalizeURL(u),[u,int(size['width'])])
+
+    if not nsrc in widths or widths[nsrc][1]<=imagewidth:
+        return isrc
+    best = None
+    for u,w in widths.values():
+        if w>=imagewidth and w<widths[nsrc][1] and (best == None or w<best[1]):
+            best = [u,w]
+    if best == None:
+        return isrc
 
-    # get end of gallery
-    iend = s.find("]",i)
+    if debugMode():
+        print("  rendition",best[0],best[1],"for",isrc,widths[nsrc][1])
+    rendition_count = rendition_count+1
+    return best[0]
 
-    gal = s[i:iend+1]
+#
+# Function to get the thumbnail urls of the ids of all the
+# gallery short codes in a post, for the transform of the post.
+# Ids missing from the media index are looked up in one batch.
+#
+def galleryThumbs(s):
+    if debugMode():
+        print("galleryThumbs")
 
-    # get ids in the gallery
-    ii = gal.find('"')
-    iiend = gal.find('"',ii+1)
-    ids = gal[ii+1:iiend]
-    ilist = ids.split(',')
+    ilist = shortcodes.galleryIds(s)
+    lookupMedia(ilist)
     
     # get the media thunb URLs from the ids
     thumbs = {}
     for il in ilist:
-        thumbs[il] = getMediaThumbURL(il)
-    
-    # create replacement string
-    srep = "\n"
-    for img in thumbs:
-        url = thumbs[img]
-        ap = '<img class="gallery-image" src="'+url+'"/>'
-        ap = ap+"\n"
-        srep = srep+ap
-
-    # replace the gallery
-    sret = s.replace(gal,srep)
-            
-    return sret
-
-#
-# Function to test if file is an image
-#
-def isImage(f):
-    iexts = (".PNG",".JPG",".GIF",".BMP",".JPEG")
-    fdata = os.path.splitext(f)
-    fext = fdata[1]
-    fext = fext.upper()
-    if fext in iexts:
-        return True
-    else:
-        return False
+        url = getMediaThumbURL(il)
+        if not url == None:
+            thumbs[il] = url
+
+    return thumbs
 
 #
-# Function to turn text lines into <p> elements
+# Function to add a category directory the first time a
+# category is seen
 #
-def makeParagraphs(s):
+def addCategory(c,cdir):
     if debugMode():
-        print("makeParagraphs:",s[0:20])
-    
-    sss = s.strip()
-    splist = []
+        print("addCategory",c,cdir)
 
-    slines = sss.splitlines()
-    nlines = len(slines)
-    if debugMode():
-      print("text contains",nlines,"lines of text")
-    if nlines>0:
-        for ss in slines:
-            sp = "<p>"+ss+"</p>"
-            splist.append(XML(sp))
-    
-    return splist
+    category_list.append(c)
+    os.makedirs(cdir,exist_ok=True)
+    catdirs[c] = cdir
 
 #
-# Function to make last minute changes to the text
+# Function to put back the posts and images recorded in the
+# journal of an earlier run that did not finish. The posts
+# are written to the manifest, the last entry of a post wins.
+# Returns the set of post ids that are already done.
 #
-def filterText(s):
-
-    ss = s
-
-    # handle ü
-    ss = ss.replace("&#252;","ue")
-
-    return ss
+def resumeJournal(entries):
+    global total_nodes
+    if debugMode():
+        print("resumeJournal",len(entries))
+
+    done = set()
+    posts = {}
+    for e in entries:
+        if e.tag == "run":
+            for k in run_settings:
+                if not e.get(k,setting_defaults[k]) == run_settings[k]:
+                    print("Error, the journal is for",k,'"'+e.get(k,"")+'"')
+                    exit(0)
+        elif e.tag == "image":
+            fname = e.get("file")
+            if os.path.exists(imageFile(fname)):
+                fut = concurrent.futures.Future()
+                fut.set_result(fname)
+                image_store[e.get("url")] = fut
+        elif e.tag == "post":
+            pid = e.find("node").get("id")
+            posts[pid] = e
+            # the text may not have reached the disk before a
+            # crash, the post is done again then
+            path = e.find("node").get("path")
+            if post_store == None:
+                saved = os.path.exists(path)
+            else:
+                saved = poststore.hasPost(path)
+            if not saved:
+                del posts[pid]
+
+    for pid in posts:
+        e = posts[pid]
+        c = e.get("type")
+        ne = e.find("node")
+        ne.tail = None
+        if not c in category_list:
+            addCategory(c,e.get("dir"))
+        writeManifestNode(c,ne)
+        # the copy from the last run is replaced
+        if pid in old_nodes:
+            del old_nodes[pid]
+        total_nodes = total_nodes+1
+        done.add(pid)
+
+    return done
 
 ###################################
 # PROCESSING INITIALIZATION SECTION
 ###################################
 
-# name of the options file
-options_file = "options.xml"
-
-# set debugging control
-setdebug(False)
-# only process a single node, if true
-testmode = False
-
-# set the CMS to WordPress
-set_cms("WordPress")
-
-# unique file identifier
-file_ident = 0
-
-# get runtime options from the options XML file
-
-tree = ElementTree()
-try:
-    root = tree.parse(options_file)
-except:
-    print("Error, could not parse",options_file)
-    exit(0)
-
-if not root.tag == "options":
-    print("Error,",options_file,"is not recognized")
-    exit(0)
-
-# set defaults
-set_maxretry(5)
-set_retrysleep(5)
-WordPressurl = None
-user = None
-password = None
-
-# get parameter values from the options file
-for e in root.iter():
-    if not e.text == None:
-      if e.tag == "url":
-        WordPressurl = e.text
-      elif e.tag == "user":
-        user = e.text
-      elif e.tag == "password":
-        password = e.text
-      elif e.tag == "outdir":
-        outdir = e.text
-      elif e.tag == "debug":
-        if e.text[0] == "Y":
-          setdebug(True)
-      elif e.tag == "testmode":
-        if e.text[0] == "Y":
-          testmode = True
-      elif e.tag == "maxretry":
-          n = int(e.text)
-          set_maxretry(n)
-      elif e.tag == "retrysleep":
-          n = int(e.text)
-          set_retrysleep(n)
-
-# check for stuff we need missing
-if WordPressurl == None:
-    print("No url!")
-    exit(0)
-if user == None:
-    print("No user!")
-    exit(0)
-if password == None:
-    print("No password!")
-    exit(0)
-
-#
-# signon to the site for XML-RPC
-#
-print("deconstructwp utility begins")
-print()
-
-# set the url to be used for XML-RPC calls
-WordPress = WordPressurl+"/xmlrpc.php"
-set_cms_url(WordPress)
-
-# calculate the relative base to the URL
-set_base_url(baseURL(WordPressurl))
-
-# set the site user and password
-set_user(user)
-set_password(password)
-
-print("WordPress URL:",WordPressurl)
-print(" username:",user,",password:",password)
-
-print("max communication retry:",get_maxretry())
-print("communication retry sleep:",get_retrysleep())
-print()
-
-# initial setup of the output directory
-# set output directory
-EmptyDir(outdir)
-# create a directory for the images
-imagedir = outdir+os.sep+"images"
-os.mkdir(imagedir)
-
-# set the XML manifest output file
-xml_file = "manifestwp.xml"
-
-total_nodes = 0
-image_count = 0
-
-istored = {}
-unparsed = []
+# the worker processes, which are started with spawn, import
+# this script for its functions, only running it does the work
+if __name__ == "__main__":
+
+    # name of the options file
+    options_file = "options.xml"
+
+    # set debugging control
+    setdebug(False)
+    # only process a single node, if true
+    testmode = False
+
+    # set the CMS to WordPress
+    set_cms("WordPress")
+
+    # unique temporary file identifier
+    temp_ident = itertools.count()
+
+    # number of image download threads
+    imageworkers = 8
+    # maximum number of downloads at the same time from one host
+    hostconnections = 4
+
+    # number of posts requested per wp.getPosts call
+    pagesize = 100
+    # number of pages of posts the read ahead thread may get ahead
+    readahead = 4
+    # number of windows of posts requested in one round trip
+    batchwindows = 4
+    # number of XML-RPC requests in flight at once
+    rpcconcurrency = 4
+    # read the whole media library up front
+    medialibrary = False
+    # number of processes that transform the post text, 0 to
+    # transform in the main process
+    transformworkers = os.cpu_count() or 1
+    # adapt the number of requests in flight to how the site
+    # copes, and the ceilings of requests per second and KB per
+    # second toward the site, 0 for none
+    adaptive = True
+    maxrate = 0
+    maxbandwidth = 0
+
+    # get runtime options from the options XML file
+
+    tree = ElementTree()
+    try:
+        root = tree.parse(options_file)
+    except:
+        print("Error, could not parse",options_file)
+        exit(0)
+
+    if not root.tag == "options":
+        print("Error,",options_file,"is not recognized")
+        exit(0)
+
+    # set defaults
+    set_maxretry(5)
+    set_retrysleep(5)
+    WordPressurl = None
+    user = None
+    password = None
+    cachedir = None
+    cassettedir = None
+    cassettemode = "record"
+    cassettelatency = 0
+    incremental = False
+    # the JSON file of the timing report of the run
+    timing_file = "deconstructwp_timing.json"
+    # a SQLite manifest to keep in place of the XML manifest
+    manifest_db_file = None
+    # the width images are scaled to by manifest2ditawp.py, smaller
+    # renditions of wider images are read, 0 to read the img src
+    imagewidth = 450
+    # the users and terms of the site kept between runs
+    site_cache_file = "deconstructwp_site.xml"
+    # the layout of the post and image files, see wplayout.py
+    layout = "flat"
+    # the packed store of the post texts in the output directory,
+    # see poststore.py, or None for a file for each post
+    poststore_file = None
+    # make the DITA topics as the posts are finished, see wpdita.py
+    fused = False
+    # poll the site for changes every this many seconds, 0 for a
+    # single run
+    watch = 0
+
+    # get parameter values from the options file
+    for e in root.iter():
+        if not e.text == None:
+          if e.tag == "url":
+            WordPressurl = e.text
+          elif e.tag == "user":
+            user = e.text
+          elif e.tag == "password":
+            password = e.text
+          elif e.tag == "outdir":
+            outdir = e.text
+          elif e.tag == "debug":
+            if e.text[0] == "Y":
+              setdebug(True)
+          elif e.tag == "testmode":
+            if e.text[0] == "Y":
+              testmode = True
+          elif e.tag == "incremental":
+            if e.text[0] == "Y":
+              incremental = True
+          elif e.tag == "fused":
+            if e.text[0] == "Y":
+              fused = True
+          elif e.tag == "medialibrary":
+            if e.text[0] == "Y":
+              medialibrary = True
+          elif e.tag == "maxretry":
+              n = int(e.text)
+              set_maxretry(n)
+          elif e.tag == "retrysleep":
+              n = int(e.text)
+              set_retrysleep(n)
+          elif e.tag == "pagesize":
+              pagesize = int(e.text)
+          elif e.tag == "readahead":
+              readahead = int(e.text)
+          elif e.tag == "batchwindows":
+              batchwindows = int(e.text)
+          elif e.tag == "batchsize":
+              wprpc.set_batch_size(int(e.text))
+          elif e.tag == "rpcconcurrency":
+              rpcconcurrency = int(e.text)
+          elif e.tag == "imageworkers":
+              imageworkers = int(e.text)
+          elif e.tag == "hostconnections":
+              hostconnections = int(e.text)
+          elif e.tag == "transformworkers":
+              transformworkers = int(e.text)
+          elif e.tag == "adaptive":
+              adaptive = e.text[0] == "Y"
+          elif e.tag == "maxrate":
+              maxrate = float(e.text)
+          elif e.tag == "maxbandwidth":
+              maxbandwidth = float(e.text)
+          elif e.tag == "mediacache":
+              cachedir = e.text
+          elif e.tag == "cassette":
+              # <cassette mode="record|replay" latency="ms">dir</cassette>
+              cassettedir = e.text
+              cassettemode = e.get("mode",cassettemode)
+              cassettelatency = int(e.get("latency",cassettelatency))
+          elif e.tag == "timingreport":
+              timing_file = e.text
+          elif e.tag == "manifestdb":
+              manifest_db_file = e.text
+          elif e.tag == "imagewidth":
+              imagewidth = int(e.text)
+          elif e.tag == "sitecache":
+              site_cache_file = e.text
+          elif e.tag == "layout":
+              layout = e.text
+          elif e.tag == "poststore":
+              poststore_file = e.text
+          elif e.tag == "watch":
+              watch = int(e.text)
+
+    # check for stuff we need missing
+    if WordPressurl == None:
+        print("No url!")
+        exit(0)
+    if user == None:
+        print("No user!")
+        exit(0)
+    if password == None:
+        print("No password!")
+        exit(0)
+    if not layout in wplayout.LAYOUTS:
+        print("Error, layout",layout,"is not one of",", ".join(wplayout.LAYOUTS))
+        exit(0)
+    # a watch keeps the DITA output up to date as well
+    if watch>0:
+        fused = True
+
+#
+    # signon to the site for XML-RPC
+#
+    print("deconstructwp utility begins")
+    wptiming.startRun()
+    print()
+
+    # set the url to be used for XML-RPC calls
+    WordPress = WordPressurl+"/xmlrpc.php"
+    set_cms_url(WordPress)
+
+    # calculate the relative base to the URL
+    set_base_url(baseURL(WordPressurl))
+
+    # set the site user and password
+    set_user(user)
+    set_password(password)
+
+    print("WordPress URL:",WordPressurl)
+    print(" username:",user,",password:",password)
+
+    print("max communication retry:",get_maxretry())
+    print("communication retry sleep:",get_retrysleep())
+    print("posts per page:",pagesize)
+    print("XML-RPC requests in flight:",rpcconcurrency)
+    print("image download threads:",imageworkers)
+    print("downloads per host:",hostconnections)
+    print("transform processes:",transformworkers)
+    print("image rendition width:",imagewidth)
+    print("file layout:",layout)
+    if not poststore_file == None:
+        print("post store:",poststore_file)
+    if fused:
+        print("DITA output:",wpdita.outdir)
+    if watch>0:
+        print("polling the site every",watch,"seconds")
+    print("adaptive request limit:",adaptive)
+    if maxrate>0:
+        print("requests per second at most:",maxrate)
+    if maxbandwidth>0:
+        print("KB per second at most:",maxbandwidth)
+    httppool.set_pool_size(hostconnections)
+    # the XML-RPC calls and the downloads share the limit of the site
+    ratecontrol.set_adaptive(adaptive)
+    ratecontrol.set_max_limit(rpcconcurrency+hostconnections)
+    ratecontrol.set_max_rate(maxrate)
+    ratecontrol.set_max_bandwidth(maxbandwidth*1024)
+    if not cachedir == None:
+        mediacache.openCache(cachedir)
+    if not cassettedir == None:
+        try:
+            wpcassette.openCassette(cassettedir,cassettemode,cassettelatency/1000.0)
+        except (ValueError,OSError) as err:
+            print("Error,",err)
+            exit(0)
+        if wpcassette.replaying():
+            print("replaying the site from",cassettedir,"with",cassettelatency,"ms latency")
+    print()
+
+    # set the XML manifest output file
+    xml_file = "manifestwp.xml"
+    if not manifest_db_file == None:
+        xml_file = manifest_db_file
+        print("the manifest is the database",xml_file)
+    # the journal of the work done by this run
+    journal_file = "deconstructwp.journal"
+    # the packed store of the post texts
+    post_store = None
+    if not poststore_file == None:
+        post_store = outdir+os.sep+poststore_file
+    # the settings the files of a run depend on, a run can only
+    # carry on from a manifest or journal with the same settings
+    run_settings = {"outdir":outdir,"layout":layout,"poststore":"","ditaout":""}
+    # the values of the settings in manifests and journals written
+    # before the setting was added
+    setting_defaults = {"outdir":None,"layout":"flat","poststore":"","ditaout":""}
+    if not post_store == None:
+        run_settings["poststore"] = post_store
+    if fused:
+        run_settings["ditaout"] = wpdita.outdir
+
+    # continue a run that did not finish
+    resume = "--resume" in sys.argv
+    if resume and not os.path.exists(journal_file):
+        print("there is no journal",journal_file,"to resume from")
+        resume = False
+    if resume:
+        print("resuming the run recorded in",journal_file)
+
+    # the image directory of the output
+    imagedir = outdir+os.sep+"images"
+
+    istored = {}
+    unparsed = []
+
+    # image download pool, the downloads of the pass keyed by
+    # normalized url and the posts waiting for their images
+    image_pool = None
+    image_store = {}
+    pending_posts = collections.deque()
+
+    # post transform worker processes, and the number of posts
+    # that may wait for their transform and images
+    transform_pool = None
+    if transformworkers>0:
+        transform_pool = wptransform.startPool(transformworkers)
+    post_backlog = 8*max(transformworkers,4)
+    # the process making the DITA topics of a fused run, and the
+    # topics queued on it with their content type and node
+    dita_pool = None
+    if fused:
+        wpdita.set_layout(layout)
+        dita_pool = wpdita.startTopicProcess()
+    dita_topics = collections.deque()
+    # the directories of the removed topics
+    topic_dirs = set()
+    host_slots = {}
+    host_lock = threading.Lock()
 
 ###################################
 #
@@ -624,316 +1569,460 @@ unparsed = []
 #
 ###################################
 
-# start up server communication
-print("starting communication with server",WordPressurl)
-try:
-    proxy = xmlrpc.client.ServerProxy(WordPress, allow_none=True)
-    print("Communication started.")
-except:
-    webErrorLog("Error, could not set server proxy!")
-    exit(0)
-
-# initialize some variables    
-set_proxy(proxy)
-
-# read in all the posts/pages and make the category list
-Posts = getWPposts('post')
-print("there are",len(Posts),"posts")
-Pages = getWPposts('page')
-print("there are",len(Pages),"pages")
-for pg in Pages:
-    Posts.append(pg)
-category_list=[]
-
-print()
-for p in Posts:
-    if debugMode():
-        print("Post:",p["post_name"])        
-    c = getCategory(p)
-    if not c in category_list:
-      category_list.append(c)
-                
-if debugMode():
-    print("category list:",category_list)
-
-catdirs = {}
-# create directories for the categories used
-for tp in category_list:
-    catdir = outdir+os.sep+tp
-    os.mkdir(catdir)
-    print("created",catdir)
-    catdirs[tp]=catdir
-
-# get information about all the media
-MediaLib = getWPMediaLibrary()
-if debugMode():
-    for m in MediaLib:
-        print()
-        formatDict(m)
-
-print()
-print("there are",len(Posts),"posts")
-print("there are",len(Pages),"pages")
-print("there are",len(MediaLib),"items in the media library")
-print("there are",len(category_list),"categories")
-
-# initialize the xml output file
-# and create the XML root
-melement = Element("manifest")
-# base level information
-tree = ElementTree(melement)
-root = tree.getroot()
-ctype_dict = {}
-    
-stampe = SubElement(root,"timestamp")
-today = date.today()
-stampe.text = today.isoformat()
-ose = SubElement(root,"os")
-ose.text = os.environ["OS"]
-compe = SubElement(root,"computer")
-compe.text = os.environ["COMPUTERNAME"]
-unamee = SubElement(root,"computer_user")
-unamee.text = os.environ["USERNAME"]
-cmse = SubElement(root,"CMS")
-cmse.text = "WordPress"
-root.set("images",imagedir)
-root.set("outdir",outdir)
-
-# add category base for each category
-for c in category_list:
-    # directory for the files
-    cdir = catdirs[c]
-    ce = SubElement(root,"ctype")
-    ce.set("type",c)
-    ce.set("dir",cdir)
-    ctype_dict[c]=ce
-
-#
-# Now process all the posts
-#
-
-for p in Posts:
-    print()
-    pid = p["post_id"]
-    # collect post information
-    ptitle = p["post_title"]
-    if ptitle=="":
-        ptitle="notitle"
-    pname = p["post_name"]
-    plink = p['link']
-    # pick yymmdd from date
-    pdate = str(p['post_date'])[0:8]
-    pcats,ptags = getPostCats(p)
-    pcat = getCategory(p)
-    # add the node to the manifest
-    ce = ctype_dict[pcat]
-    ne = SubElement(ce,"node")
-    ne.set("created",pdate)
-    print('Post',pid,': "'+ptitle+'"',pname,pcat)
-    # get author information
-    pauthid = p['post_author']
-    if not pauthid in user_dict:
-        pret = getWPUser(pauthid)
-        dname = pret['display_name']
-        user_dict[pauthid] = dname
-    ne.set("user",user_dict[pauthid])
-    
-    imagese = SubElement(ne,"images")
-    
-    # check for a featured image
-    PTHUMB = "post_thumbnail"
-    pimage = None
-    if PTHUMB in p:
-        pthumb = p[PTHUMB]
-        if not pthumb==[]:
-            pimage = pthumb["thumbnail"]
-            if debugMode():
-              print("featured image",pimage)
-            # read the image and store it
-            ibase = os.path.basename(pimage)
-            imguri = pimage
-            ibase = mapFname(imguri)
-            irc = storeImage(ibase,imguri,WordPressurl,imagedir)
-            # save image data
-            impath = imagedir+"/"+ibase
-            im = Image.open(impath)
-            width  = im.size[0]
-            height = im.size[1]
-            ie = SubElement(imagese,"image")
-            ie.set("field",FEATURED_IMAGE)
-            ie.set("uri",pimage)
-            ie.text = "image of "+pthumb['title']
-            ie.set("filename",impath)
-            ie.set("height",str(height))
-            ie.set("width",str(width))
-            image_count = image_count+1
-                         
-        
-    # set output file path
-    fpath = catdirs[pcat]+os.sep+"post_"+pid+"_"+pname+".html"
-    fpath = fpath.replace("-","_")
-    # get the raw node text
-    ftext = p['post_content']
-        
-    # try to make html out of it
-    soup = BeautifulSoup(ftext,"html.parser")
-    stext = soup.prettify()
-    
+    # start up server communication
+    print("starting communication with server",WordPressurl)
     try:
-        # do we have xhtml with a root?
-        roothtml = XML(stext)
-        print(roothtml.tag)
-        # replace <html><body> with <div>
-        if roothtml.tag == "html":
-            bodye = roothtml.find("body")
-            if not bodye == None:
-                bodye.tag = "div"
-                stext = str(tostring(bodye,encoding="unicode"))
-                                
+        if cassettedir == None:
+            proxy = xmlrpc.client.ServerProxy(WordPress, allow_none=True)
+        else:
+            proxy = xmlrpc.client.ServerProxy(WordPress, allow_none=True,
+                                              transport=wpcassette.makeTransport(WordPress))
+        print("Communication started.")
     except:
-        print("Note, could not parse html in:",fpath)
-        # wrap the text in an outer root element
-        stext = "<div>"+stext+"</div>"
-    
+        webErrorLog("Error, could not set server proxy!")
+        exit(0)
 
-    # expand any galleries to image references
-    if SGALLERY in stext:
-        print(" expanding a gallery")
-        stext = expandGallery(stext)
-
-    # delete [caption ...] shortcodes
-    if SCAPTION in stext:
-        while SCAPTION in stext:
-          cstart = stext.find(SCAPTION)
-          cend = stext.find("]",cstart)
-          stext = stext[0:cstart]+stext[cend+1:]
-        stext = stext.replace("[/caption]","")
-   
-    # parse the post string as XML
-    parse_error = False
-    
-    temproot = fromstring(stext)
-           
-    # make a list of all the img elements
-    imgs = temproot.findall(".//img")
-    if len(imgs)>0:
-        print(" post has",len(imgs),"image references")
-    ifailures = False
-    
-    for img in imgs:
-        image_count = image_count+1
-        isrc = img.get("src")
-        siteurl = get_base_url()
-        ibase = os.path.basename(isrc)
-        imguri = isrc
-        ibase = mapFname(imguri)
-          
-        # read and store an image
-        irc = storeImage(ibase,imguri,WordPressurl,imagedir)
-          
-        if not irc:
-            ifailures = True
-        img.set("src",os.path.dirname(isrc)+"/"+ibase)
-        if debugMode():
-            print("  store referenced image",ibase)
-            print("  href",img.get("src"))
-
-    # fix any image anchors
-    aa = temproot.findall(".//a")
-    for a in aa:
-        ahref = a.get("href")
-        if isImage(ahref):
-            del a.attrib['href']
-          
-
-    # turn any leading or trailing text into paragraph elements
-    nl = 0
-    # look for leading text in root element
-    if not temproot.text==None:
-        if debugMode():
-          print("TEXT:",len(temproot.text))
-          print(temproot.text)
-        # convert the text to paragraphs
-        elist = makeParagraphs(temproot.text)
-
-        # replace the text with paragraphs
-        j = 0
-        for enew in elist:
-            if debugMode():
-              print("inserting text element",j)
-              print(tostring(enew))
-            temproot.insert(j,enew)
-            j=j+1
-        temproot.text = None
-
-    # look for trailing text in the last sub-element
-    elast = None
-    for e in temproot.iter():
-      elast = e
-      nl=nl+1
-
-    if not elast==None:           
-     if not elast.tail==None:
-        if debugMode():
-          print("TAIL:",len(elast.tail))
-          print(elast.tail)
-        # convert the text to paragraphs
-        elist = makeParagraphs(elast.tail)
-
-        # replace the text with paragraphs
-        j = nl
-        for enew in elist:
+    # initialize some variables    
+    set_proxy(proxy)
+
+    # batch independent calls if the site supports it
+    methods = listMethods()
+    wprpc.set_multicall("system.multicall" in methods)
+    print("system.multicall supported:",wprpc.get_multicall())
+
+    # start the event loop for concurrent XML-RPC calls
+    wprpc.set_concurrency(rpcconcurrency)
+    wprpc.startAsync(WordPress)
+
+    # the journal is left for --resume if the run does not finish
+    atexit.register(journal.closeJournal,False)
+    # a watch is stopped by a termination signal as by an interrupt
+    if watch>0:
+        signal.signal(signal.SIGTERM,stopWatch)
+
+    # the passes over the site, one unless the site is watched, and
+    # the manifest state a pass leaves for the next
+    npass = 0
+    watch_state = None
+    while True:
+        pass_start = time.time()
+        if npass>0:
+            wptiming.startRun()
+            print()
+            print("watch pass",npass+1,"started",time.strftime("%Y-%m-%d %H:%M:%S"))
+        total_nodes = 0
+        image_count = 0
+        image_refs = 0
+        rendition_count = 0
+        rpc_failures = 0
+        # each pass fetches its images again, through the media cache
+        # if there is one, so a changed or failed image is tried anew,
+        # and looks up the media items the site did not have before
+        image_store.clear()
+        media_missing.clear()
+        pass_nodes.clear()
+
+        # for an incremental run read the last manifest, a later pass
+        # of a watch carries on from the nodes of the pass before
+        if npass>0:
+            last_manifest = watch_state
+        elif incremental:
+            last_manifest = readManifest(xml_file)
+            for k in ("layout","poststore","ditaout"):
+                if last_manifest == None:
+                    break
+                last = wpmanifest.manifestAttr(xml_file,k,setting_defaults[k])
+                if not last == run_settings[k]:
+                    print("the last run used the",k,'"'+last+'"')
+                    last_manifest = None
+            if last_manifest == None:
+                print("a full archive will be made")
+        else:
+            last_manifest = None
+
+        # initial setup of the output directory
+        if last_manifest == None and not resume:
+            # set output directory
+            EmptyDir(outdir)
+            # create a directory for the images
+            os.mkdir(imagedir)
+        elif not os.path.isdir(imagedir):
+            os.makedirs(imagedir)
+        if npass == 0 and not post_store == None:
+            poststore.openStore(post_store,not last_manifest == None or resume)
+        # the DITA output of a fused run, the topics of the unchanged
+        # posts are kept from the last run
+        if fused:
+            if last_manifest == None and not resume:
+                EmptyDir(wpdita.outdir)
+            if npass == 0:
+                wpdita.startOutput()
+
+        category_list=[]
+        catdirs = {}
+        # [type,hash,path] of the nodes from the last run by post id
+        old_nodes = {}
+        since = None
+
+        if not last_manifest == None:
+            # pick up the categories and nodes from the last run
+            since,lastcats,old_nodes = last_manifest
+            for c in lastcats:
+                category_list.append(c)
+                catdirs[c] = lastcats[c]
+            last_manifest = None
+            print("incremental run, last run had",len(old_nodes),"posts")
+            print("reading posts modified since",since)
+
+        # read the users and terms of the site, on top of those of the
+        # last run, and make the category directories. Later passes of
+        # a watch keep them and look up the new ones.
+        if npass == 0:
+            sitecache.openSiteCache(site_cache_file)
+            user_dict.update(sitecache.getUsers())
+            with wptiming.Timer("prefetch"):
+                prefetchSite()
+        makeCategoryDirs()
+        print(len(user_dict),"users,",len(catdirs),"category directories")
+
+        # start reading the posts and pages, the pages of posts
+        # are read ahead in the background while we work
+        Posts = getWPposts('post',since)
+        Pages = getWPposts('page',since)
+
+        # get information about all the media if asked to, otherwise
+        # media items are looked up as galleries need them. Later passes
+        # of a watch read the items added since the pass before.
+        if medialibrary:
+            with wptiming.Timer("media library"):
+                if npass == 0:
+                    nmedia = getWPMediaLibrary()
+                else:
+                    nmedia = getWPMediaLibrary(since)
             if debugMode():
-              print("enew:")
-              print(tostring(enew))
-              print("inserting tail element",j)
-            temproot.insert(j,enew)
-            j=j+1
-        elast.tail = None
-          
-            
-    # replace the original text
-    stext = tostring(temproot).decode()
-
-    # filter the final text
-    stext = filterText(stext)
-    
-    
-    if ifailures:
-        webErrorLog("image failures in",fpath,ptitle)
- 
-        
-    # write out the text to a file
-    print(" writing",fpath)
-    f = open(fpath,"w")
-    f.write(stext)
-    f.close()
-    total_nodes = total_nodes+1
-            
-    # populate manifest XML for this post
-    ne.set("id",p['post_id'])
-    ne.text = ptitle
-    ne.set("link",plink)
-    ne.set("path",fpath)
-    tes = SubElement(ne,"tags")
-    if len(ptags)>0:
-        for tag in ptags:
-            te = SubElement(tes,"tag")
-            te.text = tag
-
-# write the manifest XML file
-print()
-print("processing complete")
-print()
-print("Writing output XML manifest file",xml_file)
-tree.write(xml_file,encoding="UTF-8")
-print()
-
-# terminate
-webErrorLogClose()
-print("Node count",total_nodes)
-print("Image count",image_count)
-print("deconstructwp utility ends")
+                for m in media_by_id.values():
+                    print()
+                    formatDict(m)
+
+            print()
+            if npass == 0:
+                print("there are",nmedia,"items in the media library")
+            else:
+                print("there are",nmedia,"new items in the media library")
+
+        # start the XML output file, the node of each post is
+        # written to it as soon as the post is finished
+        mattrs = {"images":imagedir,"outdir":outdir,"layout":layout}
+        if not post_store == None:
+            mattrs["poststore"] = post_store
+        if fused:
+            mattrs["ditaout"] = wpdita.outdir
+        wpmanifest.openManifest(xml_file,mattrs)
+        # base level information
+        today = date.today()
+        wpmanifest.writeInfo("timestamp",today.isoformat())
+        wpmanifest.writeInfo("os",os.environ["OS"])
+        wpmanifest.writeInfo("computer",os.environ["COMPUTERNAME"])
+        wpmanifest.writeInfo("computer_user",os.environ["USERNAME"])
+        wpmanifest.writeInfo("CMS","WordPress")
+
+        # open the journal, picking up the work already done
+        entries = journal.openJournal(journal_file,resume)
+        done_ids = resumeJournal(entries)
+        if resume:
+            print(len(done_ids),"posts were already done")
+        else:
+            journal.journalRun(run_settings)
+
+        #
+        # Now process all the posts
+        #
+
+        post_count = 0
+        page_count = 0
+        unchanged_count = 0
+        watermark = since
+        # the ids of the posts and pages listed in this pass
+        seen_ids = {"post":set(),"page":set()}
+
+        # the time spent waiting for each post is the post listing
+        for p in wptiming.timedIter(itertools.chain(Posts,Pages),"post listing"):
+            print()
+            if p['post_type'] == 'page':
+                page_count = page_count+1
+            else:
+                post_count = post_count+1
+            pid = p["post_id"]
+            seen_ids.setdefault(p['post_type'],set()).add(pid)
+            # move the modification watermark forward
+            pmodified = str(p["post_modified"])
+            if watermark == None or pmodified>watermark:
+                watermark = pmodified
+            # skip a post finished before the run was resumed
+            if pid in done_ids:
+                continue
+            # skip a post that did not change since the last run
+            phash = postHash(p)
+            oldpath = None
+            oldtype = None
+            if pid in old_nodes:
+                octype,ohash,opath = old_nodes[pid]
+                if ohash == phash:
+                    print('Post',pid,"is unchanged")
+                    unchanged_count = unchanged_count+1
+                    continue
+                # drop the old copy of the post
+                oldpath = opath
+                oldtype = octype
+                del old_nodes[pid]
+            # collect post information
+            ptitle = p["post_title"]
+            if ptitle=="":
+                ptitle="notitle"
+            pname = p["post_name"]
+            plink = p['link']
+            # pick yymmdd from date
+            pdate = str(p['post_date'])[0:8]
+            pcats,ptags = getPostCats(p)
+            pcat = getCategory(p)
+            # create the directory and manifest entry
+            # the first time we see a category
+            if not pcat in category_list:
+                catdir = outdir+os.sep+pcat
+                addCategory(pcat,catdir)
+                print("created",catdir)
+            # make the manifest node, it is written when the
+            # post is finished
+            ne = Element("node")
+            ne.set("created",pdate)
+            ne.set("modified",pmodified)
+            ne.set("hash",phash)
+            print('Post',pid,': "'+ptitle+'"',pname,pcat)
+            # get author information
+            pauthid = p['post_author']
+            if not pauthid in user_dict:
+                with wptiming.Timer("user lookup",pauthid):
+                    pret = getWPUser(pauthid)
+                if pret == None:
+                    ne.set("user",pauthid)
+                else:
+                    user_dict[pauthid] = pret['display_name']
+            if pauthid in user_dict:
+                ne.set("user",user_dict[pauthid])
+
+            imagese = SubElement(ne,"images")
+
+            # set output file path
+            fpath = wplayout.postDir(layout,catdirs[pcat],pid,pdate)+os.sep+"post_"+pid+"_"+pname+".html"
+            fpath = fpath.replace("-","_")
+            if post_store == None:
+                wplayout.makeDir(os.path.dirname(fpath))
+            # remove the old file if the post moved
+            if not oldpath == None and not oldpath == fpath and os.path.exists(oldpath):
+                os.remove(oldpath)
+            if not oldpath == None and not oldpath == fpath and not post_store == None:
+                poststore.dropPost(oldpath)
+            if fused and not oldtype == None and not oldtype == pcat:
+                removeTopic(oldtype,pid)
+
+            # check for a featured image
+            PTHUMB = "post_thumbnail"
+            pimage = None
+            featured = None
+            if PTHUMB in p:
+                pthumb = p[PTHUMB]
+                if not pthumb==[]:
+                    pimage = pthumb["thumbnail"]
+                    if debugMode():
+                      print("featured image",pimage)
+                    # read the image and store it, the file name and
+                    # size are filled in when the download completes
+                    ie = SubElement(imagese,"image")
+                    ie.set("field",FEATURED_IMAGE)
+                    ie.set("uri",pimage)
+                    ie.text = "image of "+pthumb['title']
+                    fut = queueImage(pimage,WordPressurl,imagedir)
+                    featured = [ie,fut,pimage]
+
+            # get the raw node text
+            ftext = p['post_content']
+            thumbs = galleryThumbs(ftext)
+            # the media items of images without a srcset, to find their
+            # renditions
+            if imagewidth>0:
+                lookupMedia(wptransform.imageIds(ftext))
+
+            # transform the text in the worker processes and
+            # write it out once its images are stored
+            if transform_pool == None:
+                transform = concurrent.futures.Future()
+                transform.set_result(wptransform.transformPost(ftext,thumbs,fpath))
+            else:
+                transform = transform_pool.submit(wptransform.transformPost,ftext,thumbs,fpath)
+            queuePost(transform,fpath,ptitle,featured,pcat,ne)
+
+            # populate manifest XML for this post
+            ne.set("id",p['post_id'])
+            ne.text = ptitle
+            ne.set("link",plink)
+            ne.set("path",fpath)
+            tes = SubElement(ne,"tags")
+            if len(ptags)>0:
+                for tag in ptags:
+                    te = SubElement(tes,"tag")
+                    te.text = tag
+
+            # write out any posts whose images are stored, and wait
+            # for the oldest posts if too many are queued
+            finishPosts(False)
+            if len(pending_posts)>post_backlog:
+                with wptiming.Timer("backlog wait"):
+                    finishPosts(True,post_backlog)
+
+        # find and remove the posts deleted from the site
+        deleted_count = 0
+        if not since == None:
+            print()
+            print("checking for deleted posts")
+            if npass == 0:
+                siteids = getWPpostIds('post')
+                pageids = getWPpostIds('page')
+                site_ids["post"] = siteids
+                site_ids["page"] = pageids
+            else:
+                siteids = sitePostIds('post',seen_ids['post'])
+                pageids = sitePostIds('page',seen_ids['page'])
+            if siteids == None or pageids == None:
+                print("the posts on the site could not all be listed, no posts are removed")
+                siteids = None
+            else:
+                siteids = siteids | pageids
+            for pid in list(old_nodes):
+                if siteids == None:
+                    break
+                if not pid in siteids:
+                    octype,ohash,opath = old_nodes[pid]
+                    print('Post',pid,'was deleted, removing',opath)
+                    if os.path.exists(opath):
+                        os.remove(opath)
+                    if not post_store == None:
+                        poststore.dropPost(opath)
+                    if fused:
+                        removeTopic(octype,pid)
+                    del old_nodes[pid]
+                    deleted_count = deleted_count+1
+        elif rpc_failures == 0:
+            # a full pass lists all the posts on the site
+            site_ids["post"] = seen_ids["post"]
+            site_ids["page"] = seen_ids["page"]
+
+        # wait for the remaining downloads
+        print()
+        print("waiting for images of",len(pending_posts),"posts")
+        with wptiming.Timer("backlog wait"):
+            finishPosts(True)
+            collectTopics(True)
+        for id in user_dict:
+            sitecache.setUser(id,user_dict[id])
+        sitecache.saveSiteCache()
+        for fut in image_store.values():
+            if not fut.result() == None:
+                image_count = image_count+1
+        # finish the manifest XML file
+        print()
+        print("processing complete")
+        print()
+        print("Finishing output manifest file",xml_file)
+        # copy the unchanged posts from the last manifest
+        with wptiming.Timer("manifest write"):
+            ncopied = wpmanifest.copyNodes(xml_file,old_nodes)
+        if ncopied>0:
+            print("copied",ncopied,"unchanged posts from the last manifest")
+        if rpc_failures>0:
+            # the next incremental run must look at the missed posts again
+            watermark = since
+        with wptiming.Timer("manifest write"):
+            wpmanifest.closeManifest(watermark)
+        print(wpmanifest.nodeCount(),"posts in the manifest")
+        # rewrite the post store once it is mostly old texts
+        if not post_store == None:
+            with wptiming.Timer("file write"):
+                poststore.compactStore()
+        # the next pass of a watch carries on from the watermark,
+        # categories and nodes of this one, those copied and those
+        # written, without reading the manifest again
+        if watch>0:
+            old_nodes.update(pass_nodes)
+            watch_state = (watermark,dict(catdirs),old_nodes)
+        if fused:
+            print()
+            print("writing the DITA maps in",wpdita.outdir)
+            with wptiming.Timer("dita maps"):
+                nrelink = writeDITAMaps()
+            if nrelink>0:
+                print(nrelink,"topics with links to later posts were made again")
+        # keep the journal so a run with failures can be resumed
+        journal.closeJournal(rpc_failures == 0)
+        print()
+
+        # report the pass
+        print("there were",post_count,"posts")
+        print("there were",page_count,"pages")
+        print("there were",len(category_list),"categories")
+        if not since == None:
+            print("there were",unchanged_count,"unchanged posts")
+            print("there were",deleted_count,"deleted posts")
+        if rpc_failures>0:
+            print("there were",rpc_failures,"failed XML-RPC calls, see deconstructError.log")
+        ratecontrol.report()
+        print("there were",len(media_by_id),"media items in the media index")
+        print("Node count",total_nodes)
+        print("Image references",image_refs)
+        print("Image renditions",rendition_count)
+        print("Image count",image_count)
+        print("Image files",sum(len([f for f in fs if not f.startswith(".")]) for d,ds,fs in os.walk(imagedir)))
+        print()
+        # report the time spent in each phase of the run
+        report = wptiming.makeReport(total_nodes,{"post_count":post_count,"page_count":page_count,
+                                                  "image_refs":image_refs,"image_count":image_count,
+                                                  "rendition_count":rendition_count,
+                                                  "rpc_failures":rpc_failures})
+        wptiming.printReport(report)
+        wptiming.writeReport(report,timing_file)
+        print("timing report written to",timing_file)
+
+        # the next pass carries on from this one
+        resume = False
+        incremental = True
+        npass = npass+1
+        if watch == 0:
+            break
+        # wait for the next poll, the connections, caches and worker
+        # processes are kept for it
+        wait = watch-(time.time()-pass_start)
+        print()
+        print("next poll of the site in",max(int(wait),0),"seconds")
+        try:
+            if wait>0:
+                time.sleep(wait)
+        except KeyboardInterrupt:
+            print("the watch is stopped")
+            break
+
+    # terminate
+    if not transform_pool == None:
+        transform_pool.shutdown()
+    if not dita_pool == None:
+        dita_pool.shutdown()
+    if not image_pool == None:
+        image_pool.shutdown()
+    httppool.closeConnections()
+    wprpc.stopAsync()
+    poststore.closeStore()
+    mediacache.closeCache()
+    wpcassette.closeCassette()
+    webErrorLogClose()
+    print("deconstructwp utility ends")
 
 
 
@@ -26,6 +26,7 @@ import xmlrpc.client
 import time
 from datetime import date
 import re
+import multiprocessing
 
 # global variables for this script
 dbgflag = True
@@ -891,7 +892,7 @@ def makeContent(pages,media,p,tdir):
 # since we need a parent to use remove().
 #
 def parentMap(tree):
-    return dict((c, p) for p in tree.getiterator() for c in p)
+    return dict((c, p) for p in tree.iter() for c in p)
     
 #
 # Function to recursively remove any empty anchor elements
@@ -1041,3 +1042,14 @@ def fixTitle(s):
     ss = ss.replace(">","&gt;")
 
     return ss
+
+#
+# Function to return the context worker processes are started
+# with. Workers are started with spawn on every platform, it is
+# the only start method on Windows and it does not copy the
+# threads of the main process. A spawned worker imports the main
+# script, so the scripts keep their processing under
+# if __name__ == "__main__".
+#
+def spawnContext():
+    return multiprocessing.get_context("spawn")
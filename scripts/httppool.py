@@ -0,0 +1,233 @@
+###################################
+# PROLOG SECTION
+# httppool.py
+#
+# A pool of keep-alive HTTP connections used to fetch media
+# files from a web site. Connections are kept open per host
+# and reused, so a run with thousands of small images does not
+# pay for a new TCP connection (and TLS handshake) per image.
+# Response bodies are streamed to disk in large chunks.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import http.client
+import urllib.parse
+import urllib.error
+import threading
+import hashlib
+import time
+import wpcassette
+import ratecontrol
+from ditapub import debugMode
+
+# idle connections for each (scheme, host)
+idle_conns = {}
+pool_lock = threading.Lock()
+
+# global get/set variables
+x_pool_size = 4
+x_chunk_size = 256*1024
+x_max_redirect = 5
+x_user_agent = "WParchive"
+
+REDIRECTS = (301,302,303,307,308)
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# get/set functions for get/set variables
+#
+def set_pool_size(n):
+    global x_pool_size
+    x_pool_size = n
+def get_pool_size():
+    return x_pool_size
+def set_chunk_size(n):
+    global x_chunk_size
+    x_chunk_size = n
+def get_chunk_size():
+    return x_chunk_size
+
+#
+# Function to take an idle connection to a host from the pool,
+# or open a new one. Returns the connection and True if it was
+# reused from the pool.
+#
+def getConnection(scheme,host,timeout):
+    key = (scheme,host)
+    with pool_lock:
+        conns = idle_conns.get(key)
+        if conns:
+            return conns.pop(),True
+
+    if debugMode():
+        print("getConnection: new connection to",scheme,host)
+
+    if scheme == "https":
+        conn = http.client.HTTPSConnection(host,timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(host,timeout=timeout)
+
+    return conn,False
+
+#
+# Function to return a connection to the pool so the next
+# request to the host can reuse it
+#
+def releaseConnection(scheme,host,conn):
+    key = (scheme,host)
+    with pool_lock:
+        conns = idle_conns.setdefault(key,[])
+        if len(conns)<x_pool_size:
+            conns.append(conn)
+            return
+    conn.close()
+
+#
+# Function to close all the idle connections in the pool
+#
+def closeConnections():
+    with pool_lock:
+        for key in idle_conns:
+            for conn in idle_conns[key]:
+                conn.close()
+        idle_conns.clear()
+
+#
+# Function to send a GET request on a pooled connection. A
+# reused connection the server has already closed is replaced
+# by a new one and the request is sent again.
+#
+def sendRequest(scheme,host,target,headers,timeout):
+    while True:
+        conn,reused = getConnection(scheme,host,timeout)
+        try:
+            conn.request("GET",target,headers=headers)
+            return conn,conn.getresponse()
+        except (http.client.RemoteDisconnected,ConnectionResetError,BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+        except:
+            conn.close()
+            raise
+
+#
+# Function to fetch a url into the file at path. The body is
+# streamed to disk in chunks and its SHA-256 hash computed on
+# the way. Redirects are followed. A 304 response writes
+# nothing. Any other status raises urllib.error.HTTPError.
+#
+# Returns a dictionary with the final url, status, response
+# headers, number of bytes written and the sha256 hex digest.
+#
+# With a cassette the answer is recorded, or replayed without
+# going to the site. The request waits for a slot from the rate
+# controller of the host and tells it how the request went.
+#
+def fetchURL(url,path,headers=None,timeout=30):
+    ctl = ratecontrol.getController(url)
+    ctl.acquire()
+    start = time.monotonic()
+    try:
+        if wpcassette.replaying():
+            time.sleep(wpcassette.latency())
+            ret = wpcassette.replayURL(url,path,headers)
+        elif wpcassette.recording():
+            try:
+                ret = getURL(url,path,headers,timeout)
+            except urllib.error.HTTPError as err:
+                wpcassette.recordURLError(url,err)
+                raise
+            wpcassette.recordURL(url,ret,path)
+        else:
+            ret = getURL(url,path,headers,timeout)
+    except urllib.error.HTTPError as err:
+        ctl.release(start,"media",status=err.code,retry_after=ratecontrol.retryAfter(err.headers))
+        raise
+    except Exception:
+        ctl.release(start,"media",failed=True)
+        raise
+    ctl.release(start,"media",status=ret["status"],nbytes=ret["bytes"],latency=ret.get("latency"))
+
+    return ret
+
+#
+# Function to fetch a url into the file at path for fetchURL
+#
+def getURL(url,path,headers=None,timeout=30):
+    if debugMode():
+        print("getURL",url,path)
+
+    hdrs = {"User-Agent":x_user_agent,"Accept-Encoding":"identity"}
+    if not headers == None:
+        hdrs.update(headers)
+
+    for i in range(x_max_redirect+1):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = parts.netloc
+        target = parts.path or "/"
+        if parts.query:
+            target = target+"?"+parts.query
+
+        start = time.monotonic()
+        conn,resp = sendRequest(scheme,host,target,hdrs,timeout)
+        latency = time.monotonic()-start
+        complete = False
+
+        try:
+            status = resp.status
+            rhdrs = dict((k.lower(),v) for k,v in resp.getheaders())
+            ret = {"url":url,"status":status,"headers":rhdrs,"bytes":0,"sha256":None,"latency":latency}
+
+            if status in REDIRECTS and "location" in rhdrs:
+                resp.read()
+                complete = True
+                url = urllib.parse.urljoin(url,rhdrs["location"])
+                continue
+
+            if status == 304:
+                resp.read()
+                complete = True
+                return ret
+
+            if not status == 200:
+                resp.read()
+                complete = True
+                raise urllib.error.HTTPError(url,status,resp.reason,resp.msg,None)
+
+            # stream the body to disk
+            h = hashlib.sha256()
+            n = 0
+            f = open(path,"wb")
+            try:
+                while True:
+                    chunk = resp.read(x_chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    h.update(chunk)
+                    n = n+len(chunk)
+            finally:
+                f.close()
+            complete = True
+            ret["bytes"] = n
+            ret["sha256"] = h.hexdigest()
+            return ret
+
+        finally:
+            # keep the connection if the body was read
+            # and the server allows it
+            if resp.will_close or not complete:
+                conn.close()
+            else:
+                releaseConnection(scheme,host,conn)
+
+    raise urllib.error.HTTPError(url,310,"Too many redirects",None,None)
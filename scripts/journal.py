@@ -0,0 +1,169 @@
+###################################
+# PROLOG SECTION
+# journal.py
+#
+# An append-only journal of the work done by a deconstructwp.py
+# run. Each finished post and each stored image is appended to
+# the journal as an XML element, and the journal is flushed and
+# fsynced to disk in batches. If a run dies part way through,
+# the next run can be started with --resume to read the journal,
+# rebuild the manifest entries for the finished posts and skip
+# the work that was already done.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+import threading
+import time
+from xml.etree.ElementTree import *
+from ditapub import debugMode
+
+# global variables for this script
+journal_fileobj = None
+journal_path = None
+journal_lock = threading.Lock()
+journal_unsynced = 0
+journal_synced_at = 0
+
+# fsync the journal after this many entries or seconds
+SYNC_EVERY = 50
+SYNC_SECONDS = 5
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to read the complete entries of a journal. An entry
+# cut off by a crash at the end of the file is ignored.
+#
+def readJournal(f):
+    if debugMode():
+        print("readJournal",f)
+
+    entries = []
+    parser = XMLPullParser(("start","end"))
+    parser.feed("<journal>")
+    depth = 0
+    fp = open(f,"r",encoding="utf-8")
+    try:
+        while True:
+            chunk = fp.read(1024*1024)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            for event,e in parser.read_events():
+                if event == "start":
+                    depth = depth+1
+                else:
+                    depth = depth-1
+                    if depth == 1:
+                        entries.append(e)
+    except ParseError:
+        print("Note, the journal",f,"ends with an incomplete entry")
+    fp.close()
+
+    return entries
+
+#
+# Function to open the journal. If resume is True the entries
+# of the existing journal are read and returned and new entries
+# are appended, otherwise the journal is started over.
+#
+def openJournal(f,resume):
+    global journal_fileobj
+    global journal_path
+    global journal_synced_at
+    if debugMode():
+        print("openJournal",f,resume)
+
+    entries = []
+    if resume and os.path.exists(f):
+        entries = readJournal(f)
+        mode = "a"
+    else:
+        mode = "w"
+
+    journal_path = f
+    journal_fileobj = open(f,mode,encoding="utf-8")
+    journal_synced_at = time.time()
+
+    return entries
+
+#
+# Function to write the journal to disk
+#
+def syncJournal():
+    global journal_unsynced
+    global journal_synced_at
+    journal_fileobj.flush()
+    os.fsync(journal_fileobj.fileno())
+    journal_unsynced = 0
+    journal_synced_at = time.time()
+
+#
+# Function to append an entry element to the journal. The
+# journal is synced once enough entries or time have built up.
+#
+def journalWrite(e):
+    global journal_unsynced
+    if journal_fileobj == None:
+        return
+
+    s = tostring(e,encoding="unicode")
+    with journal_lock:
+        journal_fileobj.write(s)
+        journal_fileobj.write("\n")
+        journal_unsynced = journal_unsynced+1
+        if journal_unsynced>=SYNC_EVERY or time.time()-journal_synced_at>=SYNC_SECONDS:
+            syncJournal()
+
+#
+# Function to record the start of a run with the settings its
+# files depend on, the output directory, file layout ...
+#
+def journalRun(settings):
+    e = Element("run",settings)
+    e.set("started",time.strftime("%Y-%m-%dT%H:%M:%S"))
+    journalWrite(e)
+
+#
+# Function to record a finished post with its category,
+# category directory and manifest node
+#
+def journalPost(ctype,cdir,node):
+    e = Element("post")
+    e.set("type",ctype)
+    e.set("dir",cdir)
+    e.append(node)
+    journalWrite(e)
+
+#
+# Function to record a stored image by its normalized url
+#
+def journalImage(url,fname):
+    e = Element("image")
+    e.set("url",url)
+    e.set("file",fname)
+    journalWrite(e)
+
+#
+# Function to close the journal. If the run is complete the
+# journal is no longer needed and is deleted.
+#
+def closeJournal(complete):
+    global journal_fileobj
+    if journal_fileobj == None:
+        return
+
+    with journal_lock:
+        syncJournal()
+        journal_fileobj.close()
+        journal_fileobj = None
+
+    if complete:
+        os.remove(journal_path)
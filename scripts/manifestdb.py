@@ -0,0 +1,300 @@
+###################################
+# PROLOG SECTION
+# manifestdb.py
+#
+# A SQLite manifest, kept in place of manifestwp.xml when the
+# <manifestdb> option of deconstructwp.py names a database file.
+# It holds what the XML manifest holds, in tables:
+#
+#  info        the run information and the root attributes,
+#              images, outdir, timestamp, CMS, watermark ...
+#  categories  the directory of each content type, in the order
+#              the types were first seen
+#  nodes       one row per post, by id, with its type, title,
+#              link, the last part of the link (the slug), text
+#              file path, created and modified dates, hash and
+#              user, in the order the posts were written
+#  images      the image elements of each node
+#  tags        the tags of each node
+#
+# with indexes on the node id, slug, type and created date, so
+# manifest2ditawp.py can read one content type at a time and look
+# up the target of a link without loading the whole manifest.
+#
+# deconstructwp.py writes the database through wpmanifest.py.
+# A run is one transaction: posts written by the run replace
+# their rows, the rows of posts that are neither written nor kept
+# are removed at the end, and the database only changes when the
+# run commits. An incremental run only touches the posts that
+# changed, instead of writing the whole manifest again.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+import sqlite3
+from xml.etree.ElementTree import *
+from ditapub import debugMode
+
+# global variables for this script
+db_conn = None
+db_written = set()
+db_catseq = 0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS categories (type TEXT PRIMARY KEY, dir TEXT, seq INTEGER);
+CREATE TABLE IF NOT EXISTS nodes (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE,
+    type TEXT, title TEXT, link TEXT, slug TEXT, path TEXT, created TEXT, modified TEXT,
+    hash TEXT, user TEXT);
+CREATE INDEX IF NOT EXISTS nodes_slug ON nodes (slug);
+CREATE INDEX IF NOT EXISTS nodes_type ON nodes (type, seq);
+CREATE INDEX IF NOT EXISTS nodes_created ON nodes (created);
+CREATE TABLE IF NOT EXISTS images (node_id TEXT, seq INTEGER, field TEXT, uri TEXT,
+    filename TEXT, width TEXT, height TEXT, caption TEXT);
+CREATE INDEX IF NOT EXISTS images_node ON images (node_id, seq);
+CREATE TABLE IF NOT EXISTS tags (node_id TEXT, seq INTEGER, tag TEXT);
+CREATE INDEX IF NOT EXISTS tags_node ON tags (node_id, seq);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+"""
+
+# the node attributes kept in columns of the nodes table
+NODE_COLUMNS = ("id","link","path","created","modified","hash","user")
+# the image attributes kept in columns of the images table
+IMAGE_COLUMNS = ("field","uri","filename","width","height")
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to test if a manifest file is a SQLite database, by
+# its header if it exists or else by its extension
+#
+def isManifestDB(f):
+    if os.path.exists(f):
+        fp = open(f,"rb")
+        head = fp.read(16)
+        fp.close()
+        return head == b"SQLite format 3\x00"
+    return os.path.splitext(f)[1].lower() in (".db",".sqlite",".sqlite3")
+
+#
+# Function to return the slug of a link, the part after the
+# last /, as manifest2ditawp.py matches links
+#
+def linkSlug(link):
+    if link == None:
+        return None
+    return link[link.rfind("/")+1:]
+
+#
+# Function to open the database, making the tables if they are
+# not there. If write is True a transaction is started that
+# lasts until closeDB.
+#
+def openDB(f,write=False):
+    global db_conn
+    global db_written
+    global db_catseq
+    if debugMode():
+        print("openDB",f,write)
+
+    db_conn = sqlite3.connect(f,isolation_level=None)
+    db_conn.executescript(SCHEMA)
+    db_written = set()
+    db_catseq = db_conn.execute("SELECT COALESCE(MAX(seq),0) FROM categories").fetchone()[0]
+    if write:
+        db_conn.execute("BEGIN")
+
+#
+# Function to start the run information of a new manifest with
+# the root attributes
+#
+def startInfo(attrs):
+    db_conn.execute("DELETE FROM info")
+    for k in attrs:
+        setInfo(k,attrs[k])
+
+#
+# Function to set a run information value
+#
+def setInfo(name,value):
+    db_conn.execute("INSERT OR REPLACE INTO info (name,value) VALUES (?,?)",(name,value))
+
+#
+# Function to get a run information value, None if it is not set
+#
+def getInfo(name):
+    row = db_conn.execute("SELECT value FROM info WHERE name=?",(name,)).fetchone()
+    if row == None:
+        return None
+    return row[0]
+
+#
+# Function to write the node element of a post in its content
+# type, replacing the node of the post if there is one
+#
+def writeNode(ctype,cdir,node):
+    global db_catseq
+
+    if db_conn.execute("UPDATE categories SET dir=? WHERE type=?",(cdir,ctype)).rowcount == 0:
+        db_catseq = db_catseq+1
+        db_conn.execute("INSERT INTO categories (type,dir,seq) VALUES (?,?,?)",(ctype,cdir,db_catseq))
+
+    id = node.get("id")
+    db_conn.execute("DELETE FROM nodes WHERE id=?",(id,))
+    db_conn.execute("DELETE FROM images WHERE node_id=?",(id,))
+    db_conn.execute("DELETE FROM tags WHERE node_id=?",(id,))
+
+    values = [node.get(k) for k in NODE_COLUMNS]
+    db_conn.execute("INSERT INTO nodes (type,title,slug,"+",".join(NODE_COLUMNS)+") VALUES (?,?,?"+",?"*len(NODE_COLUMNS)+")",
+                    [ctype,node.text,linkSlug(node.get("link"))]+values)
+    images = node.find("images")
+    if not images == None:
+        rows = []
+        for i,ie in enumerate(images):
+            rows.append([id,i,ie.text]+[ie.get(k) for k in IMAGE_COLUMNS])
+        db_conn.executemany("INSERT INTO images (node_id,seq,caption,"+",".join(IMAGE_COLUMNS)+") VALUES (?,?,?"+",?"*len(IMAGE_COLUMNS)+")",rows)
+    tags = node.find("tags")
+    if not tags == None:
+        db_conn.executemany("INSERT INTO tags (node_id,seq,tag) VALUES (?,?,?)",
+                            [(id,i,te.text) for i,te in enumerate(tags)])
+    db_written.add(id)
+
+#
+# Function to remove the nodes that were not written by this
+# run and are not in keep. Returns the number of nodes kept.
+#
+def keepNodes(keep):
+    if debugMode():
+        print("keepNodes",len(keep))
+
+    n = 0
+    drop = []
+    for (id,) in db_conn.execute("SELECT id FROM nodes"):
+        if id in db_written:
+            continue
+        if id in keep:
+            n = n+1
+        else:
+            drop.append((id,))
+    db_conn.executemany("DELETE FROM nodes WHERE id=?",drop)
+    db_conn.executemany("DELETE FROM images WHERE node_id=?",drop)
+    db_conn.executemany("DELETE FROM tags WHERE node_id=?",drop)
+
+    return n
+
+#
+# Function to finish the run, with the modification watermark
+# if there is one, and commit it
+#
+def closeDB(modified):
+    global db_conn
+    if debugMode():
+        print("closeDB",modified)
+
+    db_conn.execute("DELETE FROM categories WHERE NOT type IN (SELECT DISTINCT type FROM nodes)")
+    if not modified == None:
+        setInfo("watermark",modified)
+    db_conn.execute("COMMIT")
+    db_conn.close()
+    db_conn = None
+
+#
+# Function to close a database opened for reading
+#
+def closeReader():
+    global db_conn
+    db_conn.close()
+    db_conn = None
+
+#
+# Function to read the categories, nodes and watermark of the
+# database in the form wpmanifest.scanManifest returns them
+#
+def scanDB(f):
+    if debugMode():
+        print("scanDB",f)
+
+    conn = sqlite3.connect(f)
+    row = conn.execute("SELECT value FROM info WHERE name='watermark'").fetchone()
+    modified = None
+    if not row == None:
+        modified = row[0]
+    cats = dict(conn.execute("SELECT type,dir FROM categories ORDER BY seq"))
+    nodes = {}
+    for id,ctype,hash,path in conn.execute("SELECT id,type,hash,path FROM nodes"):
+        nodes[id] = [ctype,hash,path]
+    conn.close()
+
+    return modified,cats,nodes
+
+#
+# Function to return the content types as a list of [type,dir]
+# in the order they were first seen
+#
+def categories():
+    return [list(r) for r in db_conn.execute("SELECT type,dir FROM categories ORDER BY seq")]
+
+#
+# Function to return the nodes of a content type as node
+# elements like those of the XML manifest
+#
+def typeNodes(ctype):
+    if debugMode():
+        print("typeNodes",ctype)
+
+    images = {}
+    for r in db_conn.execute("SELECT i.node_id,i.caption,"+",".join("i."+k for k in IMAGE_COLUMNS)+
+                             " FROM images i JOIN nodes n ON i.node_id=n.id WHERE n.type=? ORDER BY i.node_id,i.seq",(ctype,)):
+        images.setdefault(r[0],[]).append(r[1:])
+    tags = {}
+    for id,tag in db_conn.execute("SELECT t.node_id,t.tag FROM tags t JOIN nodes n ON t.node_id=n.id"
+                                  " WHERE n.type=? ORDER BY t.node_id,t.seq",(ctype,)):
+        tags.setdefault(id,[]).append(tag)
+
+    nodes = []
+    for r in db_conn.execute("SELECT title,"+",".join(NODE_COLUMNS)+" FROM nodes WHERE type=? ORDER BY seq",(ctype,)):
+        ne = Element("node")
+        ne.text = r[0]
+        for k,v in zip(NODE_COLUMNS,r[1:]):
+            if not v == None:
+                ne.set(k,v)
+        imagese = SubElement(ne,"images")
+        for ir in images.get(ne.get("id"),[]):
+            ie = SubElement(imagese,"image")
+            ie.text = ir[0]
+            for k,v in zip(IMAGE_COLUMNS,ir[1:]):
+                if not v == None:
+                    ie.set(k,v)
+        tes = SubElement(ne,"tags")
+        for tag in tags.get(ne.get("id"),[]):
+            SubElement(tes,"tag").text = tag
+        nodes.append(ne)
+
+    return nodes
+
+#
+# Function to return the content type of a node id, or None
+#
+def nodeType(id):
+    row = db_conn.execute("SELECT type FROM nodes WHERE id=?",(id,)).fetchone()
+    if row == None:
+        return None
+    return row[0]
+
+#
+# Function to return the id of the node a link points to, by its
+# slug with or without a leading ?q=, or None
+#
+def linkId(h):
+    if h.startswith("?q="):
+        h = h[3:]
+    row = db_conn.execute("SELECT id FROM nodes WHERE slug=? ORDER BY seq DESC LIMIT 1",(h,)).fetchone()
+    if row == None:
+        return None
+    return row[0]
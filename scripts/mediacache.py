@@ -0,0 +1,214 @@
+###################################
+# PROLOG SECTION
+# mediacache.py
+#
+# A persistent on-disk cache of media files fetched from a web
+# site. The cache lives outside the output directory so it
+# survives between runs. For each url it remembers the ETag and
+# Last-Modified validators of the last response, so the next run
+# can send a conditional GET and reuse the cached bytes when the
+# server answers 304 Not Modified.
+#
+# Cached files are stored by their SHA-256 content hash in
+# <cache>/blobs/<first 2 hash chars>/<hash>, and the index of
+# urls is kept in <cache>/mediacache.xml.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+import shutil
+import threading
+from xml.etree.ElementTree import *
+from ditapub import debugMode
+
+# sharing the blocks of a file, where the file system can
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# global variables for this script
+cache_dir = None
+cache_index = {}
+cache_lock = threading.Lock()
+save_lock = threading.Lock()
+cache_changes = 0
+
+# name of the index file in the cache directory
+INDEX_FILE = "mediacache.xml"
+# save the index after this many changes
+SAVE_EVERY = 500
+# the Linux ioctl that makes a file share the blocks of another
+FICLONE = 0x40049409
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to open the cache in directory d, creating it if
+# needed, and read the index from the last run
+#
+def openCache(d):
+    global cache_dir
+    if debugMode():
+        print("openCache",d)
+
+    cache_dir = d
+    if not os.path.isdir(d+os.sep+"blobs"):
+        os.makedirs(d+os.sep+"blobs")
+
+    cache_index.clear()
+    ipath = d+os.sep+INDEX_FILE
+    if os.path.exists(ipath):
+        tree = ElementTree()
+        try:
+            root = tree.parse(ipath)
+        except:
+            print("Error, could not parse",ipath,"the media cache is reset")
+            return
+        for item in root.iter("item"):
+            cache_index[item.get("url")] = dict(item.attrib)
+
+    print("media cache",d,"has",len(cache_index),"items")
+
+#
+# Function to test if the cache is in use
+#
+def cacheOpen():
+    return not cache_dir == None
+
+#
+# Function to return the path of a cached file
+#
+def blobPath(h):
+    return cache_dir+os.sep+"blobs"+os.sep+h[0:2]+os.sep+h
+
+#
+# Function to copy a file. Where the file system can, the copy
+# shares the blocks of src until one of them is written. A hard
+# link would not do, a later change to a file in the output
+# directory would change the cached file too.
+#
+def copyFile(src,dst):
+    if not fcntl == None:
+        fs = open(src,"rb")
+        fd = open(dst,"wb")
+        try:
+            fcntl.ioctl(fd.fileno(),FICLONE,fs.fileno())
+            return
+        except OSError:
+            pass
+        finally:
+            fs.close()
+            fd.close()
+    shutil.copyfile(src,dst)
+
+#
+# Function to return the conditional GET headers for a url,
+# or an empty dictionary if the url is not in the cache
+#
+def validators(url):
+    if not cacheOpen():
+        return {}
+
+    with cache_lock:
+        item = cache_index.get(url)
+    if item == None or not os.path.exists(blobPath(item["hash"])):
+        return {}
+
+    hdrs = {}
+    if "etag" in item:
+        hdrs["If-None-Match"] = item["etag"]
+    if "modified" in item:
+        hdrs["If-Modified-Since"] = item["modified"]
+
+    return hdrs
+
+#
+# Function to copy the cached bytes for a url to path after
+# the server answered 304. Returns the content hash, or None
+# if the url is not cached.
+#
+def restore(url,path):
+    if debugMode():
+        print("mediacache restore",url)
+
+    with cache_lock:
+        item = cache_index.get(url)
+    if item == None:
+        return None
+
+    bpath = blobPath(item["hash"])
+    if not os.path.exists(bpath):
+        return None
+    copyFile(bpath,path)
+
+    return item["hash"]
+
+#
+# Function to add a downloaded file to the cache along with
+# the validators from its response. Responses without an
+# ETag or Last-Modified header can not be revalidated and
+# are not cached.
+#
+def update(url,path,h,headers):
+    global cache_changes
+    if not cacheOpen():
+        return
+
+    item = {"url":url,"hash":h}
+    if "etag" in headers:
+        item["etag"] = headers["etag"]
+    if "last-modified" in headers:
+        item["modified"] = headers["last-modified"]
+    if len(item)==2:
+        return
+
+    bpath = blobPath(h)
+    if not os.path.exists(bpath):
+        bdir = os.path.dirname(bpath)
+        os.makedirs(bdir,exist_ok=True)
+        tmp = bpath+"."+str(threading.get_ident())
+        copyFile(path,tmp)
+        os.replace(tmp,bpath)
+
+    with cache_lock:
+        cache_index[url] = item
+        cache_changes = cache_changes+1
+        save = cache_changes>=SAVE_EVERY
+    if save:
+        saveCache()
+
+#
+# Function to write the cache index
+#
+def saveCache():
+    global cache_changes
+    if not cacheOpen():
+        return
+
+    with save_lock:
+        with cache_lock:
+            root = Element("mediacache")
+            for url in cache_index:
+                SubElement(root,"item",cache_index[url])
+            cache_changes = 0
+
+        ipath = cache_dir+os.sep+INDEX_FILE
+        ElementTree(root).write(ipath+".tmp",encoding="UTF-8")
+        os.replace(ipath+".tmp",ipath)
+
+#
+# Function to save the index and stop using the cache
+#
+def closeCache():
+    global cache_dir
+    if cacheOpen():
+        saveCache()
+        print("media cache has",len(cache_index),"items")
+    cache_dir = None
@@ -0,0 +1,253 @@
+###################################
+# PROLOG SECTION
+# poststore.py
+#
+# A packed store of post texts, kept in place of a small HTML
+# file for each post when the <poststore> option of
+# deconstructwp.py names a store file. deconstructwp.py appends
+# each finished post to the end of the store, and
+# manifest2ditawp.py reads the posts back through a memory map
+# of the store.
+#
+# The store is a sequence of records, each a header, the key of
+# the post and the UTF-8 text of the post:
+#
+#  magic   4 bytes  PST1, or PST0 for a post that was removed
+#  keylen  4 bytes  big-endian length of the key
+#  textlen 4 bytes  big-endian length of the text, 0 for PST0
+#  key     the path the post file would have had, as it is in
+#          the path attribute of the manifest node
+#  text    the post text
+#
+# The offset index of the store is made by stepping from header
+# to header, without reading the texts. When a key is written
+# again, by an incremental run, the last record of the key is
+# the current text of the post, and a PST0 record after it drops
+# the key, for a post deleted from the site or moved. A record
+# cut off by a crash at the end of the store is dropped when the
+# store is opened.
+#
+# The records that are written over or dropped stay in the store
+# until it is compacted. Once they are more than half of the
+# store, compactStore writes the live records to a new store and
+# renames it over the old one.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+import mmap
+import struct
+import threading
+from ditapub import debugMode
+
+# global variables for this script
+store_fd = None
+store_lock = threading.Lock()
+store_map = None
+store_index = {}
+# the store being written, the size of the record of each key
+# and the size of the store
+write_path = None
+write_index = {}
+write_size = 0
+
+# the record header, of a post and of a dropped post
+MAGIC = b"PST1"
+DROP = b"PST0"
+HEADER = struct.Struct(">4sII")
+# compact the store when this much of it is dead records
+COMPACT_RATIO = 0.5
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to make the offset index of a store, a dictionary of
+# (offset,length) of the text by key. Returns the index and the
+# end of the last complete record.
+#
+def scanStore(buf):
+    index = {}
+    pos = 0
+    end = len(buf)
+    while pos+HEADER.size<=end:
+        magic,klen,tlen = HEADER.unpack_from(buf,pos)
+        if not magic in (MAGIC,DROP):
+            print("Note, the post store is damaged at offset",pos)
+            break
+        tpos = pos+HEADER.size+klen
+        if tpos+tlen>end:
+            break
+        key = bytes(buf[pos+HEADER.size:tpos]).decode("utf-8")
+        if magic == DROP:
+            index.pop(key,None)
+        else:
+            index[key] = (tpos,tlen)
+        pos = tpos+tlen
+
+    return index,pos
+
+#
+# Function to open the store for writing. If keep is True the
+# records already in the store are kept and new records are
+# appended, otherwise the store is started over.
+#
+def openStore(f,keep):
+    global store_fd
+    global write_path
+    global write_index
+    global write_size
+    if debugMode():
+        print("openStore",f,keep)
+
+    write_path = f
+    write_index = {}
+    write_size = 0
+    if keep and os.path.exists(f) and os.path.getsize(f)>0:
+        fp = open(f,"rb")
+        buf = mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+        index,end = scanStore(buf)
+        size = len(buf)
+        buf.close()
+        fp.close()
+        store_fd = os.open(f,os.O_WRONLY|os.O_APPEND)
+        if end<size:
+            print("Note, the post store",f,"ends with an incomplete record")
+            os.truncate(f,end)
+        print("post store",f,"has",len(index),"posts")
+        for key in index:
+            write_index[key] = HEADER.size+len(key.encode("utf-8"))+index[key][1]
+        write_size = end
+    else:
+        store_fd = os.open(f,os.O_WRONLY|os.O_APPEND|os.O_CREAT|os.O_TRUNC,0o666)
+
+#
+# Function to test if the store had the text of a post when it
+# was opened
+#
+def hasPost(key):
+    return key in write_index
+
+#
+# Function to append the text of a post to the store. The record
+# goes to the file in one write, so a post in the journal is in
+# the store even if the run dies before the store is closed.
+#
+def writePost(key,text):
+    global write_size
+    kb = key.encode("utf-8")
+    tb = text.encode("utf-8")
+    record = HEADER.pack(MAGIC,len(kb),len(tb))+kb+tb
+    with store_lock:
+        os.write(store_fd,record)
+        write_index[key] = len(record)
+        write_size = write_size+len(record)
+
+#
+# Function to drop the text of a post from the store, for a post
+# deleted from the site or moved to another key
+#
+def dropPost(key):
+    global write_size
+    kb = key.encode("utf-8")
+    record = HEADER.pack(DROP,len(kb),0)+kb
+    with store_lock:
+        if not key in write_index:
+            return
+        os.write(store_fd,record)
+        del write_index[key]
+        write_size = write_size+len(record)
+
+#
+# Function to compact the store being written if more than
+# COMPACT_RATIO of it is records written over or dropped. The
+# live records are copied to <store>.tmp, which is synced and
+# renamed over the store. Returns True if the store was compacted.
+#
+def compactStore():
+    global store_fd
+    global write_size
+    if store_fd == None:
+        return False
+    live = sum(write_index.values())
+    if write_size == 0 or write_size-live<=COMPACT_RATIO*write_size:
+        return False
+    if debugMode():
+        print("compactStore",write_path,write_size,live)
+
+    with store_lock:
+        fp = open(write_path,"rb")
+        buf = mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+        index,end = scanStore(buf)
+        out = open(write_path+".tmp","wb")
+        for key in index:
+            tpos,tlen = index[key]
+            out.write(buf[tpos-HEADER.size-len(key.encode("utf-8")):tpos+tlen])
+        out.flush()
+        os.fsync(out.fileno())
+        out.close()
+        buf.close()
+        fp.close()
+        os.close(store_fd)
+        os.replace(write_path+".tmp",write_path)
+        store_fd = os.open(write_path,os.O_WRONLY|os.O_APPEND)
+        print("post store",write_path,"compacted from",write_size,"to",live,"bytes")
+        write_size = live
+
+    return True
+
+#
+# Function to close the store after writing
+#
+def closeStore():
+    global store_fd
+    if store_fd == None:
+        return
+    if debugMode():
+        print("closeStore")
+
+    os.close(store_fd)
+    store_fd = None
+
+#
+# Function to map a store for reading and make its index
+#
+def mapStore(f):
+    global store_map
+    global store_index
+    if debugMode():
+        print("mapStore",f)
+
+    fp = open(f,"rb")
+    if os.fstat(fp.fileno()).st_size == 0:
+        store_map = b""
+    else:
+        store_map = mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+    fp.close()
+    store_index,end = scanStore(store_map)
+    print("post store",f,"has",len(store_index),"posts")
+
+#
+# Function to return the text of a post from the mapped store,
+# or None if the store does not have it
+#
+def readPost(key):
+    if not key in store_index:
+        return None
+    pos,n = store_index[key]
+    return store_map[pos:pos+n].decode("utf-8")
+
+#
+# Function to release the mapped store
+#
+def unmapStore():
+    global store_map
+    if not store_map == None and not store_map == b"":
+        store_map.close()
+    store_map = None
+    store_index.clear()
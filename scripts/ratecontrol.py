@@ -0,0 +1,321 @@
+###################################
+# PROLOG SECTION
+# ratecontrol.py
+#
+# Control of the load the scripts put on the site. Every
+# request to a host, XML-RPC call or media download, first asks
+# the controller of the host for a slot and reports how it went
+# when it is done.
+#
+# The number of requests in flight is set AIMD style, the way
+# TCP sets its window: while responses come back without errors
+# and without their latency growing, the limit goes up by about
+# one each round trip, up to x_max_limit. A 429 Too Many
+# Requests, a 5xx error, a timeout or a dropped connection cuts
+# the limit in half, at most once a round trip, down to one. A
+# Retry-After header stops all requests to the host until the
+# time it gives. Requests that must be tried again wait an
+# exponential backoff with jitter that starts at the retry sleep
+# of the options, or the Retry-After time when there is one.
+#
+# On top of that a host can be held to a ceiling of requests
+# per second and of bytes per second, kept with token buckets.
+#
+# The latency a request is judged by is the time until the
+# response headers arrive, so large files do not look slow.
+# Each kind of request, an XML-RPC method or "media", is measured
+# against its own lowest latency, as a page of posts takes the
+# site longer to make than an image takes to send. The limit is
+# cut by a tenth when the moving average of the latency of a
+# kind grows past x_latency_tolerance times its lowest.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import time
+import random
+import asyncio
+import threading
+import email.utils
+import urllib.parse
+from ditapub import debugMode, get_retrysleep
+
+# global get/set variables
+x_adaptive = True
+x_initial_limit = 2
+x_max_limit = 8
+x_max_rate = 0
+x_max_bandwidth = 0
+x_latency_tolerance = 2.0
+x_max_backoff = 60
+
+# controllers by host
+controllers = {}
+controllers_lock = threading.Lock()
+
+# statuses that mean the site is overloaded
+CONGESTION = (429,500,502,503,504)
+# latency samples in a window of the lowest latency
+LATENCY_WINDOW = 100
+# how long a waiting request sleeps before it looks again
+POLL = 0.01
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# get/set functions for get/set variables
+#
+def set_adaptive(flag):
+    global x_adaptive
+    x_adaptive = flag
+def get_adaptive():
+    return x_adaptive
+def set_initial_limit(n):
+    global x_initial_limit
+    x_initial_limit = max(n,1)
+def get_initial_limit():
+    return x_initial_limit
+def set_max_limit(n):
+    global x_max_limit
+    x_max_limit = max(n,1)
+def get_max_limit():
+    return x_max_limit
+def set_max_rate(n):
+    global x_max_rate
+    x_max_rate = n
+def get_max_rate():
+    return x_max_rate
+def set_max_bandwidth(n):
+    global x_max_bandwidth
+    x_max_bandwidth = n
+def get_max_bandwidth():
+    return x_max_bandwidth
+
+#
+# Function to test if a status means the request can be tried
+# again later
+#
+def retryable(status):
+    return status in CONGESTION
+
+#
+# Function to read the Retry-After header of a response, in
+# seconds or as an HTTP date. Returns the seconds to wait, or
+# None if there is no usable header.
+#
+def retryAfter(headers):
+    if headers == None:
+        return None
+    value = None
+    for k in headers:
+        if k.lower() == "retry-after":
+            value = headers[k]
+    if value == None:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError,ValueError):
+        return None
+    return max(when.timestamp()-time.time(),0.0)
+
+#
+# Function to get the controller of the host of a url
+#
+def getController(url):
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    with controllers_lock:
+        if not host in controllers:
+            controllers[host] = Controller(host)
+        return controllers[host]
+
+#
+# Function to print what the controllers did
+#
+def report():
+    for host in controllers:
+        c = controllers[host]
+        print("host",host,"requests",c.requests,"errors",c.errors,"limit %.1f" % c.limit,
+              "highest %.1f" % c.highest,"cuts",c.cuts,"waits %.1fs" % c.waited)
+
+#
+# Class for the controller of one host
+#
+class Controller:
+
+    def __init__(self,host):
+        self.host = host
+        self.lock = threading.Lock()
+        self.limit = float(x_max_limit)
+        if x_adaptive:
+            self.limit = float(min(x_initial_limit,x_max_limit))
+        self.in_flight = 0
+        # no requests before this time, from a Retry-After
+        self.paused_until = 0.0
+        # token buckets of requests and bytes
+        now = time.monotonic()
+        self.rate_tokens = 1.0
+        self.rate_time = now
+        self.byte_tokens = float(x_max_bandwidth)
+        self.byte_time = now
+        # lowest latency by kind, over this window and the last
+        self.latency_min = {}
+        self.latency_last = {}
+        self.latency_count = {}
+        self.latency_avg = {}
+        self.round_trip = 0.0
+        self.last_cut = 0.0
+        # counts for the report
+        self.requests = 0
+        self.errors = 0
+        self.cuts = 0
+        self.highest = self.limit
+        self.waited = 0.0
+
+    #
+    # Function to fill the token buckets for the time gone by
+    #
+    def refill(self,now):
+        if x_max_rate>0:
+            self.rate_tokens = min(max(x_max_rate,1.0),self.rate_tokens+(now-self.rate_time)*x_max_rate)
+        self.rate_time = now
+        if x_max_bandwidth>0:
+            self.byte_tokens = min(float(x_max_bandwidth),self.byte_tokens+(now-self.byte_time)*x_max_bandwidth)
+        self.byte_time = now
+
+    #
+    # Function to take a slot for a request if one is free.
+    # Returns 0 when the slot is taken, or else the seconds to
+    # wait before asking again.
+    #
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.paused_until>now:
+                return self.paused_until-now
+            if self.in_flight>=int(self.limit):
+                return POLL
+            self.refill(now)
+            if x_max_rate>0 and self.rate_tokens<1.0:
+                return (1.0-self.rate_tokens)/x_max_rate
+            if x_max_bandwidth>0 and self.byte_tokens<0:
+                return -self.byte_tokens/x_max_bandwidth
+            if x_max_rate>0:
+                self.rate_tokens = self.rate_tokens-1.0
+            self.in_flight = self.in_flight+1
+            self.requests = self.requests+1
+            return 0
+
+    #
+    # Function to wait for a slot in a thread
+    #
+    def acquire(self):
+        while True:
+            wait = self.reserve()
+            if wait == 0:
+                return
+            self.waited = self.waited+wait
+            time.sleep(wait)
+
+    #
+    # Function to wait for a slot on the event loop
+    #
+    async def aacquire(self):
+        while True:
+            wait = self.reserve()
+            if wait == 0:
+                return
+            self.waited = self.waited+wait
+            await asyncio.sleep(wait)
+
+    #
+    # Function to give back the slot of a request started at
+    # start, a time.monotonic() value, and adjust the limit by
+    # how it went. kind is the XML-RPC method or "media", status the HTTP
+    # status if there was a response, failed True for a timeout
+    # or connection error, latency the seconds to the response
+    # headers if known and retry_after the seconds of a
+    # Retry-After header.
+    #
+    def release(self,start,kind,status=None,nbytes=0,failed=False,latency=None,retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self.in_flight = self.in_flight-1
+            if latency == None:
+                latency = now-start
+            if x_max_bandwidth>0:
+                self.refill(now)
+                self.byte_tokens = self.byte_tokens-nbytes
+            if not retry_after == None:
+                self.paused_until = max(self.paused_until,now+retry_after)
+
+            if failed or status in CONGESTION:
+                self.errors = self.errors+1
+                self.cut(now,0.5)
+                return
+
+            # keep the lowest latency of the kind over the last
+            # two windows, so it follows the site if it slows,
+            # and the moving average of its latency
+            n = self.latency_count.get(kind,0)+1
+            if n>LATENCY_WINDOW:
+                self.latency_last[kind] = self.latency_min[kind]
+                del self.latency_min[kind]
+                n = 1
+            self.latency_count[kind] = n
+            self.latency_min[kind] = min(self.latency_min.get(kind,latency),latency)
+            lowest = min(self.latency_min[kind],self.latency_last.get(kind,latency))
+            avg = 0.8*self.latency_avg.get(kind,latency)+0.2*latency
+            self.latency_avg[kind] = avg
+            self.round_trip = 0.9*self.round_trip+0.1*latency
+
+            if not x_adaptive:
+                return
+            if avg>x_latency_tolerance*lowest and avg>0.01:
+                # requests are queueing at the site
+                self.cut(now,0.9)
+            elif self.in_flight+1>=int(self.limit):
+                # the limit is in use, open it by about one
+                # each round trip
+                self.limit = min(float(x_max_limit),self.limit+1.0/self.limit)
+                self.highest = max(self.highest,self.limit)
+
+    #
+    # Function to give back the slot of a request that was
+    # cancelled, without judging the site by it
+    #
+    def cancel(self):
+        with self.lock:
+            self.in_flight = self.in_flight-1
+
+    #
+    # Function to cut the limit by a factor, at most once a
+    # round trip. Call with the lock held.
+    #
+    def cut(self,now,factor):
+        if not x_adaptive or now-self.last_cut<max(self.round_trip,POLL):
+            return
+        self.last_cut = now
+        self.limit = max(1.0,self.limit*factor)
+        self.cuts = self.cuts+1
+        if debugMode():
+            print("ratecontrol",self.host,"limit cut to %.1f" % self.limit)
+
+    #
+    # Function to return the seconds to wait before try number
+    # attempt+1 of a request, the Retry-After time if the site
+    # gave one, otherwise an exponential backoff with jitter
+    #
+    def backoff(self,attempt,retry_after=None):
+        if not retry_after == None:
+            return retry_after
+        wait = min(float(x_max_backoff),get_retrysleep()*(2**attempt))
+        return random.uniform(wait/2,wait)
@@ -0,0 +1,268 @@
+###################################
+# PROLOG SECTION
+# shortcodes.py
+#
+# Expansion of WordPress shortcodes like [gallery ids="1,2,3"]
+# and [caption ...]<img .../> text[/caption] in the raw text of
+# a post.
+#
+# The text is scanned once for the shortcodes that have a
+# handler. Text between the shortcodes is copied through, and
+# each shortcode is replaced by what its handler returns. A
+# shortcode with a closing tag, like [caption]...[/caption], has
+# its content expanded first and handed to the handler. Shortcodes
+# without a handler are left in the text, as WordPress does, and
+# [[name]] is written out as [name].
+#
+# A handler is a function handler(attrs,content,ctx) returning
+# the replacement text, where attrs is a dictionary of the
+# shortcode attributes, content is the text inside an enclosing
+# shortcode or None, and ctx is the dictionary passed to
+# processShortcodes. Handlers are registered with addShortcode
+# when this module is imported, so the post transform worker
+# processes have them too.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import re
+from xml.sax.saxutils import escape
+from ditapub import debugMode
+
+# the registered handlers by shortcode name
+shortcode_handlers = {}
+
+# a shortcode tag: an optional [ escape, an optional / for a
+# closing tag, the name, the attributes, an optional / for a
+# self-closing tag and an optional ] escape
+SHORTCODE_RE = re.compile(r"\[(\[?)(/?)([A-Za-z0-9_-]+)(?![\w-])((?:[^\[\]/]|/(?!\]))*)(/?)\](\]?)")
+
+# an attribute: name="value", name='value', name=value,
+# "value", 'value' or value
+ATTR_RE = re.compile(r"""([\w-]+)\s*=\s*"([^"]*)"(?:\s|$)|([\w-]+)\s*=\s*'([^']*)'(?:\s|$)|([\w-]+)\s*=\s*([^\s'"]+)(?:\s|$)|"([^"]*)"(?:\s|$)|'([^']*)'(?:\s|$)|(\S+)(?:\s|$)""")
+
+# the image, with any link around it, at the start of a caption
+CAPTION_IMG_RE = re.compile(r"((?:<a [^>]+>\s*)?<img [^>]+>(?:\s*</a>)?)(.*)",re.I|re.S)
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to register the handler of a shortcode
+#
+def addShortcode(name,handler):
+    shortcode_handlers[name] = handler
+
+#
+# Function to parse the attributes of a shortcode. Attributes
+# without a name are keyed by their position, "0", "1" and so on.
+#
+def parseAttrs(s):
+    attrs = {}
+    n = 0
+    s = s.replace("\u00a0"," ").replace("\u200b"," ")
+    for m in ATTR_RE.finditer(s):
+        if m.group(1):
+            attrs[m.group(1).lower()] = m.group(2)
+        elif m.group(3):
+            attrs[m.group(3).lower()] = m.group(4)
+        elif m.group(5):
+            attrs[m.group(5).lower()] = m.group(6)
+        else:
+            v = m.group(7)
+            if v == None:
+                v = m.group(8)
+            if v == None:
+                v = m.group(9)
+            attrs[str(n)] = v
+            n = n+1
+
+    return attrs
+
+#
+# Generator function to scan a text for the tags of the given
+# shortcode names. Yields ("text",s), ("open",name,attrs,closed)
+# and ("close",name) tokens in the order they appear, where
+# closed is True for a self-closing tag.
+#
+def tokenize(s,names):
+    pos = 0
+    for m in SHORTCODE_RE.finditer(s):
+        name = m.group(3)
+        if not name in names:
+            continue
+        if m.start()>pos:
+            yield ("text",s[pos:m.start()])
+        pos = m.end()
+        if m.group(1) == "[" and m.group(6) == "]":
+            # an escaped tag is written out without the brackets
+            yield ("text",m.group(0)[1:-1])
+        elif m.group(2) == "/":
+            yield ("close",name)
+        else:
+            yield ("open",name,parseAttrs(m.group(4)),m.group(5) == "/")
+    if pos<len(s):
+        yield ("text",s[pos:])
+
+#
+# Function to expand the shortcodes with handlers in a text.
+# Returns the expanded text.
+#
+def processShortcodes(s,ctx):
+    if debugMode():
+        print("processShortcodes:",s[0:40])
+
+    if not "[" in s:
+        return s
+
+    # each open shortcode has a frame with its name, attributes
+    # and the expanded text seen since it was opened
+    top = [None,None,[]]
+    stack = [top]
+
+    # an open tag that is never closed is self-closing, and the
+    # text after it was not its content
+    def unwind():
+        name,attrs,out = stack.pop()
+        parent = stack[-1][2]
+        parent.append(shortcode_handlers[name](attrs,None,ctx))
+        parent.extend(out)
+
+    for tok in tokenize(s,shortcode_handlers):
+        kind = tok[0]
+        if kind == "text":
+            stack[-1][2].append(tok[1])
+        elif kind == "open":
+            name,attrs,closed = tok[1:]
+            if closed:
+                stack[-1][2].append(shortcode_handlers[name](attrs,None,ctx))
+            else:
+                stack.append([name,attrs,[]])
+        else:
+            name = tok[1]
+            if not name in [f[0] for f in stack[1:]]:
+                # a closing tag with nothing to close
+                continue
+            while not stack[-1][0] == name:
+                unwind()
+            name,attrs,out = stack.pop()
+            stack[-1][2].append(shortcode_handlers[name](attrs,"".join(out),ctx))
+
+    while len(stack)>1:
+        unwind()
+
+    return "".join(top[2])
+
+#
+# Function to get the attachment ids of all the galleries in
+# a text
+#
+def galleryIds(s):
+    ids = []
+    if not "[gallery" in s:
+        return ids
+
+    for tok in tokenize(s,("gallery",)):
+        if tok[0] == "open":
+            for id in galleryAttrIds(tok[2]):
+                if not id in ids:
+                    ids.append(id)
+
+    return ids
+
+#
+# Function to get the ids of a gallery from its attributes
+#
+def galleryAttrIds(attrs):
+    ids = attrs.get("ids",attrs.get("include",""))
+    return [id.strip() for id in ids.split(",") if id.strip()]
+
+#
+# Function to quote a url for an html attribute
+#
+def quoteURL(url):
+    return '"'+escape(url,{'"':"&quot;"})+'"'
+
+#
+# Handler for [gallery ids="17,16,15,14"]. Each id becomes an
+# img element with the thumbnail url found in ctx["thumbs"].
+#
+def galleryHandler(attrs,content,ctx):
+    ctx.setdefault("notes",[]).append(" expanding a gallery")
+    thumbs = ctx.get("thumbs",{})
+
+    srep = "\n"
+    for id in galleryAttrIds(attrs):
+        url = thumbs.get(id)
+        if url == None:
+            continue
+        srep = srep+'<img class="gallery-image" src='+quoteURL(url)+'/>\n'
+
+    return srep
+
+#
+# Handler for [caption]<img .../> text[/caption]. The image
+# and its caption text become a figure with a figcaption. The
+# caption text can also come from the caption attribute.
+#
+def captionHandler(attrs,content,ctx):
+    if content == None:
+        return ""
+
+    caption = attrs.get("caption")
+    m = CAPTION_IMG_RE.match(content.strip())
+    if m == None:
+        return content
+    image = m.group(1)
+    if caption == None:
+        caption = m.group(2).strip()
+
+    fig = '<figure class="wp-caption">'+image
+    if len(caption)>0:
+        fig = fig+"<figcaption>"+caption+"</figcaption>"
+    fig = fig+"</figure>"
+
+    return fig
+
+#
+# Function to make a paragraph with a link to a media url
+#
+def mediaLink(kind,url):
+    return '<p class="wp-'+kind+'"><a href='+quoteURL(url)+'>'+escape(url)+"</a></p>"
+
+#
+# Handler for [embed]url[/embed]
+#
+def embedHandler(attrs,content,ctx):
+    url = (content or attrs.get("src","")).strip()
+    if len(url)==0:
+        return ""
+    return mediaLink("embed",url)
+
+#
+# Handler for [video src="..."] and [audio src="..."], which may
+# also name their file with a format attribute like mp4="..."
+#
+def mediaHandler(kind,formats):
+    def handler(attrs,content,ctx):
+        url = attrs.get("src")
+        for f in formats:
+            if url == None:
+                url = attrs.get(f)
+        if url == None and not content == None:
+            url = content.strip()
+        if not url:
+            return ""
+        return mediaLink(kind,url)
+    return handler
+
+addShortcode("gallery",galleryHandler)
+addShortcode("caption",captionHandler)
+addShortcode("wp_caption",captionHandler)
+addShortcode("embed",embedHandler)
+addShortcode("video",mediaHandler("video",("mp4","m4v","webm","ogv","wmv","flv")))
+addShortcode("audio",mediaHandler("audio",("mp3","m4a","ogg","wav","wma")))
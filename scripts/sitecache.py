@@ -0,0 +1,111 @@
+###################################
+# PROLOG SECTION
+# sitecache.py
+#
+# A persistent cache of the users and the category and tag terms
+# of a web site, by id. deconstructwp.py reads all of them in a
+# few paged calls at the start of a run, instead of a call for
+# each new author, and keeps them here between runs. When the
+# site will not list them, the cache of the last run and the
+# lookups of single users fill in.
+#
+# The cache is an XML file:
+#
+#  <sitecache>
+#   <user id="1" name="Dick Johnson"/>
+#   <term taxonomy="category" id="3" name="Local Events" slug="local-events"/>
+#  </sitecache>
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+from xml.etree.ElementTree import *
+from ditapub import debugMode
+
+# global variables for this script
+cache_file = None
+cache_users = {}
+cache_terms = {}
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to read the cache file f of the last run
+#
+def openSiteCache(f):
+    global cache_file
+    if debugMode():
+        print("openSiteCache",f)
+
+    cache_file = f
+    cache_users.clear()
+    cache_terms.clear()
+    if not os.path.exists(f):
+        return
+    tree = ElementTree()
+    try:
+        root = tree.parse(f)
+    except:
+        print("Error, could not parse",f,"the site cache is reset")
+        return
+    for e in root.iter("user"):
+        cache_users[e.get("id")] = e.get("name")
+    for e in root.iter("term"):
+        t = dict(e.attrib)
+        cache_terms.setdefault(t["taxonomy"],{})[t["id"]] = t
+
+    print("site cache",f,"has",len(cache_users),"users and",
+          sum(len(t) for t in cache_terms.values()),"terms")
+
+#
+# Function to return the display names of the users by id
+#
+def getUsers():
+    return cache_users
+
+#
+# Function to set the display name of a user
+#
+def setUser(id,name):
+    cache_users[id] = name
+
+#
+# Function to return the terms of a taxonomy by id, each a
+# dictionary with the taxonomy, id, name, slug and parent
+#
+def getTerms(taxonomy):
+    return cache_terms.setdefault(taxonomy,{})
+
+#
+# Function to add a term as wp.getTerms returns it
+#
+def addTerm(t):
+    e = {"taxonomy":t["taxonomy"],"id":str(t["term_id"]),"name":t["name"]}
+    for k in ("slug","parent"):
+        if k in t:
+            e[k] = str(t[k])
+    cache_terms.setdefault(e["taxonomy"],{})[e["id"]] = e
+
+#
+# Function to write the cache file
+#
+def saveSiteCache():
+    if cache_file == None:
+        return
+    if debugMode():
+        print("saveSiteCache",cache_file)
+
+    root = Element("sitecache")
+    for id in cache_users:
+        SubElement(root,"user",{"id":id,"name":cache_users[id]})
+    for taxonomy in cache_terms:
+        for id in cache_terms[taxonomy]:
+            SubElement(root,"term",cache_terms[taxonomy][id])
+    ElementTree(root).write(cache_file+".tmp",encoding="UTF-8")
+    os.replace(cache_file+".tmp",cache_file)
@@ -0,0 +1,393 @@
+###################################
+# PROLOG SECTION
+# wpbench.py
+#
+# An end to end benchmark of the two stages of the archive. It
+# starts wpserver.py with a made up site of the size asked for,
+# runs deconstructwp.py against it and then manifest2ditawp.py
+# on the result, each as its own process in a work directory,
+# and records for each stage the wall time, the peak resident
+# memory, the requests made to the site and the requests and
+# posts per second. With the fused option deconstructwp.py
+# makes the DITA output itself and manifest2ditawp.py is not run.
+#
+# The results are written to a JSON file. Given a baseline, the
+# results of an earlier run, a stage whose time or peak memory
+# grew by more than the threshold is a regression, and the
+# benchmark exits with status 1, as it does when a stage fails.
+#
+# Usage:
+#  python wpbench.py [--posts 2000] [--media 8000] [--images 4]
+#                    [--latency 0] [--capacity 0]
+#                    [--option pagesize=50 ...]
+#                    [--baseline base.json [--save-baseline]]
+#                    [--threshold 0.2] [--output result.json]
+#
+# The peak memory of a stage is that of all its processes, the
+# worker processes of the transform pool and of the fused topic
+# process too. Where there is a /proc file system the memory of
+# the processes is sampled while the stage runs and added up.
+# The largest single process, from os.wait4, is the least it can
+# be, and all that is measured where there is no /proc. Neither
+# is available on Windows.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import sys
+import os
+import time
+import json
+import shutil
+import socket
+import argparse
+import threading
+import subprocess
+import xmlrpc.client
+from xml.etree.ElementTree import *
+from PIL import Image
+import manifestdb
+
+# peak memory of a finished process, where it can be measured
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the directory of the scripts, with the templates and the
+# common files manifest2ditawp.py needs
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# the stages, in the order they run
+STAGES = ("deconstructwp","manifest2ditawp")
+
+# results compared with the baseline
+COMPARED = ("seconds","peak_rss_mb")
+
+# seconds between samples of the memory of a stage
+RSS_INTERVAL = 0.1
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to find a free local port for the server
+#
+def freePort():
+    s = socket.socket()
+    s.bind(("127.0.0.1",0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+#
+# Function to start wpserver.py and wait until it serves
+#
+def startServer(args,port):
+    cmd = [sys.executable,os.path.join(script_dir,"wpserver.py"),"--port",str(port),
+           "--posts",str(args.posts),"--media",str(args.media),"--images",str(args.images),
+           "--gallery",str(args.gallery),"--latency",str(args.latency),"--capacity",str(args.capacity)]
+    srv = subprocess.Popen(cmd,stdout=subprocess.PIPE,text=True)
+    line = srv.stdout.readline()
+    if not line.startswith("serving"):
+        srv.kill()
+        print("Error, wpserver.py did not start")
+        sys.exit(1)
+    print(line.strip())
+    return srv
+
+#
+# Function to read the request counts of the server. The count
+# includes the request that reads it.
+#
+def serverStats(port):
+    proxy = xmlrpc.client.ServerProxy("http://127.0.0.1:"+str(port)+"/xmlrpc.php")
+    return proxy.wpserver.getStats()
+
+#
+# Function to set up the work directory with the options file
+# and the files manifest2ditawp.py reads
+#
+def makeWorkDir(d,port,options):
+    if os.path.exists(d):
+        shutil.rmtree(d)
+    os.makedirs(d)
+    shutil.copytree(os.path.join(script_dir,"templates"),os.path.join(d,"templates"))
+    shutil.copytree(os.path.join(script_dir,"common"),os.path.join(d,"common"))
+
+    # the images of the common files are not kept with the
+    # scripts, make stand-ins if they are missing
+    idir = os.path.join(d,"common","processing_files","images")
+    os.makedirs(idir,exist_ok=True)
+    for name in ("missing_image.jpg","splash_page_image.jpg"):
+        if not os.path.exists(os.path.join(idir,name)):
+            Image.new("RGB",(300,200),(200,200,200)).save(os.path.join(idir,name))
+
+    root = Element("options")
+    values = {"url":"http://127.0.0.1:"+str(port),"user":"admin","password":"bench",
+              "outdir":"out","debug":"N","testmode":"N","maxretry":"1","retrysleep":"1"}
+    values.update(options)
+    for k in values:
+        SubElement(root,k).text = values[k]
+    ElementTree(root).write(os.path.join(d,"options.xml"),encoding="UTF-8")
+
+#
+# Function to return the resident memory in MB of a process and
+# all the processes it started, from /proc, or None if there is
+# no /proc
+#
+def treeRSS(pid):
+    if not os.path.exists("/proc/self/statm"):
+        return None
+
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            f = open(os.path.join("/proc",name,"stat"))
+            stat = f.read()
+            f.close()
+        except OSError:
+            continue
+        # the parent id follows the state, after the command
+        # name in brackets, which may have spaces in it
+        ppid = int(stat.rsplit(")",1)[1].split()[1])
+        children.setdefault(ppid,[]).append(int(name))
+
+    pages = 0
+    todo = [pid]
+    while len(todo)>0:
+        p = todo.pop()
+        todo.extend(children.get(p,[]))
+        try:
+            f = open(os.path.join("/proc",str(p),"statm"))
+            pages = pages+int(f.read().split()[1])
+            f.close()
+        except (OSError,IndexError,ValueError):
+            pass
+
+    return pages*os.sysconf("SC_PAGE_SIZE")/(1024.0*1024.0)
+
+#
+# Function to sample the memory of a process and the processes
+# it started until done is set. The largest total is kept in
+# peak[0].
+#
+def sampleRSS(pid,done,peak):
+    while not done.is_set():
+        rss = treeRSS(pid)
+        if rss == None:
+            return
+        if peak[0] == None or rss>peak[0]:
+            peak[0] = rss
+        done.wait(RSS_INTERVAL)
+
+#
+# Function to run a stage in the work directory. Returns the
+# exit status, wall time in seconds and peak memory in MB of
+# the stage and the processes it started, or None if the memory
+# could not be measured.
+#
+def runStage(name,d):
+    env = dict(os.environ)
+    # deconstructwp.py records these in the manifest
+    env.setdefault("OS",sys.platform)
+    env.setdefault("COMPUTERNAME",socket.gethostname())
+    env.setdefault("USERNAME",env.get("USER","bench"))
+
+    log = open(os.path.join(d,name+".log"),"w")
+    start = time.perf_counter()
+    p = subprocess.Popen([sys.executable,os.path.join(script_dir,name+".py")],cwd=d,env=env,
+                         stdout=log,stderr=subprocess.STDOUT)
+    done = threading.Event()
+    peak = [None]
+    sampler = threading.Thread(target=sampleRSS,args=(p.pid,done,peak),daemon=True)
+    sampler.start()
+    rss = None
+    if not resource == None and hasattr(os,"wait4"):
+        pid,status,usage = os.wait4(p.pid,0)
+        rc = os.waitstatus_to_exitcode(status)
+        p.returncode = rc
+        # the largest of the process and the processes it waited
+        # for, but not the sum of those that ran at the same time
+        rss = usage.ru_maxrss/1024.0
+        if sys.platform == "darwin":
+            # macOS gives bytes, not KB
+            rss = rss/1024.0
+    else:
+        rc = p.wait()
+    seconds = time.perf_counter()-start
+    done.set()
+    sampler.join()
+    log.close()
+
+    if not peak[0] == None and (rss == None or peak[0]>rss):
+        rss = peak[0]
+
+    return rc,seconds,rss
+
+#
+# Function to count the posts in the manifest, the XML manifest
+# or the SQLite manifest of the manifestdb option
+#
+def countPosts(d,options):
+    if "manifestdb" in options:
+        f = os.path.join(d,options["manifestdb"])
+        if not os.path.exists(f):
+            return 0
+        return len(manifestdb.scanDB(f)[2])
+    f = os.path.join(d,"manifestwp.xml")
+    if not os.path.exists(f):
+        return 0
+    n = 0
+    for event,e in iterparse(f):
+        if e.tag == "node":
+            n = n+1
+            e.clear()
+    return n
+
+#
+# Function to return the stages to run, with the fused option
+# deconstructwp.py makes the DITA output itself
+#
+def benchStages(options):
+    if options.get("fused","N")[0:1] == "Y":
+        return STAGES[0:1]
+    return STAGES
+
+#
+# Function to run the benchmark. Returns the results.
+#
+def runBench(args):
+    port = freePort()
+    options = dict(o.split("=",1) for o in args.option)
+    makeWorkDir(args.workdir,port,options)
+    srv = startServer(args,port)
+
+    results = {"site":{"posts":args.posts,"media":args.media,"images":args.images,
+                       "gallery":args.gallery,"latency":args.latency,"capacity":args.capacity},
+               "options":options,"stages":{}}
+    try:
+        for name in benchStages(options):
+            print("running",name)
+            before = serverStats(port)
+            rc,seconds,rss = runStage(name,args.workdir)
+            after = serverStats(port)
+            requests = after["rpc_requests"]-before["rpc_requests"]-1+after["media_requests"]-before["media_requests"]
+            r = {"rc":rc,"seconds":round(seconds,3),"peak_rss_mb":None,"requests":requests,
+                 "rpc_requests":after["rpc_requests"]-before["rpc_requests"]-1,
+                 "rpc_calls":after["rpc_calls"]-before["rpc_calls"],
+                 "media_requests":after["media_requests"]-before["media_requests"],
+                 "media_bytes":after["media_bytes"]-before["media_bytes"],
+                 "refused":after["refused"]-before["refused"]}
+            if not rss == None:
+                r["peak_rss_mb"] = round(rss,1)
+            r["requests_per_second"] = round(requests/seconds,1)
+            r["posts"] = countPosts(args.workdir,options)
+            r["posts_per_second"] = round(r["posts"]/seconds,1)
+            results["stages"][name] = r
+            if not rc == 0:
+                print("Error,",name,"ended with status",rc,"see",os.path.join(args.workdir,name+".log"))
+                break
+    finally:
+        srv.terminate()
+        srv.wait()
+
+    return results
+
+#
+# Function to print the results
+#
+def printResults(results):
+    print()
+    print("%-16s %4s %10s %10s %10s %10s %10s" % ("stage","rc","seconds","peak MB","requests","req/s","posts/s"))
+    for name in results["stages"]:
+        r = results["stages"][name]
+        rss = "-" if r["peak_rss_mb"] == None else "%.1f" % r["peak_rss_mb"]
+        print("%-16s %4d %10.3f %10s %10d %10.1f %10.1f" % (name,r["rc"],r["seconds"],rss,r["requests"],
+                                                          r["requests_per_second"],r["posts_per_second"]))
+
+#
+# Function to compare the results with a baseline. Returns the
+# list of regressions.
+#
+def compareBaseline(results,base,threshold):
+    regressions = []
+    print()
+    print("compared with the baseline, threshold %.0f%%:" % (threshold*100))
+    if not base.get("site") == results["site"]:
+        print(" Note, the baseline is of a different site",base.get("site"))
+    for name in results["stages"]:
+        r = results["stages"][name]
+        b = base.get("stages",{}).get(name)
+        if b == None:
+            continue
+        for k in COMPARED:
+            if r.get(k) == None or not b.get(k):
+                continue
+            change = (r[k]-b[k])/b[k]
+            flag = ""
+            if change>threshold:
+                flag = "  REGRESSION"
+                regressions.append(name+" "+k)
+            print(" %-16s %-12s %10.3f -> %10.3f %+7.1f%%%s" % (name,k,b[k],r[k],change*100,flag))
+
+    return regressions
+
+###################################
+# MAIN PROCESSING SECTION
+###################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark deconstructwp.py and manifest2ditawp.py on a made up site")
+    parser.add_argument("--posts",type=int,default=2000)
+    parser.add_argument("--media",type=int,default=8000,help="items in the media library")
+    parser.add_argument("--images",type=int,default=4,help="image references in each post")
+    parser.add_argument("--gallery",type=int,default=5,help="every n-th post has a gallery, 0 for none")
+    parser.add_argument("--latency",type=float,default=0,help="seconds the server delays each XML-RPC request")
+    parser.add_argument("--capacity",type=int,default=0,help="requests the server answers at once, 0 for no limit")
+    parser.add_argument("--option",action="append",default=[],metavar="NAME=VALUE",
+                        help="an options.xml setting for deconstructwp.py, may be repeated")
+    parser.add_argument("--workdir",default="wpbench.work",help="directory the stages run in, emptied first")
+    parser.add_argument("--output",default=None,help="JSON results file, default wpbench.json in the work directory")
+    parser.add_argument("--baseline",default=None,help="JSON results of an earlier run to compare with")
+    parser.add_argument("--save-baseline",action="store_true",help="write the results to the baseline file")
+    parser.add_argument("--threshold",type=float,default=0.2,help="allowed growth over the baseline, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    results = runBench(args)
+    printResults(results)
+
+    output = args.output or os.path.join(args.workdir,"wpbench.json")
+    f = open(output,"w")
+    json.dump(results,f,indent=2)
+    f.close()
+    print()
+    print("results written to",output)
+
+    failed = [n for n in results["stages"] if not results["stages"][n]["rc"] == 0]
+    if len(results["stages"])<len(benchStages(results["options"])):
+        failed.append("not all stages ran")
+
+    regressions = []
+    if not args.baseline == None:
+        if args.save_baseline:
+            shutil.copyfile(output,args.baseline)
+            print("baseline written to",args.baseline)
+        elif os.path.exists(args.baseline):
+            f = open(args.baseline)
+            base = json.load(f)
+            f.close()
+            regressions = compareBaseline(results,base,args.threshold)
+        else:
+            print("there is no baseline",args.baseline)
+
+    if len(failed)>0 or len(regressions)>0:
+        print()
+        print("FAILED:",", ".join(failed+regressions))
+        sys.exit(1)
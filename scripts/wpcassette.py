@@ -0,0 +1,365 @@
+###################################
+# PROLOG SECTION
+# wpcassette.py
+#
+# Record and replay of the traffic between deconstructwp.py and
+# a WordPress site, so a run can be repeated on a machine with no
+# network and the fetch stage can be timed without the noise of
+# a live site.
+#
+# In record mode every XML-RPC response and every media file
+# fetched is saved in a cassette directory. In replay mode the
+# saved responses are served back instead of going to the site,
+# after an optional injected latency per request, and a request
+# that was not recorded fails the way a missing page would.
+#
+# XML-RPC responses are keyed by the SHA-256 hash of the request
+# body, so the calls can be made in any order and any number at
+# a time. The read ahead of the pages of posts may ask for pages
+# past the end that the recorded run did not ask for. Those are
+# not in the cassette and fail, which does no harm since the
+# results past the end are dropped anyway.
+# Media files are keyed by url. A conditional GET for a
+# recorded url is answered with 304 when its validators match
+# the recorded ETag or Last-Modified, as the site would.
+#
+# Response bodies are stored by their SHA-256 content hash in
+# <cassette>/bodies/<first 2 hash chars>/<hash>, and the index is
+# kept in <cassette>/cassette.xml.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+import shutil
+import threading
+import hashlib
+import time
+import xmlrpc.client
+import urllib.error
+from xml.etree.ElementTree import *
+from ditapub import debugMode
+
+# global variables for this script
+cassette_dir = None
+cassette_mode = None
+cassette_latency = 0.0
+rpc_index = {}
+http_index = {}
+cassette_lock = threading.Lock()
+save_lock = threading.Lock()
+cassette_changes = 0
+cassette_hits = 0
+cassette_misses = 0
+
+# name of the index file in the cassette directory
+INDEX_FILE = "cassette.xml"
+# save the index after this many changes
+SAVE_EVERY = 500
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to open the cassette in directory d for mode
+# "record" or "replay", with latency seconds injected before
+# each replayed response. A recording adds to what the
+# cassette already holds.
+#
+def openCassette(d,mode,latency=0.0):
+    global cassette_dir
+    global cassette_mode
+    global cassette_latency
+    if debugMode():
+        print("openCassette",d,mode,latency)
+
+    if not mode in ("record","replay"):
+        raise ValueError("cassette mode must be record or replay, not "+str(mode))
+
+    ipath = d+os.sep+INDEX_FILE
+    if mode == "replay" and not os.path.exists(ipath):
+        raise FileNotFoundError("there is no cassette "+ipath+" to replay")
+    if not os.path.isdir(d+os.sep+"bodies"):
+        os.makedirs(d+os.sep+"bodies")
+
+    cassette_dir = d
+    cassette_mode = mode
+    cassette_latency = latency
+    rpc_index.clear()
+    http_index.clear()
+    if os.path.exists(ipath):
+        tree = ElementTree()
+        root = tree.parse(ipath)
+        for e in root.iter("rpc"):
+            rpc_index[e.get("key")] = e.get("body")
+        for e in root.iter("http"):
+            item = dict(e.attrib)
+            item["headers"] = dict((h.get("name"),h.text or "") for h in e.iter("header"))
+            http_index[e.get("url")] = item
+
+    print("cassette",d,"opened to",mode,"with",len(rpc_index),"XML-RPC responses and",
+          len(http_index),"media files")
+
+#
+# Functions to test the mode of the cassette
+#
+def recording():
+    return cassette_mode == "record"
+
+def replaying():
+    return cassette_mode == "replay"
+
+#
+# Function to return the latency to inject before a replayed
+# response, in seconds
+#
+def latency():
+    return cassette_latency
+
+#
+# Function to return the path of a stored body
+#
+def bodyPath(h):
+    return cassette_dir+os.sep+"bodies"+os.sep+h[0:2]+os.sep+h
+
+#
+# Function to store a body given as bytes, or as the file at
+# path with its known hash. Returns the hash of the body.
+#
+def storeBody(data=None,path=None,h=None):
+    if h == None:
+        h = hashlib.sha256(data).hexdigest()
+    bpath = bodyPath(h)
+    if os.path.exists(bpath):
+        return h
+
+    os.makedirs(os.path.dirname(bpath),exist_ok=True)
+    tmp = bpath+"."+str(threading.get_ident())
+    if data == None:
+        shutil.copyfile(path,tmp)
+    else:
+        f = open(tmp,"wb")
+        f.write(data)
+        f.close()
+    os.replace(tmp,bpath)
+
+    return h
+
+#
+# Function to read a stored body
+#
+def readBody(h):
+    f = open(bodyPath(h),"rb")
+    data = f.read()
+    f.close()
+    return data
+
+#
+# Function to count a change to the index and save the index
+# once enough changes have built up. Call with cassette_lock.
+#
+def countChange():
+    global cassette_changes
+    cassette_changes = cassette_changes+1
+    return cassette_changes>=SAVE_EVERY
+
+#
+# Function to record the response body of an XML-RPC request
+#
+def recordRPC(request,response):
+    key = hashlib.sha256(request).hexdigest()
+    h = storeBody(response)
+    with cassette_lock:
+        rpc_index[key] = h
+        save = countChange()
+    if save:
+        saveCassette()
+
+#
+# Function to return the recorded response body of an XML-RPC
+# request to url. A request that was not recorded raises
+# xmlrpc.client.ProtocolError, as a missing page would.
+#
+def replayRPC(request,url):
+    global cassette_hits
+    global cassette_misses
+
+    key = hashlib.sha256(request).hexdigest()
+    with cassette_lock:
+        h = rpc_index.get(key)
+        if h == None:
+            cassette_misses = cassette_misses+1
+        else:
+            cassette_hits = cassette_hits+1
+    if debugMode():
+        print("replayRPC",key,h)
+    if h == None:
+        raise xmlrpc.client.ProtocolError(url,404,"Not in cassette",{})
+
+    return readBody(h)
+
+#
+# Function to record the answer to a GET of a media url, from
+# the dictionary returned by httppool.fetchURL and the file the
+# body was written to
+#
+def recordURL(url,ret,path):
+    item = {"url":url,"status":str(ret["status"]),"headers":dict(ret["headers"])}
+    if ret["status"] == 200:
+        item["body"] = storeBody(path=path,h=ret["sha256"])
+
+    with cassette_lock:
+        # a 304 says nothing new about a url already recorded
+        if ret["status"] == 304 and url in http_index:
+            return
+        http_index[url] = item
+        save = countChange()
+    if save:
+        saveCassette()
+
+#
+# Function to record a GET of a media url that failed with an
+# HTTP error
+#
+def recordURLError(url,err):
+    with cassette_lock:
+        http_index[url] = {"url":url,"status":str(err.code),"reason":str(err.reason),"headers":{}}
+        save = countChange()
+    if save:
+        saveCassette()
+
+#
+# Function to test if the conditional GET headers of a request
+# match the validators of a recorded response
+#
+def notModified(headers,item):
+    rh = item["headers"]
+    if "If-None-Match" in headers and "etag" in rh:
+        return headers["If-None-Match"] == rh["etag"]
+    if "If-Modified-Since" in headers and "last-modified" in rh:
+        return headers["If-Modified-Since"] == rh["last-modified"]
+    return False
+
+#
+# Function to answer a GET of a media url from the cassette,
+# writing the body to path. Returns the same dictionary as
+# httppool.fetchURL, and raises urllib.error.HTTPError for a
+# recorded error or a url that was not recorded.
+#
+def replayURL(url,path,headers=None):
+    global cassette_hits
+    global cassette_misses
+    if debugMode():
+        print("replayURL",url)
+
+    if headers == None:
+        headers = {}
+    with cassette_lock:
+        item = http_index.get(url)
+        if item == None:
+            cassette_misses = cassette_misses+1
+        else:
+            cassette_hits = cassette_hits+1
+    if item == None:
+        raise urllib.error.HTTPError(url,404,"Not in cassette",None,None)
+
+    status = int(item["status"])
+    ret = {"url":url,"status":status,"headers":dict(item["headers"]),"bytes":0,"sha256":None}
+    if status == 304 or (status == 200 and notModified(headers,item)):
+        ret["status"] = 304
+        return ret
+    if not status == 200:
+        raise urllib.error.HTTPError(url,status,item.get("reason",""),None,None)
+
+    shutil.copyfile(bodyPath(item["body"]),path)
+    ret["bytes"] = os.path.getsize(path)
+    ret["sha256"] = item["body"]
+
+    return ret
+
+#
+# Function to write the cassette index
+#
+def saveCassette():
+    global cassette_changes
+    if not recording():
+        return
+
+    with save_lock:
+        with cassette_lock:
+            root = Element("cassette")
+            for key in rpc_index:
+                SubElement(root,"rpc",{"key":key,"body":rpc_index[key]})
+            for url in http_index:
+                item = http_index[url]
+                he = SubElement(root,"http",dict((k,v) for k,v in item.items() if not k == "headers"))
+                for name in item["headers"]:
+                    SubElement(he,"header",{"name":name}).text = item["headers"][name]
+            cassette_changes = 0
+
+        ipath = cassette_dir+os.sep+INDEX_FILE
+        ElementTree(root).write(ipath+".tmp",encoding="UTF-8")
+        os.replace(ipath+".tmp",ipath)
+
+#
+# Function to save the index and stop using the cassette
+#
+def closeCassette():
+    global cassette_mode
+    if cassette_mode == None:
+        return
+
+    if recording():
+        saveCassette()
+        print("cassette has",len(rpc_index),"XML-RPC responses and",len(http_index),"media files")
+    else:
+        print("cassette replayed",cassette_hits,"responses,",cassette_misses,"requests were not recorded")
+    cassette_mode = None
+
+#
+# Class for the XML-RPC transport of a ServerProxy that records
+# or replays its responses. The request body of each thread is
+# kept while its response is read, so a response, fault or not,
+# can be recorded before it is parsed.
+#
+class CassetteMixin:
+
+    # compressed responses could not be recorded as sent
+    accept_gzip_encoding = False
+
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.pending = threading.local()
+
+    def request(self,host,handler,request_body,verbose=False):
+        if replaying():
+            time.sleep(latency())
+            rbody = replayRPC(request_body,host+handler)
+            return xmlrpc.client.loads(rbody,use_builtin_types=self._use_builtin_types)[0]
+
+        self.pending.request = request_body
+        return super().request(host,handler,request_body,verbose)
+
+    def parse_response(self,response):
+        body = response.read()
+        if recording():
+            recordRPC(self.pending.request,body)
+        return xmlrpc.client.loads(body,use_builtin_types=self._use_builtin_types)[0]
+
+class CassetteTransport(CassetteMixin,xmlrpc.client.Transport):
+    pass
+
+class CassetteSafeTransport(CassetteMixin,xmlrpc.client.SafeTransport):
+    pass
+
+#
+# Function to make the transport for a ServerProxy to url
+#
+def makeTransport(url):
+    if url.lower().startswith("https:"):
+        return CassetteSafeTransport()
+    return CassetteTransport()
@@ -0,0 +1,1313 @@
+###################################
+# PROLOG SECTION
+# wpdita.py
+#
+# The DITA topics and maps of an archive, made from the nodes of
+# a manifest written by deconstructwp.py. manifest2ditawp.py
+# makes all the topics from a manifest and then the maps. The
+# fused mode of deconstructwp.py makes the topic of each post as
+# soon as the post is finished, from the text it has in memory,
+# and only reads the manifest back to make the maps at the end.
+#
+# The fused mode makes the topics in a worker process of lower
+# priority, so the topics are made while deconstructwp.py waits
+# for the site, without holding up the work it does meanwhile.
+#
+# A link to a post that is not known yet when a topic is made
+# points back to the topic itself, as links that do not resolve
+# always have. The hrefs are kept, and once the manifest is
+# complete the topics with links that now resolve are made again.
+#
+# A watch by deconstructwp.py makes the maps again after each
+# pass, but only writes the year maps and content type maps
+# whose entries the pass changed.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+import time
+import signal
+import shutil
+import concurrent.futures
+from xml.etree.ElementTree import *
+from PIL import Image
+from ditapub import debugMode, setdebug, spawnContext
+import manifestdb
+import wplayout
+import poststore
+
+# global variables for this script
+develflag = False
+cms = None
+DRUPAL = "Drupal"
+WORDPRESS = "WordPress"
+
+logfp = None
+# set true to add date and author to title
+longtitle = False
+
+# how to sort the topics in the output map
+STITLE = 1
+SCHRON = 2
+sorttype = SCHRON
+
+if sorttype == SCHRON:
+    NTYPE = 0
+    NCREATE = 1
+    NFNFT = 2
+    NFPATH = 3
+    NTITLE = -1
+else:
+    NTYPE = 0
+    NTITLE = 1
+    NCREATE = 2
+    NFNFT = 3
+    NFPATH = 4
+    
+
+# file object for the web site error log file, and how to open
+# it, the log is appended to once it was started
+log_fileobj = None
+log_mode = "w"
+log_file = "manifest2ditaError.log"
+text_log_file = "manifest2dita.log"
+
+# True when the manifest is a SQLite database
+manifest_db = False
+# the file layout and post store of the manifest
+layout = "flat"
+post_store = None
+
+# special image files used in processing
+missing_image =     "common/processing_files/images/missing_image.jpg"
+splash_page_image = "common/processing_files/images/splash_page_image.jpg"
+missing_image_path = None
+
+# maximum image width in pixels
+MAX_WIDTH = 450
+
+# the output directory
+outdir = "manifest.dita"
+imagedir = outdir+"/"+"images"
+imagedir_rel = "..\\images"
+
+# the DITA template files
+template = "templates/template.dita"
+template_map = "templates/template_pdf.ditamap"
+templatew_map = "templates/template_web.ditamap"
+template_dir_map = "templates/template_dir.ditamap"
+splash_page = "common/processing_files/splash_pages/splashpage_archive.dita"
+tstring = None
+doctype = None
+
+# the map entry of each node by id, the content type of each
+# node and the node each link points to
+node_data = {}
+nodetypeD = {}
+link2idD = {}
+# the output directory of each content type
+typedirs = {}
+# the file names of the directories read by actualPath
+dir_listings = {}
+# the hrefs that did not resolve in the topic being made, and
+# by node id those of each topic made
+unresolved_hrefs = []
+node_links = {}
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to write a text line to the
+# web site error log
+#
+def webErrorLog(*s):
+    global log_fileobj
+    global log_mode
+    
+    if debugMode():
+        print("webErrorLog:",s)
+
+    if log_fileobj == None:
+        log_fileobj = open(log_file, log_mode)
+        log_mode = "a"
+
+    print(s, file=log_fileobj)
+    print(s)
+
+    return
+
+#
+# Function to close the web site error log
+#
+def webErrorLogClose():
+    global log_fileobj
+    if not log_fileobj == None:
+        log_fileobj.close()
+        log_fileobj = None
+
+def setdevel(flag):
+    global develflag
+    develflag = flag
+    if develflag:
+        print("we are in developer mode!")
+    return
+
+def develMode():
+    return develflag
+
+#
+# Function to resize the image files
+#
+def resizeImages(imagedir):
+    if debugMode():
+        print("resizeImages",imagedir)
+
+    # maximum image width in pixels
+    maxwidth = MAX_WIDTH
+
+    if debugMode():
+        print("maximum image width",maxwidth)
+
+    cnt = 0
+    tot = 0
+
+    # get the file names of all the images
+    fnames = os.walk(imagedir)
+
+    for f in fnames:
+        dirp = f[0]
+        fns  = f[2]
+        
+        for img in fns:
+            tot=tot+1
+            infile = dirp+"/"+img
+            im = Image.open(infile)
+            width  = im.size[0]
+            height = im.size[1]
+        
+            # change widths, if required
+            if width>maxwidth:
+                cnt = cnt+1
+                newheight = int((float(maxwidth)/float(width))*float(height))
+                newwidth = maxwidth
+                if debugMode():
+                    print("resize",width,height,"to",newwidth,newheight,img)
+                out = im.resize((newwidth,newheight))
+                out.save(infile)
+
+        
+    return cnt
+
+#
+# Function to get case sensitive file path (used for name folding issues)
+#
+def actualPath(fp):
+    if debugMode():
+        print("actualPath",fp)
+
+    fdir = os.path.dirname(fp)
+    fbase = os.path.basename(fp)
+        
+    if os.path.exists(fp):
+        # the file exists, check for case match
+        # by reading the actual filenames from the directory,
+        # once for each directory, and again if the file was
+        # added since the directory was read
+        if fdir in dir_listings:
+            names,upper = dir_listings[fdir]
+        if not fdir in dir_listings or not fbase.upper() in upper:
+            dlist = os.listdir(fdir)
+            upper = {}
+            for f in dlist:
+                upper.setdefault(f.upper(),f)
+            names = set(dlist)
+            dir_listings[fdir] = (names,upper)
+        # all OK, we have a match
+        if fbase in names:
+            return fp
+        # check for case mismatch
+        if fbase.upper() in upper:
+            # return the correct case
+            return fdir+"/"+upper[fbase.upper()]
+        
+    else:
+        # return a missing file
+        return missing_image_path
+
+#
+# Function to log text to a file.
+#
+def logText(s):
+    global logfp
+
+    if logfp==None:
+        omode = "w"
+    else:
+        omode = "a"
+    
+    logfp = open(text_log_file,omode)
+
+    logfp.write(s)
+    logfp.write("\n")
+
+    logfp.close()
+
+    logfp = 1
+
+#
+# Function to get index of a SubElement
+#
+def getIndex(e,sub):
+    if debugMode():
+        print("getIndex",e.tag,sub)
+
+    # all children of an element
+    kids = list(e)
+    ind = 1
+    for kid in kids:
+        # check for right subelement
+        if kid.tag == sub:
+            return ind
+        ind = ind+1
+        
+    print("Error, getIndex did not find",sub,"in",e.tag)
+    return None
+
+#
+# Function to make a display format date for titles.
+#
+def titleDate(crd):
+    if debugMode():
+        print("titleDate",crd)
+
+    pmonth = ["January","February","March","April","May"]
+    pmonth2 = ["June","July","August","September","October","November","December"]
+    pmonth = pmonth+pmonth2
+
+    yr = crd[:4]
+    mon = int(crd[4:6])
+    day = crd[6:8]
+    
+    return pmonth[mon-1]+" "+day+", "+yr
+
+#
+# Function to create dictionary mapping child elements to parents
+# since we need a parent to use remove().
+#
+def parentMap(tree):
+    return dict((c, p) for p in tree.iter() for c in p)
+
+#
+# Function to create the path to an image
+#
+def imagePath(ifname):
+    if debugMode():
+        print("imagePath",ifname)
+
+    ibase = os.path.basename(ifname)
+    
+    return wplayout.topicUp(layout)+"images/"+wplayout.imageRelPath(layout,ibase)
+
+#
+# Function to return the content type of a node id, from the
+# database if the manifest is one
+#
+def nodeType(id):
+    if manifest_db:
+        return manifestdb.nodeType(id)
+    return nodetypeD.get(id)
+
+#
+# Function to return the node id a link points to, or None
+#
+def linkId(h):
+    if manifest_db:
+        return manifestdb.linkId(h)
+    return link2idD.get(h)
+
+#
+# Function to return the nodes of a content type element
+#
+def ctypeNodes(ctype):
+    if manifest_db:
+        return manifestdb.typeNodes(ctype.get("type"))
+    return ctype.findall("node")
+
+#
+# Function to update a reference to another DITA topic
+#
+def updateHref(h):
+    if debugMode():
+      print("updateHref",h)
+
+    hret = None
+    
+    if h.find("/?q=node/") == 0:
+        # get the node id
+        id = h[9:]
+        ntype = nodeType(id)
+        if not ntype == None:
+            hret = wplayout.topicUp(layout)+ntype+"/"+wplayout.topicRelPath(layout,id,ntype+"_"+id+".dita")
+        
+    else:
+        id = linkId(h)
+        if not id == None:
+            ntype = nodeType(id)
+            hret = wplayout.topicUp(layout)+ntype+"/"+wplayout.topicRelPath(layout,id,ntype+"_"+id+".dita")
+ 
+    if hret == None:
+        if debugMode():
+          webErrorLog("updateHref failed for",h)
+            
+    return hret
+
+#
+# Function to make element text bold
+#
+def makeBold(e):
+    if debugMode():
+        print("makeBold",e.tag)
+
+    b = Element("b")
+    etext = e.text
+    e.text = None
+    b.text = etext
+    e.insert(0,b)
+
+    return
+
+#
+# Function to convert an html document to DITA.
+# We can only handle a simple subset of all html.
+#
+def html2dita(e,dfile,id):
+    if debugMode():
+        print("html2dita",e.tag,dfile,id)
+        print(" input element:",tostring(e))
+    
+    #
+    # First pass: make all simple tag substitutions
+    #
+    
+    # a becomes xref or lines+filepath
+    
+    xrfs = e.iter("a")
+    for xrf in xrfs:
+        xrf.tag = "xref"
+        href = xrf.get("href")
+        if "target" in xrf.attrib:
+            # remove any target attributes
+            del xrf.attrib['target']
+        if "title" in xrf.attrib:
+            # remove any title attributes
+            del xrf.attrib['title']
+        # modify references to files
+        if not href==None:
+          if href.find("/wp-content/")>-1:
+            hrefbase = os.path.basename(href)
+            hreftext = xrf.text
+            xrf.clear()
+            xrf.tag="lines"
+            xrf.text = hreftext
+            xrfp = SubElement(xrf,"filepath")
+            xrfp.text = "["+hrefbase+"] "
+          else:
+            hrefnew = updateHref(xrf.get("href"))
+            if hrefnew == None:
+                unresolved_hrefs.append(href)
+                xrf.set("href",dfile+"#"+id)
+            else: 
+                xrf.set("href", hrefnew)
+        else:
+            # dummy out xref with no href
+            xrf.tag = "p"
+
+                      
+                   
+    # h4 becomes p
+    for h4 in e.iter("h4"):
+        h4.tag = "p"
+
+    # em becomes b
+    for em in e.iter("em"):
+        em.tag = "b"
+
+    # strong becomes b
+    for em in e.iter("strong"):
+        em.tag = "b"
+
+    # blockquote becomes p
+    for bq in e.iter("blockquote"):
+        bq.tag = "p"
+        
+    # img becomes image
+    for img in e.iter("img"):
+        src = img.get("src")
+        alt = img.text
+        img.clear()
+        img.set("href",imagePath(src))
+        img.tag = "image"
+        ealt = SubElement(img,"alt")
+        ealt.text = alt
+
+    # figure becomes fig
+    #  figcaption becomes the fig title, which comes first
+    for fig in list(e.iter("figure")):
+        fig.tag = "fig"
+        fig.attrib.clear()
+        cap = fig.find("figcaption")
+        if not cap == None:
+            fig.remove(cap)
+            cap.tag = "title"
+            cap.tail = None
+            fig.insert(0,cap)
+
+    # table becomes simpletable
+    #  tr becomes strow
+    #  td becomes stentry
+    for tab in e.iter("table"):
+        tab.tag = "simpletable"
+    for tr in e.iter("tr"):
+        tr.tag = "strow"
+    for td in e.iter("td"):
+        td.tag = "stentry"
+
+    # get rid of content and itemprop attributes
+    for et in e.iter():
+        if "itemprop" in et.attrib:
+            del et.attrib["itemprop"]
+        if "content" in et.attrib:
+            del et.attrib["content"]
+
+    #
+    # Second pass: create multiple sections for h2 and
+    # nested sectiondiv for h3.
+    #
+
+    slist = []
+    elist = list(e)
+    # initialize a section
+    section = Element("section")
+    sectionp = section
+    slist.append(section)
+    sectid = "body_section"
+    section.set("id",sectid)
+    nsect = 0
+
+    # pick up text not inside an element
+    sectionp.text = e.text
+    
+    for ee in elist:
+        if ee.tag=="h2":
+            # h2 starts a new section with a title
+            section = Element("section")
+            sectionp = section
+            stitle = SubElement(section,"title")
+            stitle.text = ee.text
+            nsect = nsect+1
+            section.set("id",sectid+"_"+str(nsect))
+            slist.append(section)
+        elif ee.tag=="h3":
+            # h3 starts a sectiondiv within the current section
+            sectiondiv = ee
+            ee.tag = "sectiondiv"
+            # fake up a title line, since sectiondiv does not allow a title subelement
+            sectiondivp = SubElement(sectiondiv,"p")
+            sectiondivpb = SubElement(sectiondivp,"b")
+            sectiondivpb.text = ee.text
+            sectionp = sectiondiv
+            nsect = nsect+1
+            sectiondiv.set("id",sectid+"_div_"+str(nsect))
+        else:
+            # add everything else to the current section
+            sectionp.append(ee)
+            
+        
+    
+    return slist
+
+#
+# Function to gather the nodes of each content type under the
+# first ctype element of that type. The manifest writer of
+# deconstructwp.py starts a new ctype element whenever the
+# type of the next post is another one, so a type can have more
+# than one.
+#
+def mergeCtypes(root):
+    if debugMode():
+        print("mergeCtypes")
+
+    first = {}
+    for ce in root.findall("ctype"):
+        c = ce.get("type")
+        if not c in first:
+            first[c] = ce
+            continue
+        for ne in ce.findall("node"):
+            first[c].append(ne)
+        root.remove(ce)
+
+    return len(first)
+
+#
+# Function to filter the input text
+#
+def filterText(t):
+
+    # here you can edit the node text as a string
+    ft = t
+    
+    return ft
+
+#
+# Function to create a DITA file from a node, with the text of
+# the node if it is given, otherwise it is read
+#
+def makeDITA(ts,ctp,node,idir,node_text=None):
+
+    # maximum images per row
+    maxrow = 3
+    
+    if debugMode():
+        print("makeDITA",ctp,node.get("id"),node.text)
+  
+    
+    # initialize the DITA XML
+    root = fromstring(ts)
+    tree = ElementTree()
+    tree._setroot(root)
+            
+    node_id = node.get("id")
+    node_author = node.get("user")
+    node_created = node.get("created")
+    node_textp = node.get("path")
+    
+    # read in the node body text file, or the text in the
+    # post store
+    if node_text == None and post_store == None:
+        fp = open(node_textp,"r")
+        node_text = fp.read()
+        fp.close()
+    elif node_text == None:
+        node_text = poststore.readPost(node_textp)
+        if node_text == None:
+            webErrorLog("Error, the post store does not have",node_textp)
+            node_text = ""
+
+    # set output id and file path
+    ditaid = ctp+"_"+node_id
+    ditafile = ditaid+".dita"
+    addNode(ctp,node)
+    del unresolved_hrefs[:]
+     
+    title_date = titleDate(node_created)
+
+    # get all the image elements for the node
+    images = node.find("images")
+    imagelist = iter(images)
+
+    top_images = []
+    bot_images = []
+    
+    # build the image lists
+    for image in imagelist:
+        top_images.append(image)
+       
+    # common for all content types
+    root.set("id",ditaid)
+    titlee = root.find("title")
+    # title
+    if develMode():
+      title_date=title_date+" "+ditafile
+    if longtitle:
+      titlee.text = node.text+" - "+title_date+", by "+node_author
+    else:
+        titlee.text = node.text
+
+    # find the body
+    conbody = root.find("conbody")
+
+    # tags
+    keywords = root.find("prolog/metadata/keywords")
+    tags = node.find("tags")
+    tlist = iter(tags)
+    for t in tlist:
+        indt = SubElement(keywords,"indexterm")
+        indt.text = t.text
+
+    # create a section for the top images
+    if len(top_images)>0:
+        section = SubElement(conbody,"section")
+        section.set("id","images_top")
+        sectp = SubElement(section,"p")
+        ni = 0
+        for imge in top_images:
+          imagefn = idir+'/'+imge.get("filename")
+          imagefn = imagefn.replace("\\","/")
+          img = SubElement(sectp,"image")
+          img.set("href",imagePath(imagefn))
+          if not imge.text==None:
+            img.set("alt",imge.text)
+          ni=ni+1
+          if ni>=maxrow:
+              sectp = SubElement(section,"p")
+              ni=0
+              
+        
+    # create a section for the text
+    
+    # get filtered node text
+    filtered = filterText(node_text)
+        
+    # write out text in case we bomb out trying to parse it
+    fpp = open("debug.xml","w")
+    fpp.write(filtered)
+    fpp.close()
+        
+        
+    # make sure text is valid XML
+    try:
+        section = XML(filtered)
+        # make the root be a section
+        section.tag = "section"
+        section.set("id","node_text")
+        if debugMode():
+            print("filtered section:")
+            print(tostring(section))
+                
+            
+    except:
+        webErrorLog("Invalid node text in:",ctp,node.get("id"),node.text)
+        logText("Invalid node text")
+        logText(" node id: "+node.get("id"))
+        logText(" node_text:")
+        logText(node_text)
+        logText(" filtered text:")
+        logText(filtered)
+        logText(" ")
+            
+        section = SubElement(conbody,"section")
+        sectp = SubElement(section,"p")
+        sectp.text = "** invalid XML **"
+
+    dita_sections = html2dita(section,ditafile,ditaid)
+    # keep the links that may resolve once all the nodes are known
+    if len(unresolved_hrefs)>0:
+        node_links[node_id] = list(unresolved_hrefs)
+    elif node_id in node_links:
+        del node_links[node_id]
+            
+    # add the text as sections
+    for dita_section in dita_sections:
+        if debugMode():
+          print("dita_section:",tostring(dita_section))
+        conbody.append(dita_section)
+                 
+    # create a section for the bottom images
+    if len(bot_images)>0:
+        section = SubElement(conbody,"section")
+        section.set("id","images_bottom")
+        sectp = SubElement(section,"p")
+        ni=0
+        for imge in bot_images:
+          imagefn = idir+'/'+imge.get("filename")
+          imagefn = imagefn.replace("\\","/")
+          img = SubElement(sectp,"image")
+          img.set("href",imagePath(imagefn))
+          if not imge.text==None:
+             img.set("alt",imge.text)
+          ni=ni+1
+          if ni>=maxrow:
+              sectp = SubElement(section,"p")
+              ni=0
+
+    # patch things up for image href values
+    imgs = root.findall("*//image")
+    for img in imgs:
+        ipath = img.get("href")
+        ipath_base = os.path.basename(ipath)
+        ipath_full = imagedir+"/"+wplayout.imageRelPath(layout,ipath_base)
+        
+        apath_full = actualPath(ipath_full)
+        apath_base = os.path.basename(apath_full)
+        
+        if not os.path.exists(ipath_full):
+            webErrorLog(ditafile)
+            webErrorLog("missing image",ipath_full)
+            img.set("href",imagePath(missing_image))
+        else:
+            img.set("href",os.path.dirname(ipath)+"/"+apath_base)
+        
+    try:
+        # return the DITA topic as a string
+        retstr = tostring(root)
+    except:
+        webErrorLog("Oh oh!, the DITA file is not XML")
+        dump(root)
+        exit(0)
+        
+    return retstr
+
+#
+# Function to set the file layout of the output, see wplayout.py
+#
+def set_layout(l):
+    global layout
+    layout = l
+
+#
+# Function to add the map entry of a node, with the path of its
+# topic file in the content type directory
+#
+def addNode(ctp,node):
+    node_id = node.get("id")
+    node_created = node.get("created")
+    ditarel = wplayout.topicRelPath(layout,node_id,ctp+"_"+node_id+".dita")
+    typedirs[ctp] = outdir+os.sep+ctp
+
+    if sorttype == SCHRON:
+     node_data[node_id] = [ctp,node_created,ditarel,ctp+os.sep+ditarel]
+    else:
+     title_key = node.text.upper()
+     title_key = title_key.strip()
+     title_key = title_key.replace('\n','')
+     while '  ' in title_key:
+         title_key = title_key.replace('  ',' ')
+     node_data[node_id] = [ctp,title_key,node_created,ditarel,ctp+os.sep+ditarel]
+
+#
+# Function to add the link and content type of a node to the
+# dictionaries links are resolved with
+#
+def addLinks(ctp,node):
+    id = node.get("id")
+    nlink = node.get("link")
+    lpos = nlink.rfind("/")
+    nlinkbase = nlink[lpos+1:]
+    link2idD["?q="+nlinkbase] = id
+    link2idD[nlinkbase] = id
+    nodetypeD[id] = ctp
+
+#
+# Function to read a manifest, an XML file or a SQLite database.
+# Returns the root element with a ctype element for each content
+# type. The nodes of an XML manifest are in its ctype elements,
+# those of a database are read a content type at a time.
+#
+def readManifest(input_file):
+    global manifest_db
+    global cms
+    global layout
+    global post_store
+    if debugMode():
+        print("readManifest",input_file)
+
+    nodetypeD.clear()
+    link2idD.clear()
+    node_data.clear()
+    manifest_db = manifestdb.isManifestDB(input_file)
+    if manifest_db:
+        # read the content types and run information from the
+        # database, the nodes are read a content type at a time
+        manifestdb.openDB(input_file)
+        root = Element("manifest")
+        for k in ("images","outdir","layout","poststore"):
+            v = manifestdb.getInfo(k)
+            if not v == None:
+                root.set(k,v)
+        for c,d in manifestdb.categories():
+            SubElement(root,"ctype",{"type":c,"dir":d})
+
+        # determine CMS
+        cms = manifestdb.getInfo("CMS")
+        if cms == None:
+            cms = DRUPAL
+    else:
+        # build a tree from the manifest XML
+        intree = ElementTree()
+        intree.parse(input_file)
+
+        # get the root element
+        root = intree.getroot()
+        if debugMode():
+            print("XML root:",root.tag)
+        mergeCtypes(root)
+
+        # determine CMS
+        incmse = root.find("CMS")
+        if not incmse == None:
+            cms = incmse.text
+        else:
+            cms = DRUPAL
+
+        # loop thru the category nodes and build dictionaries,
+        # the database looks the links up in its indexes instead
+        for ctype in root.findall("ctype"):
+            for node in ctype.findall("node"):
+                addLinks(ctype.get("type"),node)
+
+    layout = root.get("layout","flat")
+    post_store = root.get("poststore")
+    # map the post store, the texts are read from it as the
+    # topics are made
+    if not post_store == None:
+        poststore.mapStore(post_store)
+
+    return root
+
+#
+# Function to close the manifest
+#
+def closeManifest():
+    global manifest_db
+    if manifest_db:
+        manifestdb.closeReader()
+        manifest_db = False
+    if not post_store == None:
+        poststore.unmapStore()
+
+#
+# Function to read the topic template
+#
+def readTemplate():
+    global tstring
+    global doctype
+    global missing_image_path
+
+    missing_image_path = imagedir+"/"+os.path.basename(missing_image)
+    # read in the template DITA file (a concept)
+    fp = open(template,"r")
+    tstring = fp.read()
+    fp.close()
+    # save doctype
+    p = tstring.find("<concept")
+    doctype = tstring[0:p]
+
+#
+# Function to set up the output directory, with the splash page
+# and the special images, and read the topic template
+#
+def startOutput():
+    if debugMode():
+        print("startOutput",outdir)
+
+    # copy the web splash page
+    shutil.copy(splash_page,outdir)
+    if not os.path.isdir(imagedir):
+        os.makedirs(imagedir)
+    # add the missing image
+    shutil.copyfile(missing_image,imagedir+"/"+os.path.basename(missing_image))
+    # add the splash page image
+    shutil.copy(splash_page_image,imagedir)
+    readTemplate()
+    # start the logs over
+    webErrorLogClose()
+    for f in (log_file,text_log_file):
+        if os.path.exists(f):
+            os.remove(f)
+    continueLogs()
+
+    node_data.clear()
+    typedirs.clear()
+    dir_listings.clear()
+    node_links.clear()
+
+#
+# Function to copy a stored image to the output images and
+# resize it to the maximum width, if it is not there yet
+#
+def copyImage(ipath,fname):
+    opath = imagedir+"/"+wplayout.imageRelPath(layout,fname)
+    if os.path.exists(opath):
+        return
+    if debugMode():
+        print("copyImage",ipath,opath)
+
+    wplayout.makeDir(os.path.dirname(opath))
+    im = Image.open(ipath)
+    width  = im.size[0]
+    height = im.size[1]
+    if width>MAX_WIDTH:
+        newheight = int((float(MAX_WIDTH)/float(width))*float(height))
+        out = im.resize((MAX_WIDTH,newheight))
+        out.save(opath+".tmp",im.format)
+        os.replace(opath+".tmp",opath)
+    else:
+        im.close()
+        shutil.copyfile(ipath,opath)
+
+#
+# Function to return the path of the topic file of a node
+#
+def topicPath(ctp,id):
+    return outdir+os.sep+ctp+os.sep+wplayout.topicRelPath(layout,id,ctp+"_"+id+".dita")
+
+#
+# Function to make the topic of a node and write it out, with
+# the text of the node if it is given
+#
+def writeTopic(ctp,node,node_text=None):
+    nid = node.get("id")
+    # create the node DITA topic
+    makedita = makeDITA(tstring,ctp,node,imagedir_rel,node_text)
+    # append the doctype to the XML for the node
+    dita_file = doctype+makedita.decode()
+    outpath = outdir+os.sep+node_data[nid][NFPATH]
+    # not wplayout.makeDir, deconstructwp.py removes topic
+    # directories left empty while the topic process runs on
+    os.makedirs(os.path.dirname(outpath),exist_ok=True)
+
+    # write the DITA source file out
+    print("  writing",outpath)
+    fp = open(outpath,"w")
+    fp.write(dita_file)
+    fp.close()
+
+#
+# Function to start the worker process that makes the topics of
+# a fused run, started with spawn, see spawnContext in ditapub.py.
+# The process only needs this module.
+#
+def startTopicProcess():
+    if debugMode():
+        print("startTopicProcess")
+
+    ctx = spawnContext()
+    return concurrent.futures.ProcessPoolExecutor(max_workers=1,mp_context=ctx,
+                                                  initializer=initTopicProcess,initargs=(debugMode(),layout))
+
+#
+# Function run when the topic process starts. An interrupt is
+# left to the main process, which stops the topic process.
+#
+def initTopicProcess(debug,lay):
+    setdebug(debug)
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    set_layout(lay)
+    readTemplate()
+    continueLogs()
+    # give way to the process waiting for the site
+    if hasattr(os,"nice"):
+        os.nice(10)
+
+#
+# Function to make the topic of a finished post in the topic
+# process, after copying its images, each (path,file name), to
+# the output images. Returns the seconds it took and the hrefs
+# that did not resolve.
+#
+def makeTopic(ctp,node,node_text,images):
+    start = time.perf_counter()
+    for ipath,fname in images:
+        copyImage(ipath,fname)
+    addLinks(ctp,node)
+    writeTopic(ctp,node,node_text)
+    # the log lines of the topic must be in the log before the
+    # process that started the topic writes to it
+    webErrorLogClose()
+
+    return time.perf_counter()-start,node_links.get(node.get("id"),[])
+
+#
+# Function to append to the logs from now on, they are shared
+# with the topic process of a fused run
+#
+def continueLogs():
+    global log_mode
+    global logfp
+    log_mode = "a"
+    logfp = 1
+
+#
+# Function to keep the hrefs that did not resolve in the topic
+# of a node made in the topic process
+#
+def addNodeLinks(id,hrefs):
+    if len(hrefs)>0:
+        node_links[id] = hrefs
+    elif id in node_links:
+        del node_links[id]
+
+#
+# Function to return the ids of the topics made with links that
+# did not resolve then and do now
+#
+def relinkNodes():
+    relink = set()
+    for id in node_links:
+        for h in node_links[id]:
+            if not updateHref(h) == None:
+                relink.add(id)
+                break
+
+    return relink
+
+#
+# Function to test if the maps of a content type, or of one of
+# its years, are to be written. All of them are if touched is
+# None.
+#
+def mapTouched(touched,ctp,year=None):
+    if touched == None:
+        return True
+    if not ctp in touched:
+        return False
+    return year == None or year in touched[ctp]
+
+#
+# Function to return the years of each content type whose maps
+# change from the map entries in old to those of the nodes added
+# since, as a dictionary of sets of years by content type
+#
+def changedMaps(old):
+    touched = {}
+    for id in set(old)|set(node_data):
+        o = old.get(id)
+        n = node_data.get(id)
+        if o == n:
+            continue
+        for d in (o,n):
+            if not d == None:
+                touched.setdefault(d[NTYPE],set()).add(d[NCREATE][0:4])
+
+    return touched
+
+#
+# Function to write the maps, a map for each content type, in
+# the order of ctps, and a master map for everything. If touched
+# is given, only the content type and year maps in it are
+# written, see changedMaps, and the year maps left with no
+# topics are removed.
+#
+def writeMaps(ctps,touched=None):
+    if debugMode():
+        print("writeMaps",ctps)
+
+    node_array = []
+    for tid in node_data:
+        node_array.append(node_data[tid])
+
+    # make a list of topics in type and creation or title order
+    if sorttype == SCHRON:
+        node_array.sort(reverse=True)
+    else:
+        node_array.sort()
+
+    # read in the book template ditamap file
+    fp = open(template_map,"r")
+    mapstring = fp.read()
+    fp.close()
+    # save the book doctype
+    p = mapstring.find("<bookmap")
+    bookdoctype = mapstring[0:p]
+    # initialize the book map DITA XML
+    bookroot = fromstring(mapstring)
+
+    # read in the web template ditamap file
+    fp = open(templatew_map,"r")
+    mapstringw = fp.read()
+    fp.close()
+    # save the web doctype
+    pw = mapstringw.find("<map")
+    mapdoctype = mapstringw[0:pw]
+    # initialize the web map DITA XML
+    maproot = fromstring(mapstringw)
+
+    # locate the frontmatter in the PDF map
+    ipoint = getIndex(bookroot,"frontmatter")
+    # set the start of the web map
+    ipointw = 1
+
+    # update the web map with a splash page
+    mapwe = Element("topicref")
+    mapwe.set("href",os.path.basename(splash_page))
+    mapwe.set("format","dita")
+    maproot.insert(ipointw,mapwe)
+    ipointw = ipointw+1
+
+    # write out the maps for each content type
+    for ctp in ctps:
+      # read in the directory template ditamap file
+      fp = open(template_dir_map,"r")
+      dirmapstring = fp.read()
+      fp.close()
+      # save the doctype
+      p = dirmapstring.find("<map")
+      dirdoctype = dirmapstring[0:p]
+
+      # initialize the content type map
+      dirroot = fromstring(dirmapstring)
+      dirroot.set("id",ctp+"_id")
+      dirroot.set("title",ctp+" pages")
+
+      # create a container topic for the content type
+      container = fromstring(tstring)
+      container.set("id",ctp+"_container_topic")
+      title = container.find("title")
+      dctp = ctp
+      dctp = dctp.replace("_"," ")
+      title.text = dctp.capitalize()+" topics"
+
+      # put the container topic in the content type map
+      contref = SubElement(dirroot,"topicref")
+      fnft = ctp+"_container.dita"
+      contref.set("href",fnft)
+
+      # loop through the ordered array of topics of this type
+      tyear = None
+      tyears = set()
+      ntop = 0
+      for topic in [l for l in node_array if l[NTYPE]==ctp]:
+        ntop=ntop+1
+        cr = topic[NCREATE]
+        cryr = cr[0:4]
+        fnft = topic[NFNFT]
+
+        # create a topicref for this year, if required
+        if (tyear==None) or (not tyear==cryr):
+            if not tyear==None and mapTouched(touched,ctp,tyear):
+                # write out the previous year map
+                yfnft = "year_"+tyear+".ditamap"
+                outypath = typedirs[ctp]+"/"+yfnft
+                fp = open(outypath,"w")
+                if debugMode():
+                    print("writing",outypath)
+                outstry = mapdoctype+tostring(yrroot).decode()
+                fp.write(outstry)
+                fp.close()
+                # write out the container for the year
+                outypath = typedirs[ctp]+"/"+ycontfnft
+                fp = open(outypath,"w")
+                if debugMode():
+                    print("  writing",outypath)
+                outstry = doctype+tostring(ycontainer).decode()
+                fp.write(outstry)
+                fp.close() 
+
+            tyear = cryr
+            tyears.add(tyear)
+
+            # initialize the year submap DITA XML
+            yrroot = fromstring(dirmapstring)
+            yrroot.set("id",ctp+"_year_"+tyear+"_id")
+            yrroot.set("title",tyear)
+            # put the year map in the content type map
+            yfnft = "year_"+tyear+".ditamap"
+            ysubmap = SubElement(contref,"topicref")
+            ysubmap.set("href",yfnft)
+            ysubmap.set("navtitle",tyear)
+            ysubmap.set("toc","yes")
+            ysubmap.set("format","ditamap")
+            # create a container topic for the year map
+            ycontainer = fromstring(tstring)
+            ycontainer.set("id","year_"+tyear+"_container_topic")
+            ytitle = ycontainer.find("title")
+            ytitle.text = tyear
+            yconbody = ycontainer.find("conbody")
+            ycontsection = SubElement(yconbody,"section")
+            ycontp = SubElement(ycontsection,"p")
+            ycontp.text = tyear
+            ycontsl = SubElement(ycontp,"sl")
+            ycontsl.set("otherprops","pdf")
+            # add the container to the year map
+            ycontfnft = "year_"+tyear+"_container.dita"
+            yconte = SubElement(yrroot,"topicref")
+            yconte.set("href",ycontfnft)
+
+
+        # add this topic to the year map below the container
+        topicref = SubElement(yconte,"topicref")
+        topicref.set("href",fnft)
+        topicref.set("toc","no")
+        # add this topic to the year container topic
+        ycontsli = SubElement(ycontsl,"sli")
+        ycontxref = SubElement(ycontsli,"xref")
+        ycontxref.set("href",fnft)
+
+
+      # write out the container topic
+      if ntop>0:
+        fnft = ctp+"_container.dita"
+        outcpath = typedirs[ctp]+"/"+fnft
+        if mapTouched(touched,ctp):
+          fp = open(outcpath,"w")
+          if debugMode():
+            print("  writing",outcpath)
+          outstr = doctype+tostring(container).decode()
+          fp.write(outstr)
+          fp.close()
+
+        # write out the last year map
+        yfnft = "year_"+tyear+".ditamap"
+        outypath = typedirs[ctp]+"/"+yfnft
+        if mapTouched(touched,ctp,tyear):
+          fp = open(outypath,"w")
+          if debugMode():
+            print("writing",outypath)
+          outstry = mapdoctype+tostring(yrroot).decode()
+          fp.write(outstry)
+          fp.close()
+          # write out the container for the year
+          outypath = typedirs[ctp]+"/"+ycontfnft
+          fp = open(outypath,"w")
+          if debugMode():
+            print("writing",outypath)
+          outstry = doctype+tostring(ycontainer).decode()
+          fp.write(outstry)
+          fp.close() 
+
+        # write out content type map
+        outmappath = typedirs[ctp]+"/"+ctp+".ditamap"
+        if mapTouched(touched,ctp):
+          outstr = dirdoctype+tostring(dirroot).decode()
+          fp = open(outmappath,"w")
+          if debugMode():
+            print("writing",outmappath)
+          fp.write(outstr)
+          fp.close()
+
+        # update the book map
+        mape = Element("chapter")
+        mape.set("href",ctp+"/"+ctp+".ditamap")
+        mape.set("format","ditamap")
+        bookroot.insert(ipoint,mape)
+        ipoint=ipoint+1
+
+        # update the web map
+        mapwe = Element("topicref")
+        mapwe.set("href",ctp+"/"+ctp+".ditamap")
+        mapwe.set("format","ditamap")
+        maproot.insert(ipointw,mapwe)
+        ipointw = ipointw+1
+
+      # remove the maps of the touched years left with no topics
+      if not touched == None and ctp in touched:
+        for y in touched[ctp]-tyears:
+          for fnft in ("year_"+y+".ditamap","year_"+y+"_container.dita"):
+            outypath = typedirs.get(ctp,outdir+os.sep+ctp)+"/"+fnft
+            if os.path.exists(outypath):
+              print("removing",outypath)
+              os.remove(outypath)
+
+    print()
+    # write out the book map
+    outstr = bookdoctype+tostring(bookroot).decode()
+    outmappath = outdir+os.sep+"WParchive_pdf.ditamap"
+    fp = open(outmappath,"w")
+    print("writing",outmappath)
+    fp.write(outstr)
+    fp.close()
+
+    # write out the web map
+    outstr = mapdoctype+tostring(maproot).decode()
+    outmappath = outdir+os.sep+"WParchive_web.ditamap"
+    fp = open(outmappath,"w")
+    print("writing",outmappath)
+    fp.write(outstr)
+    fp.close()
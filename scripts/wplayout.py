@@ -0,0 +1,108 @@
+###################################
+# PROLOG SECTION
+# wplayout.py
+#
+# The layouts of the files deconstructwp.py writes, shared with
+# manifest2ditawp.py so both stages find the files the same way.
+# The layout of a run is recorded in the layout attribute of its
+# manifest.
+#
+#  flat  every post of a category in the category directory and
+#        every image in the images directory, as it always was
+#  hash  the posts of a category in 256 subdirectories by the
+#        first two hex digits of the MD5 hash of the post id,
+#        and the images in 256 subdirectories by the first two
+#        characters of their name, which is their content hash
+#  date  the posts of a category in year/month subdirectories
+#        by the date the post was created, and the images as
+#        in the hash layout, since an image can be shared by
+#        posts of any date
+#
+# manifest2ditawp.py puts the DITA topics of a content type in
+# the same 256 subdirectories as hash layout posts, for either
+# sharded layout. A link to a topic only has the node id to go
+# by, so the directory of a topic comes from its id alone.
+#
+# With 100,000 files or more in one directory, making, listing
+# and looking up files is slow on many file systems.
+#
+# Only stored images, named by their 64 hex digit SHA-256 hash,
+# are put in subdirectories. Other image files, like the missing
+# image of manifest2ditawp.py, stay in the images directory.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+import re
+import hashlib
+import threading
+
+# the layouts
+LAYOUTS = ("flat","hash","date")
+
+# the subdirectories made so far
+made_dirs = set()
+made_lock = threading.Lock()
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to make a directory if it was not made before by
+# this run
+#
+def makeDir(d):
+    with made_lock:
+        if d in made_dirs:
+            return
+        os.makedirs(d,exist_ok=True)
+        made_dirs.add(d)
+
+#
+# Function to return the directory of a post in its category
+# directory, by its id and creation date, yyyymmdd...
+#
+def postDir(layout,cdir,pid,pdate):
+    if layout == "hash":
+        return cdir+os.sep+hashlib.md5(pid.encode("utf-8")).hexdigest()[0:2]
+    if layout == "date":
+        return cdir+os.sep+pdate[0:4]+os.sep+pdate[4:6]
+    return cdir
+
+#
+# Function to return the path of the DITA topic file of a node
+# relative to its content type directory, with / separators
+#
+def topicRelPath(layout,id,fname):
+    if layout in ("hash","date"):
+        return hashlib.md5(id.encode("utf-8")).hexdigest()[0:2]+"/"+fname
+    return fname
+
+#
+# Function to return the relative path from a DITA topic up to
+# the output directory
+#
+def topicUp(layout):
+    if layout in ("hash","date"):
+        return "../../"
+    return "../"
+
+#
+# Function to test if an image file name is a content hash
+#
+def isStoredImage(fname):
+    return not re.match("[0-9a-f]{64}(\\.|$)",fname) == None
+
+#
+# Function to return the path of an image file relative to the
+# images directory, with / separators
+#
+def imageRelPath(layout,fname):
+    if layout in ("hash","date") and isStoredImage(fname):
+        return fname[0:2]+"/"+fname
+    return fname
@@ -0,0 +1,281 @@
+###################################
+# PROLOG SECTION
+# wpmanifest.py
+#
+# A streaming writer for the manifest made by deconstructwp.py.
+# Instead of building the whole manifest tree in memory and
+# writing it at the end of the run, each post is written out as
+# soon as it is finished, as a <node> in a <ctype> element of
+# its content type. Posts of the same type in a row share their
+# <ctype> element, a post of another type closes it and opens
+# the next one:
+#
+#  <manifest images="..." outdir="...">
+#   <timestamp>...</timestamp> ...
+#   <ctype type="News" dir="out/News">
+#    <node id="12" .../>
+#    <node id="11" .../>
+#   </ctype>
+#   <ctype type="Sports" dir="out/Sports">
+#    <node id="10" .../>
+#   </ctype>
+#   ...
+#   <watermark modified="20160612T11:00:00"/>
+#  </manifest>
+#
+# so a content type can appear more than once. Readers collect
+# the nodes of a type from all its <ctype> elements. The
+# watermark, the newest post modification time, comes last since
+# it is only known at the end.
+#
+# The manifest is written to <manifest>.tmp, synced to disk and
+# renamed over the manifest when it is complete, so the manifest
+# of the last run stays in place until then, even if the system
+# goes down.
+#
+# A manifest file that is a SQLite database, or named .db, is
+# written and read with manifestdb.py instead.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import os
+from xml.sax.saxutils import XMLGenerator
+from xml.etree.ElementTree import *
+from ditapub import debugMode
+import manifestdb
+
+# global variables for this script
+manifest_fileobj = None
+manifest_gen = None
+manifest_path = None
+manifest_nodes = 0
+# the type of the open ctype element, or None
+manifest_ctype = None
+# True when the manifest is a SQLite database
+manifest_db = False
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to start writing a manifest with the given root
+# element attributes
+#
+def openManifest(f,attrs):
+    global manifest_fileobj
+    global manifest_gen
+    global manifest_path
+    global manifest_nodes
+    global manifest_ctype
+    global manifest_db
+    if debugMode():
+        print("openManifest",f)
+
+    manifest_path = f
+    manifest_nodes = 0
+    manifest_ctype = None
+    manifest_db = manifestdb.isManifestDB(f)
+    if manifest_db:
+        manifestdb.openDB(f,True)
+        manifestdb.startInfo(attrs)
+        return
+    manifest_fileobj = open(f+".tmp","w",encoding="utf-8")
+    manifest_gen = XMLGenerator(manifest_fileobj,"UTF-8",short_empty_elements=True)
+    manifest_gen.startDocument()
+    manifest_gen.startElement("manifest",attrs)
+    manifest_gen.characters("\n")
+
+#
+# Function to write an element and everything in it
+#
+def writeElement(e):
+    manifest_gen.startElement(e.tag,e.attrib)
+    if e.text:
+        manifest_gen.characters(e.text)
+    for c in e:
+        writeElement(c)
+    manifest_gen.endElement(e.tag)
+    if e.tail:
+        manifest_gen.characters(e.tail)
+
+#
+# Function to close the open ctype element, if there is one
+#
+def endCtype():
+    global manifest_ctype
+    if manifest_ctype == None:
+        return
+    manifest_gen.endElement("ctype")
+    manifest_gen.characters("\n")
+    manifest_ctype = None
+
+#
+# Function to write an element with only text, like the
+# <timestamp> and other run information
+#
+def writeInfo(tag,text):
+    if manifest_db:
+        manifestdb.setInfo(tag,text)
+        return
+    endCtype()
+    e = Element(tag)
+    e.text = text
+    writeElement(e)
+    manifest_gen.characters("\n")
+
+#
+# Function to write the node of a finished post in its content
+# type and hand it to the operating system. A new ctype element
+# is opened if the last node was of another type.
+#
+def writeNode(ctype,cdir,node):
+    global manifest_nodes
+    global manifest_ctype
+
+    manifest_nodes = manifest_nodes+1
+    if manifest_db:
+        manifestdb.writeNode(ctype,cdir,node)
+        return
+    if not manifest_ctype == ctype:
+        endCtype()
+        manifest_gen.startElement("ctype",{"type":ctype,"dir":cdir})
+        manifest_gen.characters("\n")
+        manifest_ctype = ctype
+    writeElement(node)
+    manifest_gen.characters("\n")
+    manifest_fileobj.flush()
+
+#
+# Function to return the number of nodes written
+#
+def nodeCount():
+    return manifest_nodes
+
+#
+# Function to drop an element read by iterparse from the tree
+# once it is done with, a node from its ctype and any element
+# right under the manifest root from the root, so reading a
+# manifest does not build up its tree. The elements before it
+# are dropped already, so it is the first child.
+#
+def dropElement(root,ctype,e):
+    if e.tag == "node":
+        e.clear()
+        ctype.remove(e)
+    elif len(root)>0 and root[0] is e:
+        e.clear()
+        root.remove(e)
+
+#
+# Function to copy the nodes of an existing manifest whose ids
+# are in keep, reading it a node at a time. A database keeps
+# those nodes in place and drops the others not written.
+#
+def copyNodes(f,keep):
+    global manifest_nodes
+    if debugMode():
+        print("copyNodes",f,len(keep))
+
+    if manifest_db:
+        n = manifestdb.keepNodes(keep)
+        manifest_nodes = manifest_nodes+n
+        return n
+    if len(keep) == 0:
+        return 0
+
+    n = 0
+    root = None
+    ctype = None
+    for event,e in iterparse(f,("start","end")):
+        if event == "start":
+            if root == None:
+                root = e
+            elif e.tag == "ctype":
+                ctype = e
+            continue
+        if e.tag == "node" and e.get("id") in keep:
+            e.tail = None
+            writeNode(ctype.get("type"),ctype.get("dir"),e)
+            n = n+1
+        dropElement(root,ctype,e)
+
+    return n
+
+#
+# Function to finish the manifest, with the modification
+# watermark if there is one, and put it in place
+#
+def closeManifest(modified):
+    global manifest_fileobj
+    if debugMode():
+        print("closeManifest",modified)
+
+    if manifest_db:
+        manifestdb.closeDB(modified)
+        return
+    endCtype()
+    if not modified == None:
+        manifest_gen.startElement("watermark",{"modified":modified})
+        manifest_gen.endElement("watermark")
+        manifest_gen.characters("\n")
+    manifest_gen.endElement("manifest")
+    manifest_gen.endDocument()
+    manifest_fileobj.flush()
+    os.fsync(manifest_fileobj.fileno())
+    manifest_fileobj.close()
+    manifest_fileobj = None
+    os.replace(manifest_path+".tmp",manifest_path)
+
+#
+# Function to return a root attribute of a manifest, like the
+# file layout, or default if it is not set
+#
+def manifestAttr(f,name,default):
+    if manifestdb.isManifestDB(f):
+        conn = manifestdb.sqlite3.connect(f)
+        row = conn.execute("SELECT value FROM info WHERE name=?",(name,)).fetchone()
+        conn.close()
+        if row == None:
+            return default
+        return row[0]
+    for event,e in iterparse(f,("start",)):
+        return e.get(name,default)
+
+#
+# Function to read the categories, nodes and watermark of a
+# manifest without holding the whole tree in memory. Returns
+# the watermark or None, a dictionary of category directories
+# by type, and a dictionary of [type,hash,path] by node id.
+#
+def scanManifest(f):
+    if debugMode():
+        print("scanManifest",f)
+
+    if manifestdb.isManifestDB(f):
+        return manifestdb.scanDB(f)
+    modified = None
+    cats = {}
+    nodes = {}
+    root = None
+    ctype = None
+    for event,e in iterparse(f,("start","end")):
+        if event == "start":
+            if root == None:
+                root = e
+                modified = e.get("modified")
+            elif e.tag == "ctype":
+                ctype = e
+                cats[ctype.get("type")] = ctype.get("dir")
+            continue
+        if e.tag == "node":
+            nodes[e.get("id")] = [ctype.get("type"),e.get("hash"),e.get("path")]
+        elif e.tag == "watermark":
+            modified = e.get("modified")
+        dropElement(root,ctype,e)
+
+    return modified,cats,nodes
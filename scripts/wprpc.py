@@ -0,0 +1,366 @@
+###################################
+# PROLOG SECTION
+# wprpc.py
+#
+# XML-RPC calls to a WordPress site. Independent calls can be
+# grouped into one system.multicall request, so a batch of user
+# lookups, post windows or media item lookups costs one round
+# trip instead of one per call. If the site does not offer
+# system.multicall the calls are made one at a time.
+#
+# The calls run on an asyncio event loop in a background
+# thread, over keep-alive connections, with at most
+# x_concurrency requests in flight. Faults and protocol
+# errors are raised as xmlrpc.client.Fault and ProtocolError,
+# the same as with ServerProxy.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import xmlrpc.client
+import time
+import asyncio
+import ssl
+import threading
+import urllib.parse
+import wpcassette
+import ratecontrol
+import wptiming
+from ditapub import debugMode, errCnt, get_maxretry
+
+# global get/set variables
+x_multicall = False
+x_batch_size = 20
+x_concurrency = 4
+x_timeout = 60
+
+# event loop, request semaphore and idle connections
+# of the asynchronous transport
+async_loop = None
+async_url = None
+async_sem = None
+async_idle = []
+# coroutines started by runAsync that have not finished, kept
+# here so they are not garbage collected while they wait
+async_running = set()
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# get/set functions for get/set variables
+#
+def set_multicall(flag):
+    global x_multicall
+    x_multicall = flag
+def get_multicall():
+    return x_multicall
+def set_batch_size(n):
+    global x_batch_size
+    x_batch_size = n
+def get_batch_size():
+    return x_batch_size
+def set_concurrency(n):
+    global x_concurrency
+    x_concurrency = n
+def get_concurrency():
+    return x_concurrency
+def set_timeout(n):
+    global x_timeout
+    x_timeout = n
+def get_timeout():
+    return x_timeout
+
+#
+# Function to print an XML-RPC fault
+#
+def printFault(err):
+    print("A fault occurred")
+    print("Fault code: %d" % err.faultCode)
+    print("Fault string: %s" % err.faultString)
+
+#
+# Function to print an XML-RPC protocol error
+#
+def printProtocolError(err):
+    print("A protocol error occurred")
+    print("URL: %s" % err.url)
+    print("HTTP/HTTPS headers: %s" % err.headers)
+    print("Error code: %d" % err.errcode)
+    print("Error message: %s" % err.errmsg)
+
+###################################
+# ASYNCHRONOUS TRANSPORT SECTION
+###################################
+
+#
+# Function to start the event loop thread for calls to the
+# XML-RPC endpoint at url
+#
+def startAsync(url):
+    global async_loop
+    global async_url
+    global async_sem
+    if debugMode():
+        print("startAsync",url,x_concurrency)
+
+    async_url = url
+    async_loop = asyncio.new_event_loop()
+    t = threading.Thread(target=async_loop.run_forever,daemon=True)
+    t.start()
+
+    # the semaphore belongs to the loop, so make it there
+    async def makeSemaphore():
+        return asyncio.Semaphore(x_concurrency)
+    async_sem = runAsync(makeSemaphore()).result()
+
+#
+# Function to stop the event loop thread
+#
+def stopAsync():
+    global async_loop
+    if async_loop == None:
+        return
+
+    async def closeIdle():
+        while len(async_idle)>0:
+            reader,writer = async_idle.pop()
+            writer.close()
+    runAsync(closeIdle()).result()
+    async_loop.call_soon_threadsafe(async_loop.stop)
+    async_loop = None
+
+#
+# Function to run a coroutine on the event loop from another
+# thread. Returns a concurrent.futures.Future for its result.
+#
+def runAsync(coro):
+    fut = asyncio.run_coroutine_threadsafe(coro,async_loop)
+    async_running.add(fut)
+    fut.add_done_callback(async_running.discard)
+    return fut
+
+#
+# Function to open a new connection to the endpoint
+#
+async def openConnection():
+    parts = urllib.parse.urlsplit(async_url)
+    if parts.scheme == "https":
+        ctx = ssl.create_default_context()
+        port = parts.port or 443
+    else:
+        ctx = None
+        port = parts.port or 80
+    if debugMode():
+        print("openConnection",parts.hostname,port)
+
+    return await asyncio.open_connection(parts.hostname,port,ssl=ctx)
+
+#
+# Function to read an HTTP response from a connection. Returns
+# the status, reason, headers and body, and whether the server
+# will keep the connection open.
+#
+async def readResponse(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError("connection closed by the server")
+    version,status,reason = (line.decode("latin-1").rstrip("\r\n").split(" ",2)+[""])[0:3]
+    status = int(status)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n",b"\n",b""):
+            break
+        k,v = line.decode("latin-1").split(":",1)
+        headers[k.strip().lower()] = v.strip()
+
+    if headers.get("transfer-encoding","").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0],16)
+            if size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        headers["connection"] = "close"
+
+    keep = not headers.get("connection","").lower() == "close" and version == "HTTP/1.1"
+
+    return status,reason,headers,body,keep
+
+#
+# Function to POST an XML-RPC request body on a keep-alive
+# connection and return the response body. A reused connection
+# the server has already closed is replaced and the request sent
+# again. Any status but 200 raises xmlrpc.client.ProtocolError.
+# With a cassette the response is recorded, or replayed without
+# going to the site.
+#
+async def postRequest(body):
+    if wpcassette.replaying():
+        await asyncio.sleep(wpcassette.latency())
+        return wpcassette.replayRPC(body,async_url)
+
+    parts = urllib.parse.urlsplit(async_url)
+    path = parts.path or "/"
+    req = "POST "+path+" HTTP/1.1\r\n"
+    req = req+"Host: "+parts.netloc+"\r\n"
+    req = req+"User-Agent: WParchive\r\n"
+    req = req+"Content-Type: text/xml\r\n"
+    req = req+"Content-Length: "+str(len(body))+"\r\n\r\n"
+    data = req.encode("latin-1")+body
+
+    while True:
+        reused = len(async_idle)>0
+        if reused:
+            reader,writer = async_idle.pop()
+        else:
+            reader,writer = await openConnection()
+        try:
+            writer.write(data)
+            await writer.drain()
+            status,reason,headers,rbody,keep = await readResponse(reader)
+        except (ConnectionError,asyncio.IncompleteReadError):
+            writer.close()
+            if reused:
+                continue
+            raise
+        except:
+            writer.close()
+            raise
+        break
+
+    if keep:
+        async_idle.append((reader,writer))
+    else:
+        writer.close()
+
+    if not status == 200:
+        raise xmlrpc.client.ProtocolError(parts.netloc+path,status,reason,headers)
+
+    if wpcassette.recording():
+        wpcassette.recordRPC(body,rbody)
+
+    return rbody
+
+#
+# Function to POST an XML-RPC request body once a slot is free,
+# at most x_concurrency in flight and no more than the rate
+# controller of the site allows, and tell the controller how
+# the request went. A request taking more than x_timeout
+# seconds is given up.
+#
+async def controlledRequest(method,body):
+    ctl = ratecontrol.getController(async_url)
+    async with async_sem:
+        await ctl.aacquire()
+        start = time.monotonic()
+        try:
+            rbody = await asyncio.wait_for(postRequest(body),x_timeout)
+        except xmlrpc.client.ProtocolError as err:
+            ctl.release(start,method,status=err.errcode,retry_after=ratecontrol.retryAfter(err.headers))
+            raise
+        except asyncio.CancelledError:
+            # a read ahead window that is not needed
+            ctl.cancel()
+            raise
+        except Exception:
+            ctl.release(start,method,failed=True)
+            raise
+        ctl.release(start,method,status=200,nbytes=len(rbody))
+    wptiming.addSample("xml-rpc",time.monotonic()-start,len(rbody),method)
+
+    return rbody
+
+#
+# Function to make one XML-RPC call asynchronously. Communication
+# errors, timeouts and a busy site are retried after the backoff
+# of the rate controller, faults and other protocol errors are
+# raised to the caller.
+#
+async def acall(method,*args):
+    if debugMode():
+        print("acall",method)
+
+    body = xmlrpc.client.dumps(tuple(args),method,allow_none=True).encode("utf-8")
+    ctl = ratecontrol.getController(async_url)
+    for i in range(get_maxretry()+1):
+        try:
+            rbody = await controlledRequest(method,body)
+            params,mname = xmlrpc.client.loads(rbody)
+            return params[0]
+        except xmlrpc.client.Fault:
+            raise
+        except xmlrpc.client.ProtocolError as err:
+            if i>=get_maxretry() or not ratecontrol.retryable(err.errcode):
+                raise
+            errCnt()
+            print(" WordPress XMLRPC busy!",err.errcode,i+1)
+            await asyncio.sleep(ctl.backoff(i,ratecontrol.retryAfter(err.headers)))
+        except Exception:
+            if i>=get_maxretry():
+                raise
+            errCnt()
+            print(" WordPress XMLRPC error!",i+1)
+            await asyncio.sleep(ctl.backoff(i))
+
+#
+# Function to make a batch of independent calls asynchronously,
+# given as a list of (method,args) pairs. With multicall the
+# calls go in system.multicall requests of at most x_batch_size
+# calls, otherwise one request per call, and the requests run
+# at the same time. Returns the results in the order of the
+# calls, with an xmlrpc.client.Fault in place of the result of
+# a call that failed on the server.
+#
+async def abatch(calls):
+    if debugMode():
+        print("abatch",len(calls),"calls")
+
+    async def single(method,args):
+        try:
+            return await acall(method,*args)
+        except xmlrpc.client.Fault as err:
+            return err
+
+    async def multi(chunk):
+        global x_multicall
+        if not x_multicall or len(chunk)==1:
+            return list(await asyncio.gather(*[single(m,a) for m,a in chunk]))
+        mcalls = [{"methodName":m,"params":list(a)} for m,a in chunk]
+        try:
+            raw = await acall("system.multicall",mcalls)
+        except xmlrpc.client.Fault as err:
+            printFault(err)
+            print("system.multicall failed, making single calls")
+            x_multicall = False
+            return await asyncio.gather(*[single(m,a) for m,a in chunk])
+        results = []
+        for r in raw:
+            if type(r) is dict:
+                results.append(xmlrpc.client.Fault(r['faultCode'],r['faultString']))
+            else:
+                results.append(r[0])
+        return results
+
+    if x_multicall:
+        chunks = [calls[i:i+x_batch_size] for i in range(0,len(calls),x_batch_size)]
+        parts = await asyncio.gather(*[multi(c) for c in chunks])
+        results = []
+        for p in parts:
+            results.extend(p)
+        return results
+
+    return list(await asyncio.gather(*[single(m,a) for m,a in calls]))
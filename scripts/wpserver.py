@@ -0,0 +1,501 @@
+###################################
+# PROLOG SECTION
+# wpserver.py
+#
+# A local stand-in for a WordPress site, used to test the
+# scripts without a real site and to see how they scale. It
+# serves the XML-RPC methods deconstructwp.py calls at
+# /xmlrpc.php, including system.multicall, and generated media
+# files under /wp-content/uploads/ with ETag and Last-Modified
+# validators.
+#
+# The site can be made as large as needed. Posts and media
+# items are made up when they are asked for, from a fixed seed
+# and their number, so every run of the server serves the same
+# site and a site of 50000 posts and 200000 images costs no more
+# memory than a small one. Posts have paragraphs, inline images
+# in several sizes, some with a srcset, captions, galleries,
+# featured images, some unicode text and media file names, and
+# now and then HTML that is not well formed. The latency option
+# delays each XML-RPC request to act like a site far away, and
+# the capacity option answers requests beyond that many at once
+# with 429 Too Many Requests and a Retry-After header, like a
+# small shared host. With the no-multicall option the site does
+# not offer system.multicall, like a site that turned it off.
+#
+# The server counts the requests it answers. wpserver.getStats
+# returns the counts, for benchmarks like wpbench.py.
+#
+# Usage:
+#  python wpserver.py [--port 8765] [--posts 30] [--media 10]
+#                     [--images 2] [--gallery 5] [--pages 1]
+#                     [--seed 1] [--latency 0.05]
+#                     [--capacity 4] [--retry-after 1]
+#                     [--no-multicall]
+#
+# Point the url in options.xml at http://127.0.0.1:<port>.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import argparse
+import random
+import hashlib
+import struct
+import zlib
+import time
+import datetime
+import threading
+import urllib.parse
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from socketserver import ThreadingMixIn
+
+CATEGORIES = ["News","Sports","Uncategorized","Local Events","Événements"]
+USERS = {"1":"Alice","2":"Bob","3":"Zoë"}
+UPLOADS = "/wp-content/uploads/"
+MODIFIED = "Sun, 01 May 2016 10:00:00 GMT"
+# the first post is made at this time, each later post an hour after
+FIRST_POST = datetime.datetime(2012,1,1,10,0,0)
+# the image sizes WordPress makes of each upload
+SIZES = (("thumbnail",150,150),("medium",300,200),("medium_large",768,512),("large",1024,683))
+FULL_SIZE = (1200,800)
+
+WORDS = ("the","site","archive","morning","council","river","match","season","report",
+         "school","music","road","market","weather","garden","history","photo","street",
+         "Zürich","café","naïve","über","Ærø","São","Paulo","façade","jalapeño")
+
+# the site settings
+site_url = None
+site_posts = 30
+site_media = 10
+site_images = 2
+site_gallery = 5
+site_pages = 1
+site_seed = 1
+site_latency = 0
+site_capacity = 0
+site_retry_after = 1
+
+# IDAT chunks of the media files by size, and the request counts
+png_idat = {}
+site_stats = {"rpc_requests":0,"rpc_calls":0,"media_requests":0,"media_bytes":0,"refused":0}
+stats_lock = threading.Lock()
+# requests being answered, for the capacity
+site_active = 0
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to add to a request count
+#
+def countStat(name,n=1):
+    with stats_lock:
+        site_stats[name] = site_stats[name]+n
+
+#
+# Function to start answering a request. Returns False if the
+# site is at capacity.
+#
+def enterRequest():
+    global site_active
+    with stats_lock:
+        if site_capacity>0 and site_active>=site_capacity:
+            site_stats["refused"] = site_stats["refused"]+1
+            return False
+        site_active = site_active+1
+        return True
+
+#
+# Function to finish answering a request
+#
+def leaveRequest():
+    global site_active
+    with stats_lock:
+        site_active = site_active-1
+
+#
+# Function to make a PNG file of a solid colour. The image is
+# a one colour palette image, so the compressed pixels only
+# depend on the size and are made once per size.
+#
+def makePNG(width,height,colour):
+    def chunk(kind,data):
+        c = kind+data
+        return struct.pack(">I",len(data))+c+struct.pack(">I",zlib.crc32(c))
+
+    if not (width,height) in png_idat:
+        row = b"\0"*(width+1)
+        png_idat[(width,height)] = chunk(b"IDAT",zlib.compress(row*height))
+    png = b"\x89PNG\r\n\x1a\n"
+    png = png+chunk(b"IHDR",struct.pack(">IIBBBBB",width,height,8,3,0,0,0))
+    png = png+chunk(b"PLTE",bytes(colour))
+    png = png+png_idat[(width,height)]
+    png = png+chunk(b"IEND",b"")
+    return png
+
+#
+# Function to return the bytes of a media file by name. The
+# size is taken from a -WxH suffix on the name.
+#
+def mediaFile(name):
+    width,height = FULL_SIZE
+    stem = name.rsplit(".",1)[0]
+    suffix = stem.rsplit("-",1)[-1]
+    if "x" in suffix and suffix.replace("x","").isdigit():
+        width,height = [int(n) for n in suffix.split("x")]
+    h = hashlib.md5(name.encode("utf-8")).digest()
+    return makePNG(width,height,h[0:3])
+
+#
+# Function to return the file name, without extension, and the
+# upload directory of media item i
+#
+def mediaName(i):
+    if i%7 == 0:
+        name = "Zürich-café-"+str(i)
+    else:
+        name = "pic"+str(i)
+    folder = "%04d/%02d/" % (2012+(i//1000)%5,1+i%12)
+    return name,folder
+
+#
+# Function to return the url of a size of media item i, or of
+# the full size if size is None
+#
+def mediaURL(i,size=None):
+    name,folder = mediaName(i)
+    if not size == None:
+        for s,w,h in SIZES:
+            if s == size:
+                name = name+"-"+str(w)+"x"+str(h)
+    return site_url+UPLOADS+folder+name+".png"
+
+#
+# Function to make up media item i of the media library. Item i
+# is uploaded an hour after item i-1.
+#
+def makeMedia(i):
+    name,folder = mediaName(i)
+    sizes = {}
+    for size,w,h in SIZES:
+        sizes[size] = {"file":name+"-"+str(w)+"x"+str(h)+".png","width":w,"height":h}
+    m = {}
+    m["attachment_id"] = str(1000+i)
+    m["link"] = mediaURL(i)
+    m["title"] = name
+    m["parent"] = 0
+    m["date_created_gmt"] = xmlrpc.client.DateTime(FIRST_POST+datetime.timedelta(hours=i))
+    m["metadata"] = {"width":FULL_SIZE[0],"height":FULL_SIZE[1],"file":folder+name+".png","sizes":sizes}
+    return m
+
+#
+# Function to make the img tag of the j-th image of a post, in
+# turn the medium size, the full size with the srcset newer
+# WordPress writes, and the large size without a srcset
+#
+def imgTag(i,j):
+    cls = 'class="size-%s wp-image-'+str(1000+i)+'"'
+    if j%3 == 1:
+        return '<img '+(cls % "medium")+' src="'+mediaURL(i,"medium")+'" width="300" height="200" />'
+    if j%3 == 2:
+        srcset = [mediaURL(i,s)+" "+str(w)+"w" for s,w,h in SIZES if not s == "thumbnail"]
+        srcset.append(mediaURL(i)+" "+str(FULL_SIZE[0])+"w")
+        return ('<img '+(cls % "full")+' src="'+mediaURL(i)+'" srcset="'+", ".join(srcset)+
+                '" sizes="(max-width: %dpx) 100vw, %dpx" width="%d" height="%d" />' % (FULL_SIZE[0],FULL_SIZE[0],FULL_SIZE[0],FULL_SIZE[1]))
+    return '<img '+(cls % "large")+' src="'+mediaURL(i,"large")+'" width="1024" height="683" />'
+
+#
+# Function to make up a sentence
+#
+def sentence(rand):
+    words = [rand.choice(WORDS) for j in range(rand.randint(6,18))]
+    return " ".join(words).capitalize()+"."
+
+#
+# Function to make up the text of post i
+#
+def postBody(i,rand):
+    pics = [rand.randint(1,site_media) for j in range(site_images)]
+
+    body = "Intro line for post "+str(i)+"\nSecond line\n"
+    for j in range(rand.randint(2,8)):
+        body = body+"<p>"+sentence(rand)+" "+sentence(rand)+"</p>\n"
+    if len(pics)>0:
+        body = body+'<p>Para <strong>bold</strong> <a href="'+mediaURL(pics[0])+'">link</a></p>\n'
+    for j in range(1,len(pics)):
+        img = imgTag(pics[j],j)
+        if j == 1:
+            body = body+'[caption id="attachment_'+str(1000+pics[j])+'" align="alignnone" width="300"]'+img+" A caption "+str(i)+"[/caption]\n"
+        else:
+            body = body+"<p>"+img+"</p>\n"
+    if site_gallery>0 and i%site_gallery == 0:
+        ids = [str(1000+rand.randint(1,site_media)) for j in range(rand.randint(3,6))]
+        body = body+'[gallery ids="'+",".join(ids)+'"]\n'
+    if i%13 == 0:
+        # html a browser takes but an XML parser does not
+        body = body+"<p>An open paragraph<br>with a break &nbsp; and <b>bold\n"
+    body = body+"Trailing text"
+
+    return body
+
+#
+# Function to make up post i. Post i is made an hour after
+# post i-1 and changed half an hour after it was made, so the
+# posts are in the same order by date and by modification.
+#
+def makePost(i):
+    rand = random.Random(site_seed*1000003+i)
+    cat = CATEGORIES[i%len(CATEGORIES)]
+    created = FIRST_POST+datetime.timedelta(hours=i)
+    modified = created+datetime.timedelta(minutes=30)
+
+    p = {}
+    p["post_id"] = str(i)
+    p["post_title"] = "Post "+str(i)
+    if i%11 == 0:
+        p["post_title"] = "Grüße aus Zürich "+str(i)
+    p["post_name"] = "post-"+str(i)
+    p["post_type"] = "post"
+    p["post_status"] = "publish"
+    p["link"] = site_url+"/post-"+str(i)+"/"
+    p["post_author"] = str(1+i%len(USERS))
+    p["post_date"] = xmlrpc.client.DateTime(created)
+    p["post_modified"] = xmlrpc.client.DateTime(modified)
+    p["post_content"] = postBody(i,rand)
+    p["terms"] = [{"taxonomy":"category","name":cat,"term_id":str(CATEGORIES.index(cat)+1)},
+                  {"taxonomy":"post_tag","name":"tag"+str(i%3),"term_id":str(100+i%3)}]
+    p["post_thumbnail"] = []
+    if i%2 == 1 and site_media>0:
+        pic = rand.randint(1,site_media)
+        p["post_thumbnail"] = {"thumbnail":mediaURL(pic,"thumbnail"),"title":"thumb"}
+    return p
+
+#
+# Function to make up page j of the site
+#
+def makePage(j):
+    page = {}
+    page["post_id"] = str(site_posts+1000+j)
+    page["post_title"] = "About"
+    page["post_name"] = "about"
+    if j>0:
+        page["post_title"] = "About "+str(j)
+        page["post_name"] = "about-"+str(j)
+    page["post_type"] = "page"
+    page["post_status"] = "publish"
+    page["link"] = site_url+"/"+page["post_name"]+"/"
+    page["post_author"] = "1"
+    page["post_date"] = xmlrpc.client.DateTime(datetime.datetime(2015,1,1,10,0,j))
+    page["post_modified"] = xmlrpc.client.DateTime(datetime.datetime(2015,1,1,10,0,j))
+    page["post_content"] = "About us"
+    page["terms"] = []
+    page["post_thumbnail"] = []
+    return page
+
+#
+# Function to return the offset and number of a WordPress filter
+#
+def window(f,number):
+    return int(f.get("offset",0)),int(f.get("number",number))
+
+#
+# Functions for the XML-RPC methods
+#
+def getPosts(blogid,user,password,f=None,fields=None):
+    f = f or {}
+    offset,number = window(f,10)
+    if f.get("post_type","post") == "page":
+        ids = range(site_pages)
+        make = makePage
+    else:
+        ids = range(1,site_posts+1)
+        make = makePost
+    # the posts are in the same order by date and by
+    # modification time, newest first unless asked otherwise
+    if f.get("order","DESC") == "DESC":
+        ids = ids[::-1]
+    posts = [make(i) for i in ids[offset:offset+number]]
+    if not fields == None:
+        posts = [dict((k,p[k]) for k in p if k in fields or k == "post_id") for p in posts]
+    return posts
+
+def getUser(blogid,user,password,id,fields=None):
+    if not id in USERS:
+        raise xmlrpc.client.Fault(404,"Invalid user ID.")
+    return {"user_id":id,"display_name":USERS[id],"username":USERS[id].lower()}
+
+def getUsers(blogid,user,password,f=None,fields=None):
+    offset,number = window(f or {},50)
+    users = [getUser(blogid,user,password,id) for id in USERS]
+    return users[offset:offset+number]
+
+def getTerms(blogid,user,password,taxonomy,f=None):
+    if taxonomy == "category":
+        terms = [{"term_id":str(i+1),"name":c,"taxonomy":"category","slug":c.lower()} for i,c in enumerate(CATEGORIES)]
+    else:
+        terms = [{"term_id":str(100+i),"name":"tag"+str(i),"taxonomy":"post_tag","slug":"tag"+str(i)} for i in range(3)]
+    offset,number = window(f or {},1000)
+    return terms[offset:offset+number]
+
+def getMediaLibrary(blogid,user,password,f=None):
+    offset,number = window(f or {},site_media)
+    # newest first, like WordPress
+    ids = range(site_media,0,-1)
+    return [makeMedia(i) for i in ids[offset:offset+number]]
+
+def getMediaItem(blogid,user,password,id):
+    i = int(id)-1000
+    if i<1 or i>site_media:
+        raise xmlrpc.client.Fault(404,"Invalid attachment ID.")
+    return makeMedia(i)
+
+def getStats():
+    with stats_lock:
+        return dict(site_stats)
+
+#
+# Function to wrap an XML-RPC method so its calls are counted,
+# those in a system.multicall as well
+#
+def counted(func):
+    def method(*args):
+        countStat("rpc_calls")
+        return func(*args)
+    return method
+
+#
+# Class to handle the requests, XML-RPC posts to /xmlrpc.php
+# and media gets under /wp-content/
+#
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ("/xmlrpc.php",)
+    protocol_version = "HTTP/1.1"
+
+    def refuse(self):
+        # read the body so the connection can be used again
+        n = int(self.headers.get("Content-Length",0))
+        if n>0:
+            self.rfile.read(n)
+        self.send_response(429)
+        self.send_header("Retry-After",str(site_retry_after))
+        self.send_header("Content-Length","0")
+        self.end_headers()
+
+    def do_POST(self):
+        if not enterRequest():
+            self.refuse()
+            return
+        try:
+            countStat("rpc_requests")
+            if site_latency>0:
+                time.sleep(site_latency)
+            SimpleXMLRPCRequestHandler.do_POST(self)
+        finally:
+            leaveRequest()
+
+    def do_GET(self):
+        if not enterRequest():
+            self.refuse()
+            return
+        try:
+            self.sendMedia()
+        finally:
+            leaveRequest()
+
+    def sendMedia(self):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if not path.startswith(UPLOADS) or not path.endswith(".png"):
+            self.send_response(404)
+            self.send_header("Content-Length","0")
+            self.end_headers()
+            return
+
+        data = mediaFile(path.rsplit("/",1)[1])
+        countStat("media_requests")
+        etag = '"'+hashlib.md5(data).hexdigest()+'"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag",etag)
+            self.send_header("Content-Length","0")
+            self.end_headers()
+            return
+        countStat("media_bytes",len(data))
+        self.send_response(200)
+        self.send_header("Content-Type","image/png")
+        self.send_header("ETag",etag)
+        self.send_header("Last-Modified",MODIFIED)
+        self.send_header("Content-Length",str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self,*args):
+        pass
+
+#
+# Class for a server that handles each connection in a thread
+#
+class Server(ThreadingMixIn,SimpleXMLRPCServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+#
+# Function to make the server, on a free port if port is 0.
+# If multicall is False the server does not offer
+# system.multicall.
+#
+def makeServer(port,multicall=True):
+    srv = Server(("127.0.0.1",port),requestHandler=RequestHandler,allow_none=True,logRequests=False)
+    srv.register_introspection_functions()
+    if multicall:
+        srv.register_multicall_functions()
+    srv.register_function(counted(getPosts),"wp.getPosts")
+    srv.register_function(counted(getUser),"wp.getUser")
+    srv.register_function(counted(getUsers),"wp.getUsers")
+    srv.register_function(counted(getTerms),"wp.getTerms")
+    srv.register_function(counted(getMediaLibrary),"wp.getMediaLibrary")
+    srv.register_function(counted(getMediaItem),"wp.getMediaItem")
+    srv.register_function(getStats,"wpserver.getStats")
+    return srv
+
+###################################
+# MAIN PROCESSING SECTION
+###################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a made up WordPress site")
+    parser.add_argument("--port",type=int,default=8765)
+    parser.add_argument("--posts",type=int,default=30)
+    parser.add_argument("--media",type=int,default=10,help="items in the media library")
+    parser.add_argument("--images",type=int,default=2,help="image references in each post")
+    parser.add_argument("--gallery",type=int,default=5,help="every n-th post has a gallery, 0 for none")
+    parser.add_argument("--pages",type=int,default=1)
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--latency",type=float,default=0,help="seconds to delay each XML-RPC request")
+    parser.add_argument("--capacity",type=int,default=0,help="requests answered at once, 0 for no limit")
+    parser.add_argument("--retry-after",type=int,default=1,help="seconds of the Retry-After of a refused request")
+    parser.add_argument("--no-multicall",action="store_true",help="do not offer system.multicall")
+    args = parser.parse_args()
+
+    site_url = "http://127.0.0.1:"+str(args.port)
+    site_posts = args.posts
+    site_media = max(args.media,1)
+    site_images = args.images
+    site_gallery = args.gallery
+    site_pages = args.pages
+    site_seed = args.seed
+    site_latency = args.latency
+    site_capacity = args.capacity
+    site_retry_after = args.retry_after
+
+    srv = makeServer(args.port,not args.no_multicall)
+    print("serving",site_posts,"posts,",site_pages,"pages and",site_media,"media items at",site_url,flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,181 @@
+###################################
+# PROLOG SECTION
+# wptiming.py
+#
+# Timers for the phases of a deconstructwp.py run, like the
+# listing of the posts, the media library, the transform of each
+# post, the image downloads, the writing of the post files and of
+# the manifest. Each timed piece of work adds a sample of its
+# phase with the seconds it took, the bytes it moved and a name,
+# from any thread.
+#
+# At the end of the run the report gives for each phase the
+# count, total, mean, percentiles and bytes of its samples and
+# the slowest samples by name, with the wall time of the run and
+# the posts and MB per second. It is printed as a table and
+# written as a JSON file.
+#
+# Phases run at the same time, the downloads in threads and the
+# transforms in worker processes, so the totals of the phases
+# add up to more than the wall time.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+import time
+import json
+import heapq
+import threading
+from ditapub import debugMode
+
+# global variables for this script
+run_start = time.perf_counter()
+phases = {}
+phase_order = []
+timing_lock = threading.Lock()
+
+# number of slowest samples kept for each phase
+SLOWEST = 10
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to start the clock of the run, and drop the samples
+# of a run before it
+#
+def startRun():
+    global run_start
+    run_start = time.perf_counter()
+    with timing_lock:
+        phases.clear()
+        del phase_order[:]
+
+#
+# Function to add a sample of seconds, bytes and a name to a
+# phase
+#
+def addSample(phase,seconds,nbytes=0,name=None):
+    with timing_lock:
+        if not phase in phases:
+            phases[phase] = {"times":[],"bytes":0,"slowest":[]}
+            phase_order.append(phase)
+        ph = phases[phase]
+        ph["times"].append(seconds)
+        ph["bytes"] = ph["bytes"]+nbytes
+        if not name == None:
+            # a min heap of the slowest samples
+            if len(ph["slowest"])<SLOWEST:
+                heapq.heappush(ph["slowest"],(seconds,name))
+            elif seconds>ph["slowest"][0][0]:
+                heapq.heapreplace(ph["slowest"],(seconds,name))
+
+#
+# Class to time a block of code as a sample of a phase, as in
+#  with wptiming.Timer("file write",fpath) as t:
+#      ...
+#      t.nbytes = n
+#
+class Timer:
+
+    def __init__(self,phase,name=None):
+        self.phase = phase
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        addSample(self.phase,time.perf_counter()-self.start,self.nbytes,self.name)
+        return False
+
+#
+# Generator function to time the wait for each item of an
+# iterator as a sample of a phase
+#
+def timedIter(it,phase):
+    it = iter(it)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            addSample(phase,time.perf_counter()-start)
+            return
+        addSample(phase,time.perf_counter()-start)
+        yield item
+
+#
+# Function to return percentile p of a sorted list
+#
+def percentile(sorted_times,p):
+    if len(sorted_times)==0:
+        return 0.0
+    k = int(round((len(sorted_times)-1)*p/100.0))
+    return sorted_times[k]
+
+#
+# Function to make the report of the run. posts is the number
+# of posts written, extra a dictionary of other counts.
+#
+def makeReport(posts,extra=None):
+    if debugMode():
+        print("makeReport",posts)
+
+    wall = time.perf_counter()-run_start
+    report = {"wall_seconds":round(wall,3),"posts":posts,
+              "posts_per_second":round(posts/wall,2) if wall>0 else 0.0}
+    total_bytes = 0
+    rphases = {}
+    with timing_lock:
+        for phase in phase_order:
+            ph = phases[phase]
+            times = sorted(ph["times"])
+            total = sum(times)
+            r = {"count":len(times),
+                 "total_seconds":round(total,3),
+                 "mean_ms":round(1000*total/len(times),3),
+                 "p50_ms":round(1000*percentile(times,50),3),
+                 "p90_ms":round(1000*percentile(times,90),3),
+                 "p99_ms":round(1000*percentile(times,99),3),
+                 "max_ms":round(1000*times[-1],3),
+                 "bytes":ph["bytes"]}
+            if ph["bytes"]>0 and total>0:
+                r["mb_per_second"] = round(ph["bytes"]/total/1e6,3)
+            if len(ph["slowest"])>0:
+                r["slowest"] = [{"name":n,"ms":round(1000*s,3)} for s,n in sorted(ph["slowest"],reverse=True)]
+            rphases[phase] = r
+            total_bytes = total_bytes+ph["bytes"]
+
+    report["bytes"] = total_bytes
+    report["mb_per_second"] = round(total_bytes/wall/1e6,3) if wall>0 else 0.0
+    if not extra == None:
+        report.update(extra)
+    report["phases"] = rphases
+
+    return report
+
+#
+# Function to print the phases of a report as a table
+#
+def printReport(report):
+    print("%-18s %8s %10s %9s %9s %9s %9s %10s" % ("phase","count","total s","mean ms","p50 ms","p90 ms","p99 ms","MB"))
+    for phase in report["phases"]:
+        r = report["phases"][phase]
+        print("%-18s %8d %10.2f %9.2f %9.2f %9.2f %9.2f %10.2f" % (phase,r["count"],r["total_seconds"],r["mean_ms"],
+              r["p50_ms"],r["p90_ms"],r["p99_ms"],r["bytes"]/1e6))
+    print("wall time %.1fs, %.1f posts/s, %.2f MB/s" % (report["wall_seconds"],report["posts_per_second"],report["mb_per_second"]))
+
+#
+# Function to write a report as a JSON file
+#
+def writeReport(report,f):
+    fp = open(f,"w",encoding="utf-8")
+    json.dump(report,fp,indent=2,ensure_ascii=False)
+    fp.close()
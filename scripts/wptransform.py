@@ -0,0 +1,365 @@
+###################################
+# PROLOG SECTION
+# wptransform.py
+#
+# The transformation of the raw text of a WordPress post into
+# the XHTML that deconstructwp.py writes out. The transform only
+# needs the post text and the thumbnail urls of its gallery, so
+# it runs in a pool of worker processes, one post per task, and
+# the CPU time of a run is spread over the cores of the machine.
+#
+# Shortcodes are expanded by shortcodes.py. Workers do not talk
+# to the site. The img src values of a post
+# are replaced with IMAGE_TOKEN placeholders and returned in a
+# list, so the main process can store the images and fill in
+# the file names.
+#
+# The post text is made into an element tree by normalizeHTML,
+# which parses it once: as XML when it is well formed, which is
+# cheap, and otherwise with a lenient HTML parser, lxml.html if
+# it is installed or else the html.parser of the standard
+# library.
+#
+###################################
+
+###################################
+# ENVIRONMENT SETUP SECTION
+###################################
+
+from ditapub import *
+import signal
+import concurrent.futures
+import html.parser
+import shortcodes
+from xml.etree.ElementTree import *
+
+# lxml is optional, it is the faster lenient parser
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+# placeholder written in an img src until the image is stored
+IMAGE_TOKEN = "wpimage:"
+
+# HTML elements that never have content or an end tag
+VOID_TAGS = ("area","base","br","col","embed","hr","img","input","link",
+             "meta","param","source","track","wbr")
+# HTML elements whose end tag may be left out before a sibling
+SIBLING_TAGS = ("li","p","dt","dd","tr","td","th","option")
+
+###################################
+# FUNCTION DEFINITION SECTION
+###################################
+
+#
+# Function to start the pool of transform worker processes,
+# started with spawn, see spawnContext in ditapub.py. The
+# workers only need this module.
+#
+def startPool(workers):
+    if debugMode():
+        print("startPool",workers)
+
+    ctx = spawnContext()
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers,mp_context=ctx,
+                                                  initializer=initWorker,initargs=(debugMode(),))
+
+#
+# Function run when a worker process starts. An interrupt is
+# left to the main process, which stops the workers.
+#
+def initWorker(debug):
+    setdebug(debug)
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+
+#
+# Function to test if file is an image
+#
+def isImage(f):
+    iexts = (".PNG",".JPG",".GIF",".BMP",".JPEG")
+    fdata = os.path.splitext(f)
+    fext = fdata[1]
+    fext = fext.upper()
+    if fext in iexts:
+        return True
+    else:
+        return False
+
+#
+# Function to read the srcset attribute of an img, the list of
+# renditions of the image. Returns a list of [url,width] of the
+# renditions given by width, like "pic-300x200.jpg 300w".
+#
+def parseSrcset(srcset):
+    ret = []
+    if srcset == None:
+        return ret
+    for c in srcset.split(","):
+        parts = c.split()
+        if len(parts) == 2 and parts[1].endswith("w") and parts[1][:-1].isdigit():
+            ret.append([parts[0],int(parts[1][:-1])])
+    return ret
+
+#
+# Function to get the attachment ids of the img tags of a post
+# that have no srcset, from their wp-image-<id> class. Their
+# renditions can only be found from the media item.
+#
+def imageIds(s):
+    ids = []
+    for tag in re.findall(r"<img\b[^>]*>",s,re.IGNORECASE):
+        if "srcset" in tag:
+            continue
+        m = re.search(r"wp-image-([0-9]+)",tag)
+        if not m == None and not m.group(1) in ids:
+            ids.append(m.group(1))
+    return ids
+
+#
+# Function to turn text lines into <p> elements
+#
+def makeParagraphs(s):
+    if debugMode():
+        print("makeParagraphs:",s[0:20])
+
+    sss = s.strip()
+    splist = []
+
+    slines = sss.splitlines()
+    nlines = len(slines)
+    if debugMode():
+      print("text contains",nlines,"lines of text")
+    if nlines>0:
+        for ss in slines:
+            sp = Element("p")
+            sp.text = ss
+            splist.append(sp)
+
+    return splist
+
+#
+# Class to build an element tree from HTML with the html.parser
+# of the standard library. Void elements are closed right away,
+# an open li, p and the like is closed by the start of a sibling
+# of its kind, an end tag closes any elements left open inside
+# it and an end tag with no open element is dropped.
+#
+class HTMLTreeBuilder(html.parser.HTMLParser):
+
+    def __init__(self,root):
+        html.parser.HTMLParser.__init__(self,convert_charrefs=True)
+        self.builder = TreeBuilder()
+        self.root = root
+        self.open_tags = []
+        self.builder.start(root,{})
+
+    def attribs(self,attrs):
+        d = {}
+        for k,v in attrs:
+            if v == None:
+                v = k
+            d[k] = v
+        return d
+
+    def handle_starttag(self,tag,attrs):
+        if tag in SIBLING_TAGS and len(self.open_tags)>0 and self.open_tags[-1] == tag:
+            self.builder.end(self.open_tags.pop())
+        self.builder.start(tag,self.attribs(attrs))
+        if tag in VOID_TAGS:
+            self.builder.end(tag)
+        else:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self,tag,attrs):
+        self.builder.start(tag,self.attribs(attrs))
+        self.builder.end(tag)
+
+    def handle_endtag(self,tag):
+        if not tag in self.open_tags:
+            return
+        while len(self.open_tags)>0:
+            t = self.open_tags.pop()
+            self.builder.end(t)
+            if t == tag:
+                break
+
+    def handle_data(self,data):
+        self.builder.data(data)
+
+    def close(self):
+        html.parser.HTMLParser.close(self)
+        while len(self.open_tags)>0:
+            self.builder.end(self.open_tags.pop())
+        self.builder.end(self.root)
+        return self.builder.close()
+
+#
+# Function to copy an lxml element tree to an ElementTree
+# element. Comments and processing instructions are dropped.
+#
+def copyTree(le,parent):
+    last = None
+    for lc in le:
+        if isinstance(lc.tag,str):
+            last = SubElement(parent,lc.tag,dict(lc.attrib))
+            last.text = lc.text
+            copyTree(lc,last)
+            last.tail = lc.tail
+        elif lc.tail:
+            # keep the text after a dropped comment
+            if last == None:
+                parent.text = (parent.text or "")+lc.tail
+            else:
+                last.tail = (last.tail or "")+lc.tail
+
+#
+# Function to parse the text of a post into an element tree
+# with a div root element. Well formed text is parsed as XML,
+# anything else with a lenient HTML parser. A whole html
+# document is reduced to its body. Returns the root element
+# and the name of the parser that was used.
+#
+def normalizeHTML(s):
+    if debugMode():
+        print("normalizeHTML:",s[0:40])
+
+    try:
+        root = XML("<div>"+s+"</div>")
+        how = "xml"
+    except ParseError:
+        if not lxml == None:
+            root = Element("div")
+            if len(s.strip())>0:
+                lroot = lxml.html.fragment_fromstring(s,create_parent="div")
+                root.text = lroot.text
+                copyTree(lroot,root)
+            how = "lxml"
+        else:
+            parser = HTMLTreeBuilder("div")
+            parser.feed(s)
+            root = parser.close()
+            how = "html.parser"
+
+    # replace <html><body> with <div>
+    if len(root)==1 and root[0].tag == "html":
+        bodye = root[0].find("body")
+        if not bodye == None:
+            bodye.tag = "div"
+            bodye.tail = None
+            root = bodye
+
+    return root,how
+
+#
+# Function to make last minute changes to the text
+#
+def filterText(s):
+
+    ss = s
+
+    # handle ü
+    ss = ss.replace("&#252;","ue")
+
+    return ss
+
+#
+# Function to transform the raw text of a post into XHTML.
+# thumbs has the thumbnail url of each id in the post galleries.
+# Returns a dictionary with the text, the list of original img
+# src values, whose places in the text hold IMAGE_TOKEN<n>, the
+# renditions in the srcset of each img, a list of notes for the
+# main process to print and the seconds the transform took.
+#
+def transformPost(ftext,thumbs,fpath):
+    if debugMode():
+        print("transformPost",fpath)
+
+    start = time.perf_counter()
+    notes = []
+
+    # expand galleries to image references, captions to
+    # figures and the other shortcodes with handlers
+    ctx = {"thumbs":thumbs,"notes":notes}
+    stext = shortcodes.processShortcodes(ftext,ctx)
+
+    # parse the post text
+    temproot,how = normalizeHTML(stext)
+    if not how == "xml":
+        notes.append("Note, "+fpath+" is not well formed, parsed with "+how)
+
+    # make a list of all the img elements, the src is set
+    # to the stored file when the post is written
+    imgs = temproot.findall(".//img")
+    srcs = []
+    srcsets = []
+    for img in imgs:
+        isrc = img.get("src")
+        if isrc == None:
+            continue
+        img.set("src",IMAGE_TOKEN+str(len(srcs)))
+        srcs.append(isrc)
+        srcsets.append(parseSrcset(img.get("srcset")))
+
+    # fix any image anchors
+    aa = temproot.findall(".//a")
+    for a in aa:
+        ahref = a.get("href")
+        if not ahref == None and isImage(ahref):
+            del a.attrib['href']
+
+
+    # turn any leading or trailing text into paragraph elements
+    nl = 0
+    # look for leading text in root element
+    if not temproot.text==None:
+        if debugMode():
+          print("TEXT:",len(temproot.text))
+          print(temproot.text)
+        # convert the text to paragraphs
+        elist = makeParagraphs(temproot.text)
+
+        # replace the text with paragraphs
+        j = 0
+        for enew in elist:
+            if debugMode():
+              print("inserting text element",j)
+              print(tostring(enew))
+            temproot.insert(j,enew)
+            j=j+1
+        temproot.text = None
+
+    # look for trailing text in the last sub-element
+    elast = None
+    for e in temproot.iter():
+      elast = e
+      nl=nl+1
+
+    if not elast==None:
+     if not elast.tail==None:
+        if debugMode():
+          print("TAIL:",len(elast.tail))
+          print(elast.tail)
+        # convert the text to paragraphs
+        elist = makeParagraphs(elast.tail)
+
+        # replace the text with paragraphs
+        j = nl
+        for enew in elist:
+            if debugMode():
+              print("enew:")
+              print(tostring(enew))
+              print("inserting tail element",j)
+            temproot.insert(j,enew)
+            j=j+1
+        elast.tail = None
+
+
+    # replace the original text
+    stext = tostring(temproot).decode()
+
+    # filter the final text
+    stext = filterText(stext)
+
+    return {"text":stext,"srcs":srcs,"srcsets":srcsets,"notes":notes,"seconds":time.perf_counter()-start}
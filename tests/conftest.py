@@ -0,0 +1,54 @@
+###################################
+# PROLOG SECTION
+# conftest.py
+#
+# Shared set up of the tests. The scripts are modules in the
+# scripts directory, not a package, so it is put on the path.
+# The wpsite fixture serves a made up site with wpserver.py in a
+# thread of the test process.
+#
+###################################
+
+import os
+import sys
+import threading
+import pytest
+
+script_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"scripts")
+sys.path.insert(0,script_dir)
+
+import ditapub
+import wpserver
+
+# the scripts print their debugging output unless told not to
+ditapub.setdebug(False)
+
+#
+# Fixture to start wpserver.py sites. The fixture is a function
+# taking the site settings, returning the url of the site. The
+# sites are shut down after the test.
+#
+@pytest.fixture
+def wpsite():
+    servers = []
+
+    def start(posts=30,media=10,images=2,latency=0,multicall=True):
+        srv = wpserver.makeServer(0,multicall)
+        wpserver.site_url = "http://127.0.0.1:"+str(srv.server_address[1])
+        wpserver.site_posts = posts
+        wpserver.site_media = media
+        wpserver.site_images = images
+        wpserver.site_gallery = 5
+        wpserver.site_pages = 1
+        wpserver.site_seed = 1
+        wpserver.site_latency = latency
+        wpserver.site_capacity = 0
+        threading.Thread(target=srv.serve_forever,daemon=True).start()
+        servers.append(srv)
+        return wpserver.site_url
+
+    yield start
+
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
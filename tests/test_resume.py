@@ -0,0 +1,69 @@
+###################################
+# PROLOG SECTION
+# test_resume.py
+#
+# Test that a deconstructwp.py run killed part way through is
+# finished by a run with --resume, which skips the posts in the
+# journal and makes the whole manifest.
+#
+###################################
+
+import os
+import re
+import sys
+import time
+import subprocess
+from xml.etree.ElementTree import *
+
+script_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"scripts")
+
+#
+# Function to write the options file of a run in directory d
+#
+def writeOptions(d,url):
+    root = Element("options")
+    values = {"url":url,"user":"admin","password":"pw","outdir":"out","debug":"N","testmode":"N",
+              "maxretry":"1","retrysleep":"1","pagesize":"2","batchwindows":"1","rpcconcurrency":"1",
+              "transformworkers":"0"}
+    for k in values:
+        SubElement(root,k).text = values[k]
+    ElementTree(root).write(os.path.join(d,"options.xml"),encoding="UTF-8")
+
+#
+# Function to start deconstructwp.py in directory d
+#
+def startRun(d,*args):
+    env = dict(os.environ)
+    env.update({"OS":"test","COMPUTERNAME":"test","USERNAME":"test"})
+    log = open(os.path.join(d,"log"+str(len(args))+".txt"),"w")
+    return subprocess.Popen([sys.executable,os.path.join(script_dir,"deconstructwp.py")]+list(args),
+                            cwd=d,env=env,stdout=log,stderr=subprocess.STDOUT)
+
+def test_resume_after_kill(wpsite,tmp_path):
+    # slow enough that the run can be killed after some posts
+    url = wpsite(posts=100,latency=0.1)
+    d = str(tmp_path)
+    writeOptions(d,url)
+    journal = os.path.join(d,"deconstructwp.journal")
+
+    p = startRun(d)
+    deadline = time.time()+60
+    while p.poll() == None and time.time()<deadline:
+        if os.path.exists(journal) and "<post " in open(journal,encoding="utf-8").read():
+            break
+        time.sleep(0.05)
+    assert p.poll() == None, "the run ended before it could be killed"
+    p.kill()
+    p.wait()
+    assert not os.path.exists(os.path.join(d,"manifestwp.xml"))
+
+    p = startRun(d,"--resume")
+    assert p.wait(120) == 0
+    log = open(os.path.join(d,"log1.txt"),encoding="utf-8").read()
+    done = int(re.search(r"(\d+) posts were already done",log).group(1))
+    assert done>0
+
+    ids = [e.get("id") for e in ElementTree().parse(os.path.join(d,"manifestwp.xml")).iter("node")]
+    # the posts and the one page
+    assert sorted(ids) == sorted([str(i) for i in range(1,101)]+["1100"])
+    assert not os.path.exists(journal)
@@ -0,0 +1,106 @@
+###################################
+# PROLOG SECTION
+# test_wprpc.py
+#
+# Tests of the asynchronous XML-RPC transport of wprpc.py
+# against a wpserver.py site: results, faults, protocol errors
+# and batches with and without system.multicall.
+#
+###################################
+
+import xmlrpc.client
+import pytest
+import wprpc
+import wpserver
+
+#
+# Fixture to start the transport on a wpserver.py site. The
+# fixture is a function taking the site settings and the path
+# of the endpoint, returning the url of the site.
+#
+@pytest.fixture
+def rpc(wpsite):
+    def start(path="/xmlrpc.php",**site):
+        url = wpsite(**site)
+        wprpc.startAsync(url+path)
+        return url
+
+    yield start
+
+    wprpc.stopAsync()
+    wprpc.set_multicall(False)
+
+#
+# Function to run a coroutine on the transport and wait for it
+#
+def run(coro):
+    return wprpc.runAsync(coro).result(30)
+
+#
+# Function to return the wp.getUser calls of a batch
+#
+def userCalls(ids):
+    return [("wp.getUser",(1,"admin","pw",id)) for id in ids]
+
+def test_acall_returns_the_result(rpc):
+    rpc()
+    user = run(wprpc.acall("wp.getUser",1,"admin","pw","2"))
+    assert user["display_name"] == "Bob"
+
+def test_acall_raises_a_fault(rpc):
+    rpc()
+    with pytest.raises(xmlrpc.client.Fault) as err:
+        run(wprpc.acall("wp.getUser",1,"admin","pw","99"))
+    assert err.value.faultCode == 404
+
+def test_acall_raises_a_protocol_error(rpc):
+    rpc(path="/not-xmlrpc.php")
+    with pytest.raises(xmlrpc.client.ProtocolError) as err:
+        run(wprpc.acall("wp.getUser",1,"admin","pw","1"))
+    assert err.value.errcode == 404
+
+def test_abatch_uses_one_multicall_request(rpc):
+    rpc()
+    wprpc.set_multicall(True)
+    before = wpserver.getStats()
+    rets = run(wprpc.abatch(userCalls(["1","2","99","3"])))
+    after = wpserver.getStats()
+
+    assert [r["display_name"] for r in rets if isinstance(r,dict)] == ["Alice","Bob","Zoë"]
+    assert isinstance(rets[2],xmlrpc.client.Fault)
+    assert rets[2].faultCode == 404
+    assert after["rpc_requests"]-before["rpc_requests"] == 1
+
+def test_abatch_splits_multicalls_by_batch_size(rpc):
+    rpc()
+    wprpc.set_multicall(True)
+    size = wprpc.get_batch_size()
+    wprpc.set_batch_size(2)
+    try:
+        before = wpserver.getStats()
+        rets = run(wprpc.abatch(userCalls(["1","2","3","1","2"])))
+        after = wpserver.getStats()
+    finally:
+        wprpc.set_batch_size(size)
+
+    assert [r["user_id"] for r in rets] == ["1","2","3","1","2"]
+    assert after["rpc_requests"]-before["rpc_requests"] == 3
+
+def test_abatch_falls_back_to_single_calls_without_multicall(rpc):
+    rpc(multicall=False)
+    wprpc.set_multicall(True)
+    before = wpserver.getStats()
+    rets = run(wprpc.abatch(userCalls(["1","2","99","3"])))
+    after = wpserver.getStats()
+
+    assert [r["display_name"] for r in rets if isinstance(r,dict)] == ["Alice","Bob","Zoë"]
+    assert isinstance(rets[2],xmlrpc.client.Fault)
+    # multicall is not tried again
+    assert not wprpc.get_multicall()
+    # the refused multicall and one request per call
+    assert after["rpc_requests"]-before["rpc_requests"] == 5
+
+def test_abatch_single_calls(rpc):
+    rpc()
+    rets = run(wprpc.abatch(userCalls(["3","1"])))
+    assert [r["display_name"] for r in rets] == ["Zoë","Alice"]